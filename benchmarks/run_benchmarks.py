@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from db import sqlite_client
+from service import data_organizer, spi_matcher
+from service.scrappers import clubelo_scrapper, fbref_scraper, sofifa_scraper
+from service.scrappers.http_cache import HttpCache
+from service.team_registry import TeamRegistry
+
+BENCHMARK_RESULTS_PATH = 'benchmarks/results'
+REPEATS = 3
+# Pages of every kind the parser benchmarks parse
+PARSER_PAGES = 20
+# A benchmark this many times slower than in the compared results is reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+class Timer:
+    """ adds up the time spent in its with blocks, so a benchmark can leave its own setup out """
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds += time.perf_counter() - self.start
+
+
+class BenchmarkData:
+    """
+    The synthetic inputs of a scale, written where the pipeline reads them from: the FIFA ratings, odds and SPI files
+    under work_path and a database with the matches, their lineups and the Elo snapshots.
+    """
+
+    def __init__(self, scale, seed, work_path, http_cache_path=None):
+        self.work_path = work_path
+        self.matches_df = synthetic.generate_matches(scale, seed)
+        self.fifa_tables = synthetic.generate_fifa_ratings(seed)
+        self.lineups_df = synthetic.generate_lineups(self.matches_df, self.fifa_tables, seed)
+
+        data_organizer.FIFA_PATH = self.write_csvs('fifa', {f'{edition}_ratings.csv': fifa_df for edition, fifa_df in
+                                                            self.fifa_tables.items()})
+        data_organizer.BETS_PATH = self.write_csvs('bets', synthetic.generate_bets(self.matches_df, seed))
+        spi_matcher.SPI_MATCHES_PATH = os.path.join(self.write_csvs(
+            'soccer-spi', {'spi_matches.csv': synthetic.generate_spi_matches(self.matches_df, seed)}), 'spi_matches.csv')
+
+        self.db_client = open_database(os.path.join(work_path, 'matches.db'))
+        persist_all(self.db_client, self.matches_df, self.lineups_df)
+        for date, elo_df in synthetic.generate_elo_snapshots(self.matches_df, seed).items():
+            self.db_client.persist_elo_snapshot(date, elo_df)
+
+        if http_cache_path is None:
+            self.match_reports, self.schedules, self.sofifa_pages = self.synthetic_pages()
+        else:
+            self.match_reports, self.schedules, self.sofifa_pages = load_cached_pages(http_cache_path)
+
+    def write_csvs(self, folder, frames):
+        path = os.path.join(self.work_path, folder)
+        os.makedirs(path, exist_ok=True)
+        for filename, df in frames.items():
+            df.to_csv(os.path.join(path, filename), index=False)
+        return path
+
+    def synthetic_pages(self):
+        match_reports = []
+        for game_id, home, away in zip(*(self.matches_df[column].iloc[:PARSER_PAGES] for column in
+                                         ['Game ID', 'Home', 'Away'])):
+            lineups_df = self.lineups_df[self.lineups_df['match_id'] == game_id]
+            match_reports.append(synthetic.fbref_match_report_html(home, away, lineups_df[lineups_df['is_home'] == 1],
+                                                                   lineups_df[lineups_df['is_home'] == 0]))
+
+        schedules = [(synthetic.fbref_schedule_html(season_df), league, season) for (league, season), season_df in
+                     list(self.matches_df.groupby(['League', 'Season'], sort=True))[:PARSER_PAGES]]
+
+        fifa_df = self.fifa_tables[synthetic.FIFA_EDITIONS[-1]]
+        page_size = sofifa_scraper.SOFIFA_PLAYERS_PER_PAGE
+        sofifa_pages = [synthetic.sofifa_page_html(fifa_df.iloc[start:start + page_size]) for start in
+                        range(0, PARSER_PAGES * page_size, page_size)]
+        return match_reports, schedules, sofifa_pages
+
+
+def load_cached_pages(http_cache_path):
+    """ the match reports, schedules and SoFIFA pages saved in an http cache, up to PARSER_PAGES of each """
+    http_cache = HttpCache(http_cache_path, mode='replay')
+    match_reports = [http_cache.get(url) for url in http_cache.find_urls('fbref', '/en/matches/')[:PARSER_PAGES]]
+
+    schedules = []
+    for url in http_cache.find_urls('fbref', '/schedule/')[:PARSER_PAGES]:
+        # .../en/comps/9/2019-2020/schedule/2019-2020-Premier-League-Scores-and-Fixtures
+        season = url.split('/')[-3]
+        league = url.split('/')[-1][len(season) + 1:-len('-Scores-and-Fixtures')]
+        schedules.append((http_cache.get(url), league, season))
+
+    sofifa_pages = [http_cache.get(url) for url in http_cache.find_urls('sofifa')[:PARSER_PAGES]]
+    return match_reports, schedules, sofifa_pages
+
+
+def open_database(path):
+    sqlite_client.DB_NAME = path
+    return sqlite_client.SQLiteClient()
+
+
+def persist_all(db_client, matches_df, lineups_df):
+    db_client.persist_matches(matches_df)
+    db_client.add_elo_columns_if_not_exists()
+    db_client.update_many_elo_ratings(list(zip(matches_df['home_elo'], matches_df['away_elo'],
+                                               matches_df['Game ID'].astype(str))))
+    db_client.commit_changes()
+    persist_lineups(db_client, lineups_df)
+
+
+def persist_lineups(db_client, lineups_df, timer=None):
+    """ persists every lineup in its own transaction, as the scraper does, timing only the inserts """
+    keys = lineups_df['match_id'].to_numpy() * 2 + lineups_df['is_home'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], len(lineups_df)]):
+        lineup_df = lineups_df.iloc[start:end]
+        match_id, is_home = int(lineup_df['match_id'].iloc[0]), int(lineup_df['is_home'].iloc[0])
+        with timer or Timer():
+            db_client.persist_players(lineup_df, match_id, is_home)
+
+
+def bench_db_write_matches(data, timer):
+    db_client = open_database(os.path.join(data.work_path, f'write-matches-{time.time_ns()}.db'))
+    with timer:
+        db_client.persist_matches(data.matches_df)
+    return len(data.matches_df)
+
+
+def bench_db_write_players(data, timer):
+    db_client = open_database(os.path.join(data.work_path, f'write-players-{time.time_ns()}.db'))
+    persist_lineups(db_client, data.lineups_df, timer)
+    return len(data.lineups_df)
+
+
+def bench_db_read_matches(data, timer):
+    with timer:
+        matches_df = data.db_client.find_all_matches()
+    return len(matches_df)
+
+
+def bench_db_read_players(data, timer):
+    with timer:
+        players_df = data.db_client.find_players_by_match_ids(data.matches_df['Game ID'].tolist())
+    return len(players_df)
+
+
+def bench_add_bets(data, timer):
+    matches_df = data.db_client.find_all_matches()
+    with timer:
+        data_organizer.add_bets(matches_df, TeamRegistry(data.db_client))
+    return len(matches_df)
+
+
+def bench_add_players_data(data, timer, players_executor='thread'):
+    matches_df = data.db_client.find_all_matches()
+    data_organizer.find_player.cache_clear()
+    with timer:
+        data_organizer.add_players_data(matches_df, data.db_client, players_executor)
+    return len(matches_df)
+
+
+def bench_add_spi_data(data, timer):
+    matches_df = data.db_client.find_all_matches()
+    with timer:
+        spi_matcher.add_fivethirtyeight_spi_data(matches_df, TeamRegistry(data.db_client))
+    return len(matches_df)
+
+
+def bench_add_aggregated_data(data, timer):
+    matches_df = data.db_client.find_all_matches()
+    with timer:
+        data_organizer.add_aggregated_data(matches_df)
+    return len(matches_df)
+
+
+def bench_clubelo(data, timer):
+    """ the Elo ratings of every match from the snapshot store, nothing is downloaded """
+    with timer:
+        clubelo_scrapper.scrap_clubelo_to_database(data.db_client)
+    return len(data.matches_df)
+
+
+def bench_parse_fbref_match_reports(data, timer):
+    with timer:
+        for match_html in data.match_reports:
+            fbref_scraper.get_players_data(match_html)
+    return len(data.match_reports)
+
+
+def bench_parse_fbref_schedules(data, timer):
+    with timer:
+        for html, league, season in data.schedules:
+            fbref_scraper.parse_matches_page(html, league, season)
+    return len(data.schedules)
+
+
+def bench_parse_sofifa_pages(data, timer):
+    players = 0
+    with timer:
+        for html in data.sofifa_pages:
+            players += len(sofifa_scraper.parse_players_page(html))
+    return players
+
+
+BENCHMARKS = {
+    'db_write_matches': bench_db_write_matches,
+    'db_write_players': bench_db_write_players,
+    'db_read_matches': bench_db_read_matches,
+    'db_read_players': bench_db_read_players,
+    'add_bets': bench_add_bets,
+    'add_players_data': bench_add_players_data,
+    'add_spi_data': bench_add_spi_data,
+    'add_aggregated_data': bench_add_aggregated_data,
+    'clubelo': bench_clubelo,
+    'parse_fbref_match_reports': bench_parse_fbref_match_reports,
+    'parse_fbref_schedules': bench_parse_fbref_schedules,
+    'parse_sofifa_pages': bench_parse_sofifa_pages,
+}
+
+
+def run_benchmarks(data, benchmarks, repeats=REPEATS):
+    """ {name: result} of the {name: benchmark} given, every benchmark runs repeats times and keeps its fastest run """
+    results = {}
+    for name, benchmark in benchmarks.items():
+        runs = []
+        for _ in range(repeats):
+            timer = Timer()
+            rows = benchmark(data, timer)
+            runs.append(timer.seconds)
+        seconds = min(runs)
+        results[name] = {'seconds': round(seconds, 4), 'rows': rows,
+                         'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None,
+                         'runs': [round(run, 4) for run in runs]}
+        print(f'{name}: {seconds:.3f}s for {rows} rows')
+    return results
+
+
+def get_commit():
+    """ the short hash of HEAD, with -dirty when tracked files have changes """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                 text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if changes else commit
+
+
+def save_results(results, scale, path=None):
+    commit = get_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'scale': scale,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'benchmarks': results
+    }
+    path = path or os.path.join(BENCHMARK_RESULTS_PATH, f'{commit}-x{scale:g}.json')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results saved to {path}')
+    return report
+
+
+def compare_results(report, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """ prints the time of every benchmark against the baseline, returns the names of the regressions """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['scale'] != report['scale']:
+        print(f'Warning: comparing scale {report["scale"]:g} with scale {baseline["scale"]:g}')
+
+    regressions = []
+    print(f'{"benchmark":<28}{baseline["commit"]:>16}{report["commit"]:>16}{"ratio":>8}')
+    for name, result in report['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        baseline_seconds = baseline['benchmarks'][name]['seconds']
+        ratio = result['seconds'] / baseline_seconds if baseline_seconds > 0 else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  slower'
+        print(f'{name:<28}{baseline_seconds:>15.3f}s{result["seconds"]:>15.3f}s{ratio:>8.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times the pipeline steps, the database access and the scraper parsers on synthetic data. Run '
+                    'from the repository root: python -m benchmarks.run_benchmarks --scale 1')
+    parser.add_argument('--scale', type=float, default=1,
+                        help=f'size of the data, 1 is about {synthetic.MATCHES_PER_SCALE} matches')
+    parser.add_argument('--repeat', type=int, default=REPEATS, help='runs of every benchmark, the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), metavar='BENCHMARK',
+                        help=f'run only this benchmark, can be repeated, one of {", ".join(BENCHMARKS)}')
+    parser.add_argument('--players-executor', choices=data_organizer.PLAYERS_EXECUTORS, default='thread')
+    parser.add_argument('--http-cache', help='parse the pages saved in this http cache instead of synthetic pages')
+    parser.add_argument('--output', help='where the results are written, by default under '
+                                         f'{BENCHMARK_RESULTS_PATH} named after the commit and the scale')
+    parser.add_argument('--compare', help='results of an earlier run to compare with, exits with 1 on a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_path:
+        print(f'Generating the data of scale {args.scale:g}')
+        data = BenchmarkData(args.scale, args.seed, work_path, args.http_cache)
+        benchmarks = {name: BENCHMARKS[name] for name in args.only or BENCHMARKS}
+        if 'add_players_data' in benchmarks:
+            benchmarks['add_players_data'] = partial(bench_add_players_data, players_executor=args.players_executor)
+        results = run_benchmarks(data, benchmarks, args.repeat)
+        data.db_client.close()
+
+    report = save_results(results, args.scale, args.output)
+    if args.compare and compare_results(report, args.compare):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
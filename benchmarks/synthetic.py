@@ -0,0 +1,386 @@
+from datetime import date, timedelta
+from html import escape
+
+import numpy as np
+import pandas as pd
+
+from db.datamodels.match import make_game_id, make_match_key
+from db.datamodels.player import PLAYER_SCRAPED_COLUMNS
+from service.spi_matcher import SPI_COLUMNS
+
+# Scale 1 is about the size of the real data: five leagues over five seasons
+MATCHES_PER_SCALE = 9000
+SEASONS = ['2019-2020', '2020-2021', '2021-2022', '2022-2023', '2023-2024']
+FIFA_EDITIONS = ['fifa_19', 'fifa_20', 'fifa_21', 'fifa_22', 'fifa_23', 'fifa_24']
+TEAMS_PER_LEAGUE = 20
+SQUAD_SIZE = 25
+LINEUP_SIZE = 14
+# The FIFA tables and the Elo snapshots have the size of the real ones whatever the scale
+FIFA_PLAYERS_PER_EDITION = 19000
+ELO_CLUBS_PER_SNAPSHOT = 600
+# Share of the lineup players whose FBref name is not in the FIFA table
+UNKNOWN_PLAYER_SHARE = 0.1
+# Rows of other leagues in the SPI file for every row of ours
+SPI_OTHER_LEAGUES_ROWS = 2
+MATCH_TIMES = ['13:30', '15:00', '17:30', '20:00']
+NAME_SYLLABLES = ['ka', 'ro', 'lin', 'de', 'mar', 'to', 'vi', 'an', 'sa', 'el', 'mi', 'go', 'ber', 'nu', 'ta', 'lo',
+                  'ri', 'chi', 'po', 'za', 'fer', 'dan', 'ko', 'le', 'sto', 'ju', 'ra', 'ne', 'is', 'val']
+SUMMARY_COLUMNS = [
+    ('', 'Player'), ('', '#'), ('', 'Nation'), ('', 'Pos'), ('', 'Age'), ('', 'Min'),
+    ('Performance', 'Gls'), ('Performance', 'Ast'), ('Performance', 'PK'), ('Performance', 'PKatt'),
+    ('Performance', 'Sh'), ('Performance', 'SoT'), ('Performance', 'CrdY'), ('Performance', 'CrdR'),
+    ('Performance', 'Touches'), ('Performance', 'Tkl'), ('Performance', 'Int'), ('Performance', 'Blocks'),
+    ('Expected', 'xG'), ('Expected', 'npxG'), ('Expected', 'xAG'), ('SCA', 'SCA'), ('SCA', 'GCA'),
+    ('Passes', 'Cmp'), ('Passes', 'Att'), ('Passes', 'Cmp%'), ('Passes', 'PrgP'), ('Carries', 'Carries'),
+    ('Carries', 'PrgC'), ('Take-Ons', 'Att'), ('Take-Ons', 'Succ')
+]
+KEEPER_COLUMNS = [
+    ('', 'Player'), ('', 'Nation'), ('', 'Age'), ('', 'Min'), ('Shot Stopping', 'SoTA'), ('Shot Stopping', 'GA'),
+    ('Shot Stopping', 'Saves'), ('Shot Stopping', 'Save%'), ('Shot Stopping', 'PSxG'), ('Launched', 'Cmp'),
+    ('Launched', 'Att'), ('Launched', 'Cmp%'), ('Passes', 'Att (GK)'), ('Passes', 'Thr'), ('Passes', 'Launch%'),
+    ('Passes', 'AvgLen'), ('Crosses', 'Opp'), ('Crosses', 'Stp'), ('Crosses', 'Stp%'), ('Sweeper', '#OPA'),
+    ('Sweeper', 'AvgDist')
+]
+# The other player tables of a match report, by the suffix of their id, with the number of stat columns they have
+OTHER_PLAYER_TABLES = {'passing': 23, 'passing_types': 18, 'defense': 16, 'possession': 22, 'misc': 16}
+PLAYER_ID_COLUMNS = [('', 'Player'), ('', '#'), ('', 'Nation'), ('', 'Pos'), ('', 'Age'), ('', 'Min')]
+SCHEDULE_COLUMNS = ['Wk', 'Day', 'Date', 'Time', 'Home', 'xG', 'Score', 'xG', 'Away', 'Attendance', 'Venue',
+                    'Referee', 'Match Report', 'Notes']
+# The data-stat attribute FBref gives to the cells of every schedule column
+SCHEDULE_DATA_STATS = ['gameweek', 'dayofweek', 'date', 'start_time', 'home_team', 'home_xg', 'score', 'away_xg',
+                       'away_team', 'attendance', 'venue', 'referee', 'match_report', 'notes']
+# Navigation links around the tables, the parsers that read the whole page go through them as well
+PAGE_FILLER_LINKS = 1500
+
+
+def make_name(rng, syllables):
+    return ''.join(rng.choice(NAME_SYLLABLES, syllables)).capitalize()
+
+
+def make_distinct_names(rng, count, make):
+    names = set()
+    while len(names) < count:
+        names.add(make())
+    return sorted(names)
+
+
+def make_person_names(rng, count):
+    """ count distinct 'First Last' names """
+    return make_distinct_names(rng, count,
+                               lambda: f'{make_name(rng, rng.integers(2, 4))} {make_name(rng, rng.integers(2, 5))}')
+
+
+def make_league_names(count):
+    return [f'League-{i + 1}' for i in range(count)]
+
+
+def make_team_names(rng, league_names):
+    """ {league: team names}, distinct over all the leagues """
+    names = make_distinct_names(rng, len(league_names) * TEAMS_PER_LEAGUE, lambda: make_name(rng, rng.integers(2, 4)))
+    rng.shuffle(names)
+    names = iter(names)
+    return {league: [f'FC {next(names)}' if i % 2 else f'{next(names)} United' for i in range(TEAMS_PER_LEAGUE)]
+            for league in league_names}
+
+
+def round_robin(teams):
+    """ the rounds of a double round robin, as lists of (home, away) """
+    teams = list(teams)
+    rounds = []
+    for _ in range(len(teams) - 1):
+        rounds.append([(teams[i], teams[-i - 1]) for i in range(len(teams) // 2)])
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    return rounds + [[(away, home) for home, away in matches] for matches in rounds]
+
+
+def generate_matches(scale=1, seed=0):
+    """
+    About scale * MATCHES_PER_SCALE matches with the columns find_all_matches returns, ordered by date and time. The
+    goals, xG and Elo ratings follow a hidden strength of the teams.
+    """
+    rng = np.random.default_rng(seed)
+    match_count = max(1, round(scale * MATCHES_PER_SCALE))
+    matches_per_league = len(SEASONS) * TEAMS_PER_LEAGUE * (TEAMS_PER_LEAGUE - 1)
+    league_names = make_league_names(-(-match_count // matches_per_league))
+    team_names = make_team_names(rng, league_names)
+    strengths = {team: rng.normal(0, 0.35) for teams in team_names.values() for team in teams}
+
+    rows = []
+    for league in league_names:
+        for season in SEASONS:
+            first_day = date(int(season[:4]), 8, 10)
+            for week, matches in enumerate(round_robin(team_names[league])):
+                for i, (home, away) in enumerate(matches):
+                    match_date = first_day + timedelta(days=7 * week + i % 3)
+                    rows.append((week + 1, match_date, MATCH_TIMES[i % len(MATCH_TIMES)], home, away, league, season))
+    rows = rows[:match_count]
+
+    matches_df = pd.DataFrame(rows, columns=['Wk', 'Date', 'Time', 'Home', 'Away', 'League', 'Season'])
+    home_strength = matches_df['Home'].map(strengths).to_numpy() + 0.25
+    away_strength = matches_df['Away'].map(strengths).to_numpy()
+    xg_home = np.exp(0.3 + home_strength - away_strength)
+    xg_away = np.exp(0.3 + away_strength - home_strength)
+
+    matches_df['Day'] = [match_date.strftime('%a') for match_date in matches_df['Date']]
+    matches_df['Date'] = [match_date.isoformat() for match_date in matches_df['Date']]
+    matches_df['xG Home'] = np.round(xg_home * rng.uniform(0.7, 1.3, len(matches_df)), 1)
+    matches_df['xG Away'] = np.round(xg_away * rng.uniform(0.7, 1.3, len(matches_df)), 1)
+    matches_df['G Home'] = rng.poisson(xg_home)
+    matches_df['G Away'] = rng.poisson(xg_away)
+    matches_df['Score'] = np.sign(matches_df['G Home'] - matches_df['G Away'])
+    matches_df['Game ID'] = [make_game_id(make_match_key(*key)) for key in
+                             zip(matches_df['League'], matches_df['Season'], matches_df['Date'], matches_df['Home'],
+                                 matches_df['Away'])]
+    matches_df['Match Link'] = [make_match_link(game_id, home, away, match_date, league) for
+                                game_id, home, away, match_date, league in
+                                zip(matches_df['Game ID'], matches_df['Home'], matches_df['Away'], matches_df['Date'],
+                                    matches_df['League'])]
+    matches_df['home_elo'] = np.round(1650 + 400 * home_strength, 1)
+    matches_df['away_elo'] = np.round(1650 + 400 * away_strength, 1)
+    matches_df['Wk'] = matches_df['Wk'].astype(float)
+
+    columns = ['Game ID', 'Wk', 'Day', 'Date', 'Time', 'Home', 'xG Home', 'G Home', 'Away', 'xG Away', 'G Away',
+               'League', 'Season', 'Score', 'Match Link', 'home_elo', 'away_elo']
+    matches_df = matches_df[columns].sort_values(['Date', 'Time'], kind='stable', ignore_index=True)
+    return matches_df
+
+
+def make_match_link(game_id, home, away, match_date, league):
+    day = date.fromisoformat(match_date)
+    link_date = f'{day:%B}-{day.day}-{day.year}'
+    return f'https://fbref.com/en/matches/{game_id:08x}/{home}-{away}-{link_date}-{league}'.replace(' ', '-')
+
+
+def generate_fifa_ratings(seed=0, players_per_edition=FIFA_PLAYERS_PER_EDITION):
+    """ {edition: ratings frame} with the columns of the SoFIFA tables, the same players in every edition """
+    rng = np.random.default_rng(seed)
+    names = make_person_names(rng, players_per_edition)
+    base_overall = np.clip(rng.normal(66, 7, players_per_edition), 47, 94)
+    ids = rng.choice(np.arange(100000, 300000), players_per_edition, replace=False)
+    teams = [f'FC {make_name(rng, 3)}' for _ in range(players_per_edition // SQUAD_SIZE + 1)]
+
+    fifa_tables = {}
+    for i, edition in enumerate(FIFA_EDITIONS):
+        overall = np.clip(np.round(base_overall + rng.normal(0, 2, players_per_edition)), 47, 94).astype(int)
+        fifa_df = pd.DataFrame({
+            'ID': ids,
+            'Name': names,
+            'Age': rng.integers(17, 38, players_per_edition) + i,
+            'Position': rng.choice(['GK', 'CB', 'LB', 'RB', 'CDM', 'CM', 'CAM', 'LW', 'RW', 'ST'], players_per_edition),
+            'Overall': overall,
+            'Potential': np.minimum(overall + rng.integers(0, 10, players_per_edition), 99),
+            'Team': [teams[row // SQUAD_SIZE] for row in range(players_per_edition)]
+        })
+        fifa_tables[edition] = fifa_df.sort_values('Overall', ascending=False, kind='stable', ignore_index=True)
+    return fifa_tables
+
+
+def generate_lineups(matches_df, fifa_tables, seed=0):
+    """
+    The scraped lineups of the matches as one frame with the columns of PLAYER_SCRAPED_COLUMNS plus match_id and
+    is_home, ordered by match and home before away. Every team plays with players of its squad, which are picked from
+    the FIFA table of the season, and UNKNOWN_PLAYER_SHARE of them have a name FIFA does not know.
+    """
+    rng = np.random.default_rng(seed)
+    fifa_names = np.array(next(iter(fifa_tables.values()))['Name'])
+    unknown_names = np.array(make_person_names(rng, len(fifa_names) // 10))
+    squads = {}
+
+    def squad(team, season):
+        if (team, season) not in squads:
+            is_unknown = rng.random(SQUAD_SIZE) < UNKNOWN_PLAYER_SHARE
+            squads[(team, season)] = np.where(is_unknown, rng.choice(unknown_names, SQUAD_SIZE),
+                                              rng.choice(fifa_names, SQUAD_SIZE, replace=False))
+        return squads[(team, season)]
+
+    names = []
+    match_ids = []
+    is_home = []
+    for game_id, home, away, season in zip(matches_df['Game ID'], matches_df['Home'], matches_df['Away'],
+                                           matches_df['Season']):
+        for team, team_is_home in [(home, 1), (away, 0)]:
+            names.extend(rng.choice(squad(team, season), LINEUP_SIZE, replace=False))
+            match_ids.extend([int(game_id)] * LINEUP_SIZE)
+            is_home.extend([team_is_home] * LINEUP_SIZE)
+
+    row_count = len(names)
+    lineups_df = pd.DataFrame({
+        'Player': names,
+        '#': rng.integers(1, 40, row_count),
+        'Nation': rng.choice(['eng ENG', 'es ESP', 'fr FRA', 'de GER', 'it ITA', 'br BRA'], row_count),
+        'Pos': rng.choice(['GK', 'DF', 'MF', 'FW', 'DF,MF', 'FW,MF'], row_count),
+        'Age': [f'{years}-{days:03d}' for years, days in
+                zip(rng.integers(17, 38, row_count), rng.integers(0, 365, row_count))],
+        'Min': rng.integers(1, 91, row_count),
+    })
+    for column in PLAYER_SCRAPED_COLUMNS.values():
+        if column not in lineups_df.columns:
+            lineups_df[column] = rng.integers(0, 5, row_count)
+    for column in ['xG', 'npxG', 'xAG', 'Cmp%_x']:
+        lineups_df[column] = np.round(rng.random(row_count) * (100 if column == 'Cmp%_x' else 1), 1)
+    lineups_df['match_id'] = match_ids
+    lineups_df['is_home'] = is_home
+    return lineups_df
+
+
+def generate_elo_snapshots(matches_df, seed=0):
+    """
+    {date: Elo ratings of the clubs on that date} for every match date, the teams of the matches together with other
+    clubs up to ELO_CLUBS_PER_SNAPSHOT
+    """
+    rng = np.random.default_rng(seed)
+    teams = sorted(set(matches_df['Home']) | set(matches_df['Away']))
+    clubs = teams + [f'{make_name(rng, 3)} {make_name(rng, 2)}' for _ in range(ELO_CLUBS_PER_SNAPSHOT - len(teams))]
+    elo = rng.normal(1600, 150, len(clubs))
+
+    snapshots = {}
+    for match_date in sorted(matches_df['Date'].unique()):
+        elo = elo + rng.normal(0, 5, len(clubs))
+        snapshots[match_date] = pd.DataFrame({
+            'Rank': np.arange(1, len(clubs) + 1),
+            'Club': clubs,
+            'Country': 'SYN',
+            'Level': 1,
+            'Elo': np.round(elo, 2),
+        })
+    return snapshots
+
+
+def generate_spi_matches(matches_df, seed=0):
+    """ a FiveThirtyEight SPI file covering the matches, mixed with rows of other leagues """
+    rng = np.random.default_rng(seed)
+    other_count = SPI_OTHER_LEAGUES_ROWS * len(matches_df)
+    other_teams = [f'{make_name(rng, 3)} SC' for _ in range(200)]
+    dates = pd.concat([matches_df['Date']] * (SPI_OTHER_LEAGUES_ROWS + 1), ignore_index=True)
+    spi_df = pd.DataFrame({
+        'season': dates.str[:4],
+        'date': dates,
+        'league': ['Synthetic League'] * len(matches_df) + ['Other League'] * other_count,
+        'team1': list(matches_df['Home']) + list(rng.choice(other_teams, other_count)),
+        'team2': list(matches_df['Away']) + list(rng.choice(other_teams, other_count)),
+    })
+    for column in SPI_COLUMNS:
+        spi_df[column] = np.round(rng.random(len(spi_df)) * 100, 2)
+    return spi_df.sort_values('date', kind='stable', ignore_index=True)
+
+
+def generate_bets(matches_df, seed=0):
+    """ {file name: football-data odds of a league season} covering the matches """
+    rng = np.random.default_rng(seed)
+    home_odds = np.round(rng.uniform(1.2, 6, len(matches_df)), 2)
+    bets_df = pd.DataFrame({
+        'Div': matches_df['League'],
+        'Date': pd.to_datetime(matches_df['Date']).dt.strftime('%d/%m/%Y'),
+        'Time': matches_df['Time'],
+        'HomeTeam': matches_df['Home'],
+        'AwayTeam': matches_df['Away'],
+        'FTHG': matches_df['G Home'],
+        'FTAG': matches_df['G Away'],
+        'FTR': np.select([matches_df['Score'] > 0, matches_df['Score'] < 0], ['H', 'A'], 'D'),
+        'B365H': home_odds,
+        'B365D': np.round(rng.uniform(2.8, 4.5, len(matches_df)), 2),
+        'B365A': np.round(np.maximum(1.1, 7.5 - home_odds), 2),
+    })
+    return {f'{league}-{season}.csv': season_df for (league, season), season_df in
+            bets_df.groupby([matches_df['League'], matches_df['Season']], sort=True)}
+
+
+def table_html(table_id, columns, rows, footer=None):
+    """ a stats table the way FBref writes them, with the column groups as the first header row """
+    groups = []
+    for group, _ in columns:
+        if groups and groups[-1][0] == group:
+            groups[-1][1] += 1
+        else:
+            groups.append([group, 1])
+    over_header = ''.join(f'<th colspan="{span}">{escape(group)}</th>' for group, span in groups)
+    header = ''.join(f'<th scope="col">{escape(name)}</th>' for _, name in columns)
+    body = ''.join('<tr>' + ''.join(f'<td>{escape(str(value))}</td>' for value in row) + '</tr>' for row in rows)
+    foot = '<tfoot><tr>' + ''.join(f'<td>{escape(str(value))}</td>' for value in footer) + '</tr></tfoot>' \
+        if footer is not None else ''
+    return (f'<div class="table_container"><table class="stats_table" id="{table_id}">'
+            f'<thead><tr class="over_header">{over_header}</tr><tr>{header}</tr></thead>'
+            f'<tbody>{body}</tbody>{foot}</table></div>')
+
+
+def page_html(title, content):
+    filler = ''.join(f'<li><a href="/en/squads/{i:08x}/">Link {i}</a></li>' for i in range(PAGE_FILLER_LINKS))
+    return (f'<!DOCTYPE html><html><head><title>{escape(title)}</title></head><body>'
+            f'<div id="header"><ul>{filler}</ul></div><div id="content">{content}</div></body></html>')
+
+
+def fbref_match_report_html(home, away, home_lineup_df, away_lineup_df, seed=0):
+    """
+    A match report with the tables of a real one in their order: the two lineups, the team stats, the six player
+    tables and the keeper table of each team, then the shots.
+    """
+    rng = np.random.default_rng(seed)
+    lineup_tables = ''.join(
+        f'<div class="lineup"><table><tr><th colspan="2">{escape(team)} (4-3-3)</th></tr>' +
+        ''.join(f'<tr><td>{number}</td><td><a>{escape(name)}</a></td></tr>' for number, name in
+                zip(lineup_df['#'], lineup_df['Player'])) + '</table></div>'
+        for team, lineup_df in [(home, home_lineup_df), (away, away_lineup_df)])
+    team_stats = ('<div id="team_stats"><table><tr><th colspan="2">Team Stats</th></tr>'
+                  '<tr><td>55%</td><td>45%</td></tr></table></div>')
+
+    player_tables = []
+    for squad_id, lineup_df in [('a1b2c3d4', home_lineup_df), ('e5f6a7b8', away_lineup_df)]:
+        id_rows = lineup_df[['Player', '#', 'Nation', 'Pos', 'Age', 'Min']].values.tolist()
+        # The lineups keep the summary columns except the attempts, which FBref has twice
+        summary_df = lineup_df[list(PLAYER_SCRAPED_COLUMNS.values())].copy()
+        summary_df.insert(summary_df.columns.get_loc('Cmp%_x'), 'Att', summary_df['Cmp_x'] + 3)
+        summary_df.insert(summary_df.columns.get_loc('Succ'), 'Take-Ons Att', summary_df['Succ'] + 1)
+        summary_rows = summary_df.values.tolist()
+        summary_footer = [f'{len(lineup_df)} Players', '', '', '', '', 990] + [0] * (len(SUMMARY_COLUMNS) - 6)
+        player_tables.append(table_html(f'stats_{squad_id}_summary', SUMMARY_COLUMNS, summary_rows, summary_footer))
+        for suffix, stat_count in OTHER_PLAYER_TABLES.items():
+            columns = PLAYER_ID_COLUMNS + [(suffix.title(), f'Stat{i}') for i in range(stat_count)]
+            rows = [row + rng.integers(0, 50, stat_count).tolist() for row in id_rows]
+            footer = [f'{len(lineup_df)} Players', '', '', '', '', 990] + [0] * stat_count
+            player_tables.append(table_html(f'stats_{squad_id}_{suffix}', columns, rows, footer))
+        keeper = lineup_df.iloc[0]
+        keeper_row = [keeper['Player'], keeper['Nation'], keeper['Age'], keeper['Min']] + \
+            rng.integers(0, 10, len(KEEPER_COLUMNS) - 4).tolist()
+        player_tables.append(table_html(f'keeper_stats_{squad_id}', KEEPER_COLUMNS, [keeper_row]))
+
+    shot_columns = [('', 'Minute'), ('', 'Player'), ('', 'Squad'), ('', 'xG'), ('', 'PSxG'), ('', 'Outcome')]
+    shot_tables = ''.join(
+        table_html(table_id, shot_columns, [[minute, 'Player', home, 0.1, 0.2, 'Saved'] for minute in range(1, 20)])
+        for table_id in ['shots_all', 'shots_a1b2c3d4', 'shots_e5f6a7b8'])
+
+    return page_html(f'{home} vs. {away} Match Report', lineup_tables + team_stats + ''.join(player_tables) +
+                     shot_tables)
+
+
+def fbref_schedule_html(season_matches_df):
+    """ the Scores & Fixtures page of a league season """
+    rows = []
+    for wk, day, match_date, time, home, xg_home, g_home, away, xg_away, g_away, match_link in zip(
+            *(season_matches_df[column] for column in ['Wk', 'Day', 'Date', 'Time', 'Home', 'xG Home', 'G Home',
+                                                       'Away', 'xG Away', 'G Away', 'Match Link'])):
+        values = [int(wk), day, match_date, time, home, xg_home, f'{g_home}–{g_away}', xg_away, away, 41000,
+                  'Stadium', 'Referee']
+        link = match_link.replace('https://fbref.com', '')
+        cells = [escape(str(value)) for value in values] + [f'<a href="{link}">Match Report</a>', '']
+        rows.append('<tr>' + ''.join(f'<td data-stat="{data_stat}">{cell}</td>'
+                                     for data_stat, cell in zip(SCHEDULE_DATA_STATS, cells)) + '</tr>')
+    header = ''.join(f'<th scope="col">{column}</th>' for column in SCHEDULE_COLUMNS)
+    table = (f'<table class="stats_table" id="sched_all"><thead><tr>{header}</tr></thead>'
+             f'<tbody>{"".join(rows)}</tbody></table>')
+    return page_html('Scores & Fixtures', table)
+
+
+def sofifa_page_html(fifa_df):
+    """ a page of the SoFIFA players list with the rows of fifa_df """
+    rows = []
+    for player in fifa_df.itertuples(index=False):
+        short_name = f'{player.Name[0]}. {player.Name.split()[-1]}'
+        rows.append(
+            f'<tr><td><img id="{player.ID}" src="/players/{player.ID}.png"/></td>'
+            f'<td>\n<a data-tippy-content="{escape(player.Name)}" href="/player/{player.ID}/">{escape(short_name)}</a>'
+            f'\n<a href="/players?na=1"><img src="/flags/1.png"/></a>'
+            f'<a href="/players?pn=1"><span class="pos">{player.Position}</span></a></td>'
+            f'<td>{player.Age}</td><td><em>{player.Overall}</em></td><td><em>{player.Potential}</em></td>'
+            f'<td>\n<img src="/teams/1.png"/>\n<a href="/team/1/">{escape(player.Team)}</a>\n</td></tr>')
+    table = f'<table><thead><tr><th>Name</th></tr></thead><tbody>{"".join(rows)}</tbody></table>'
+    return page_html('Players', table)
@@ -1,17 +1,77 @@
-class Match:
-    def __init__(self, game_id, wk, day, date, time, home, xg_home, g_home, away, xg_away, g_away, league, season, score, match_link):
-        self.game_id = game_id
-        self.wk = wk
-        self.day = day
-        self.date = date
-        self.time = time
-        self.home = home
-        self.xg_home = xg_home
-        self.g_home = g_home
-        self.away = away
-        self.xg_away = xg_away
-        self.g_away = g_away
-        self.league = league
-        self.season = season
-        self.score = score
-        self.match_link = match_link
+import hashlib
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+MATCH_KEY_SEPARATOR = '|'
+
+# Dtypes the matches frame is kept in, columns not listed keep the dtype pandas infers. Game ID and Wk are TEXT in the
+# matches table. xG stays float64, the rolling means of the xG differences are rounded to 2 decimals and float32 moves
+# some of them by 0.01. The goals are NULL until a match is played, hence the nullable Int8
+MATCH_DTYPES = {
+    'Game ID': 'int64', 'Wk': 'float64',
+    'Home': 'category', 'Away': 'category', 'League': 'category', 'Season': 'category',
+    'G Home': 'Int8', 'G Away': 'Int8', 'Score': 'Int8'
+}
+
+
+class Match(NamedTuple):
+    """ a row of the matches table, the fields are in the order of its columns """
+    game_id: int
+    wk: Optional[float]
+    day: str
+    date: str
+    time: str
+    home: str
+    xg_home: float
+    g_home: int
+    away: str
+    xg_away: float
+    g_away: int
+    league: str
+    season: str
+    score: int
+    match_link: str
+
+    @property
+    def match_key(self):
+        return make_match_key(self.league, self.season, self.date, self.home, self.away)
+
+    def to_db_row(self):
+        """ the values of the matches columns, followed by the match key """
+        return (*self, self.match_key)
+
+    @classmethod
+    def from_df(cls, matches_df):
+        """ yields a Match for every row of a frame with the columns of MATCH_FRAME_COLUMNS """
+        return map(cls._make, matches_df[list(MATCH_FRAME_COLUMNS.values())].itertuples(index=False, name=None))
+
+    @staticmethod
+    def to_df(matches):
+        return apply_dtypes(pd.DataFrame(list(matches), columns=list(MATCH_FRAME_COLUMNS.values())), MATCH_DTYPES)
+
+
+# Matches table column -> matches frame column
+MATCH_FRAME_COLUMNS = dict(zip(Match._fields, [
+    'Game ID', 'Wk', 'Day', 'Date', 'Time', 'Home', 'xG Home', 'G Home', 'Away', 'xG Away', 'G Away', 'League',
+    'Season', 'Score', 'Match Link'
+]))
+
+
+def apply_dtypes(df, dtypes):
+    """ casts the columns of df that have a dtype in dtypes, in place, and returns it """
+    for column, dtype in dtypes.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def make_match_key(league, season, date, home, away):
+    """ natural key of a match, the same fixture always gets the same key """
+    return MATCH_KEY_SEPARATOR.join([str(league), str(season), str(date), str(home), str(away)])
+
+
+def make_game_id(match_key):
+    """ deterministic 10 digits game id derived from the match key """
+    digest = int(hashlib.sha1(match_key.encode('utf-8')).hexdigest(), 16)
+    return 10 ** 9 + digest % (9 * 10 ** 9)
@@ -1,33 +1,85 @@
-class Player:
-    def __init__(self, player, number, nation, pos, age, minutes, goals, assists, pk, pk_att, shots, shots_on_target, crd_y, crd_r, touches, tackles, interceptions, blocks, xg, npxg, xag, sca, gca, cmp_x, cmp_pct_x, prgp, carries, prgc, succ_dribbles, match_id, is_home):
-        self.player = player
-        self.number = number
-        self.nation = nation
-        self.pos = pos
-        self.age = age
-        self.minutes = minutes
-        self.goals = goals
-        self.assists = assists
-        self.pk = pk
-        self.pk_att = pk_att
-        self.shots = shots
-        self.shots_on_target = shots_on_target
-        self.crd_y = crd_y
-        self.crd_r = crd_r
-        self.touches = touches
-        self.tackles = tackles
-        self.interceptions = interceptions
-        self.blocks = blocks
-        self.xg = xg
-        self.npxg = npxg
-        self.xag = xag
-        self.sca = sca
-        self.gca = gca
-        self.cmp_x = cmp_x
-        self.cmp_pct_x = cmp_pct_x
-        self.prgp = prgp
-        self.carries = carries
-        self.prgc = prgc
-        self.succ_dribbles = succ_dribbles
-        self.match_id = match_id
-        self.is_home = is_home
\ No newline at end of file
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+from db.datamodels.match import apply_dtypes
+
+# Compact dtypes the players frames are kept in, the counts are nullable as FBref leaves some of them empty
+PLAYER_DTYPES = {
+    'Number': 'Int8', 'Nation': 'category', 'Position': 'category', 'Age': 'Int8', 'Minutes Played': 'Int16',
+    'Goals': 'Int8', 'Assists': 'Int8', 'Penalty Kicks': 'Int8', 'Penalty Kicks Attempted': 'Int8', 'Shots': 'Int8',
+    'Shots On Target': 'Int8', 'Yellow Cards': 'Int8', 'Red Cards': 'Int8', 'Ball Touches': 'Int16',
+    'Tackles': 'Int8', 'Interceptions': 'Int8', 'Blocks': 'Int8', 'Expected Goals': 'float32',
+    'Non Penalty Expected Goals': 'float32', 'Expected Assists': 'float32', 'Shot Creating Actions': 'Int8',
+    'Goal Creating Actions': 'Int8', 'Passes Completed': 'Int16', 'Passes Completed Percentage': 'float32',
+    'Progressive Passes': 'Int16', 'Carries': 'Int16', 'Progressive Carries': 'Int16', 'Successful Dribbles': 'Int8',
+    'Game ID': 'int64', 'Is Home': 'int8'
+}
+
+
+class Player(NamedTuple):
+    """ a row of the players table, the fields are in the order of its columns """
+    player: str
+    number: Optional[int]
+    nation: Optional[str]
+    pos: Optional[str]
+    age: Optional[str]
+    minutes: Optional[int]
+    goals: Optional[int]
+    assists: Optional[int]
+    pk: Optional[int]
+    pk_att: Optional[int]
+    shots: Optional[int]
+    shots_on_target: Optional[int]
+    crd_y: Optional[int]
+    crd_r: Optional[int]
+    touches: Optional[int]
+    tackles: Optional[int]
+    interceptions: Optional[int]
+    blocks: Optional[int]
+    xg: Optional[float]
+    npxg: Optional[float]
+    xag: Optional[float]
+    sca: Optional[int]
+    gca: Optional[int]
+    cmp_x: Optional[int]
+    cmp_pct_x: Optional[float]
+    prgp: Optional[int]
+    carries: Optional[int]
+    prgc: Optional[int]
+    succ_dribbles: Optional[int]
+    match_id: int
+    is_home: int
+
+    def to_db_row(self):
+        return tuple(self)
+
+    @classmethod
+    def from_df(cls, players_df, match_id, is_home):
+        """ yields a Player for every row of a scraped lineup frame, which has the columns of PLAYER_SCRAPED_COLUMNS """
+        rows = players_df[list(PLAYER_SCRAPED_COLUMNS.values())].itertuples(index=False, name=None)
+        return (cls(*row, match_id, is_home) for row in rows)
+
+    @staticmethod
+    def to_df(players):
+        """ the frame of the players, with the columns of PLAYER_FRAME_COLUMNS in the dtypes of PLAYER_DTYPES """
+        players_df = pd.DataFrame(list(players), columns=list(PLAYER_FRAME_COLUMNS.values()))
+        # FBref gives the age as years-days, only the years are kept
+        players_df['Age'] = pd.to_numeric(players_df['Age'].astype(str).str.split('-').str[0], errors='coerce')
+        return apply_dtypes(players_df, PLAYER_DTYPES)
+
+
+# Players table column -> column of the lineups scraped from FBref
+PLAYER_SCRAPED_COLUMNS = dict(zip(Player._fields[:-2], [
+    'Player', '#', 'Nation', 'Pos', 'Age', 'Min', 'Gls', 'Ast', 'PK', 'PKatt', 'Sh', 'SoT', 'CrdY', 'CrdR', 'Touches',
+    'Tkl', 'Int', 'Blocks', 'xG', 'npxG', 'xAG', 'SCA', 'GCA', 'Cmp_x', 'Cmp%_x', 'PrgP', 'Carries', 'PrgC', 'Succ'
+]))
+
+# Players table column -> column of the players frames the pipeline reads
+PLAYER_FRAME_COLUMNS = dict(zip(Player._fields, [
+    'Player', 'Number', 'Nation', 'Position', 'Age', 'Minutes Played', 'Goals', 'Assists', 'Penalty Kicks',
+    'Penalty Kicks Attempted', 'Shots', 'Shots On Target', 'Yellow Cards', 'Red Cards', 'Ball Touches', 'Tackles',
+    'Interceptions', 'Blocks', 'Expected Goals', 'Non Penalty Expected Goals', 'Expected Assists',
+    'Shot Creating Actions', 'Goal Creating Actions', 'Passes Completed', 'Passes Completed Percentage',
+    'Progressive Passes', 'Carries', 'Progressive Carries', 'Successful Dribbles', 'Game ID', 'Is Home'
+]))
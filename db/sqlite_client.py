@@ -1,17 +1,56 @@
+import json
 import sqlite3
+import time
 from sqlite3 import Error
 
 import pandas as pd
 
-from db.datamodels.match import Match
+from db.datamodels.match import MATCH_DTYPES, MATCH_FRAME_COLUMNS, MATCH_KEY_SEPARATOR, Match, apply_dtypes, \
+    make_match_key
 from db.datamodels.player import Player
+from service.instrumentation import count_db_query
 
 DB_NAME = 'db/matches.db'
+MAX_QUERY_PARAMETERS = 900
+JOURNAL_MODES = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+
+MATCH_KEY_COLUMNS = ['league', 'season', 'date', 'home', 'away']
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """ counts every statement it runs, an executemany is one statement """
+
+    def execute(self, *args):
+        count_db_query()
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        count_db_query()
+        return super().executemany(*args)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """ counts the statements run through it, including the ones of its cursors and of pandas """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        count_db_query()
+        return super().execute(*args)
+
+    def executemany(self, *args):
+        count_db_query()
+        return super().executemany(*args)
 
 
 class SQLiteClient:
-    def __init__(self):
+    def __init__(self, journal_mode='WAL', synchronous='NORMAL'):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
         self.conn = self.create_connection()
+        self.set_pragmas(journal_mode, synchronous)
         self.create_table_if_not_exists()
 
     def __del__(self):
@@ -23,12 +62,31 @@ class SQLiteClient:
         """ create a database connection to the SQLite database """
         conn = None
         try:
-            conn = sqlite3.connect(DB_NAME)
+            conn = sqlite3.connect(DB_NAME, factory=InstrumentedConnection)
         except Error as e:
             print(e)
 
         return conn
 
+    def set_pragmas(self, journal_mode, synchronous):
+        """ WAL with synchronous=NORMAL only syncs on checkpoints instead of on every commit """
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(f'Unknown journal mode: {journal_mode}, expected one of {JOURNAL_MODES}')
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f'Unknown synchronous mode: {synchronous}, expected one of {SYNCHRONOUS_MODES}')
+
+        c = self.conn.cursor()
+        c.execute(f'PRAGMA journal_mode = {journal_mode}')
+        c.execute(f'PRAGMA synchronous = {synchronous}')
+
+    def clone(self):
+        """ a client on a new connection to the same database, for use from another thread """
+        return SQLiteClient(self.journal_mode, self.synchronous)
+
+    def close(self):
+        self.conn.close()
+        self.conn = None
+
     def commit_changes(self):
         self.conn.commit()
 
@@ -50,7 +108,8 @@ class SQLiteClient:
             league TEXT,
             season TEXT,
             score TEXT,
-            match_link TEXT
+            match_link TEXT,
+            match_key TEXT
         );
         """
 
@@ -90,74 +149,292 @@ class SQLiteClient:
             is_home INTEGER
         );
         """
+        create_scrape_tasks_table_sql = """
+        CREATE TABLE IF NOT EXISTS scrape_tasks (
+            id INTEGER PRIMARY KEY,
+            league TEXT NOT NULL,
+            season TEXT NOT NULL,
+            match_link TEXT NOT NULL UNIQUE,
+            match_data TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at REAL NOT NULL DEFAULT 0
+        );
+        """
+
+        create_scrape_seasons_table_sql = """
+        CREATE TABLE IF NOT EXISTS scrape_seasons (
+            league TEXT NOT NULL,
+            season TEXT NOT NULL,
+            PRIMARY KEY (league, season)
+        );
+        """
+
+        create_elo_snapshots_table_sql = """
+        CREATE TABLE IF NOT EXISTS elo_snapshots (
+            date TEXT NOT NULL,
+            club TEXT NOT NULL,
+            country TEXT,
+            level INTEGER,
+            elo REAL,
+            PRIMARY KEY (date, club)
+        ) WITHOUT ROWID;
+        """
+
+        create_teams_table_sql = """
+        CREATE TABLE IF NOT EXISTS teams (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        """
+
+        create_team_aliases_table_sql = """
+        CREATE TABLE IF NOT EXISTS team_aliases (
+            source TEXT NOT NULL,
+            alias TEXT NOT NULL,
+            team_id INTEGER NOT NULL REFERENCES teams (id),
+            PRIMARY KEY (source, alias)
+        );
+        """
+
+        # A team none of the names of the source matched, candidates_hash identifies the names it was matched against
+        create_team_alias_misses_table_sql = """
+        CREATE TABLE IF NOT EXISTS team_alias_misses (
+            source TEXT NOT NULL,
+            team_id INTEGER NOT NULL REFERENCES teams (id),
+            candidates_hash TEXT NOT NULL,
+            PRIMARY KEY (source, team_id, candidates_hash)
+        );
+        """
+
+        # The (match_id, is_home) index also serves lookups by match_id alone
+        create_indices_sqls = [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_match_key ON matches (match_key);",
+            "CREATE INDEX IF NOT EXISTS idx_matches_game_id ON matches (game_id);",
+            "CREATE INDEX IF NOT EXISTS idx_players_match_id_is_home ON players (match_id, is_home);",
+            "CREATE INDEX IF NOT EXISTS idx_scrape_tasks_status ON scrape_tasks (status, next_attempt_at);"
+        ]
         try:
             c = self.conn.cursor()
             c.execute(create_matches_table_sql)
             c.execute(create_players_table_sql)
+            c.execute(create_scrape_tasks_table_sql)
+            c.execute(create_scrape_seasons_table_sql)
+            c.execute(create_elo_snapshots_table_sql)
+            c.execute(create_teams_table_sql)
+            c.execute(create_team_aliases_table_sql)
+            c.execute(create_team_alias_misses_table_sql)
+            self.add_match_key_column_if_not_exists()
+            self.drop_null_team_aliases()
+            for create_index_sql in create_indices_sqls:
+                c.execute(create_index_sql)
         except Error as e:
             print(e)
 
-    def persist_matches(self, matches):
-        for match_row in matches.iterrows():
-            self.persist_match(match_row[1])
+    def add_match_key_column_if_not_exists(self):
+        """ migrates databases created before match_key existed, keeping the first copy of duplicated matches """
+        columns = [column[1] for column in self.conn.execute('PRAGMA table_info(matches)')]
+        if 'match_key' in columns:
+            return
 
-    def persist_match(self, match_row):
-        match = Match(
-            match_row["Game ID"], match_row["Wk"], match_row["Day"], match_row["Date"], match_row["Time"],
-            match_row["Home"],
-            match_row["xG Home"], match_row["G Home"], match_row["Away"], match_row["xG Away"], match_row["G Away"],
-            match_row["League"], match_row["Season"], match_row["Score"], match_row["Match Link"]
-        )
-        sql = '''INSERT INTO matches(game_id, wk, day, date, time, home, xg_home, g_home, away, xg_away, g_away, league, season, score, match_link)
-                 VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'''
-        cur = self.conn.cursor()
-        cur.execute(sql, (
-            match.game_id, match.wk, match.day, match.date, match.time, match.home, match.xg_home, match.g_home,
-            match.away,
-            match.xg_away, match.g_away, match.league, match.season, match.score, match.match_link))
-        self.conn.commit()
-        return cur.lastrowid
+        match_key_sql = f" || '{MATCH_KEY_SEPARATOR}' || ".join(MATCH_KEY_COLUMNS)
+        duplicates_sql = 'id NOT IN (SELECT MIN(id) FROM matches GROUP BY match_key)'
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute('ALTER TABLE matches ADD COLUMN match_key TEXT')
+            c.execute(f'UPDATE matches SET match_key = {match_key_sql}')
+            c.execute(f'DELETE FROM players WHERE match_id IN (SELECT game_id FROM matches WHERE {duplicates_sql})')
+            c.execute(f'DELETE FROM matches WHERE {duplicates_sql}')
+
+    def drop_null_team_aliases(self):
+        """
+        migrates databases created when a miss was kept in team_aliases as a NULL alias, whatever names it was matched
+        against. The misses are dropped, the team is matched again the next time it is looked up.
+        """
+        alias_not_null = [column[3] for column in self.conn.execute('PRAGMA table_info(team_aliases)')
+                          if column[1] == 'alias']
+        if not alias_not_null or alias_not_null[0]:
+            return
+
+        with self.conn:
+            c = self.conn.cursor()
+            c.execute('ALTER TABLE team_aliases RENAME TO team_aliases_nullable')
+            c.execute('''CREATE TABLE team_aliases (
+                             source TEXT NOT NULL,
+                             alias TEXT NOT NULL,
+                             team_id INTEGER NOT NULL REFERENCES teams (id),
+                             PRIMARY KEY (source, alias)
+                         )''')
+            c.execute('''INSERT INTO team_aliases(source, alias, team_id)
+                         SELECT source, alias, team_id FROM team_aliases_nullable WHERE alias IS NOT NULL
+                         ORDER BY rowid''')
+            c.execute('DROP TABLE team_aliases_nullable')
+
+    def persist_matches(self, matches_df):
+        """ upserts all the matches in a single transaction """
+        with self.conn:
+            self.conn.executemany(self._upsert_match_sql(), self._match_rows(matches_df))
 
     def persist_players(self, players_df, match_id, is_home):
-        for player_row in players_df.iterrows():
-            self.persist_player(player_row[1], match_id, is_home)
-
-    def persist_player(self, player_row, match_id, is_home):
-        player = Player(
-            player_row['Player'], player_row['#'], player_row['Nation'], player_row['Pos'], player_row['Age'],
-            player_row['Min'], player_row['Gls'], player_row['Ast'], player_row['PK'], player_row['PKatt'],
-            player_row['Sh'], player_row['SoT'], player_row['CrdY'], player_row['CrdR'], player_row['Touches'],
-            player_row['Tkl'], player_row['Int'], player_row['Blocks'], player_row['xG'], player_row['npxG'],
-            player_row['xAG'], player_row['SCA'], player_row['GCA'], player_row['Cmp_x'], player_row['Cmp%_x'],
-            player_row['PrgP'], player_row['Carries'], player_row['PrgC'], player_row['Succ'], match_id, is_home
-        )
-        sql = '''INSERT INTO players(player, number, nation, pos, age, minutes, goals, assists, pk, pk_att, shots, shots_on_target, crd_y, crd_r, touches, tackles, interceptions, blocks, xg, npxg, xag, sca, gca, cmp_x, cmp_pct_x, prgp, carries, prgc, succ_dribbles, match_id, is_home)
-                 VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'''
-        cur = self.conn.cursor()
-        cur.execute(sql, (
-            player.player, player.number, player.nation, player.pos, player.age, player.minutes, player.goals,
-            player.assists, player.pk, player.pk_att, player.shots,
-            player.shots_on_target, player.crd_y, player.crd_r, player.touches, player.tackles, player.interceptions,
-            player.blocks, player.xg, player.npxg, player.xag,
-            player.sca, player.gca, player.cmp_x, player.cmp_pct_x, player.prgp, player.carries, player.prgc,
-            player.succ_dribbles,
-            player.match_id, player.is_home))
-        self.conn.commit()
-        return cur.lastrowid
+        """ inserts all the players of a team in a single transaction """
+        with self.conn:
+            self._insert_players(self.conn.cursor(), players_df, match_id, is_home)
+
+    def persist_match_with_players(self, match_row, home_players_df, away_players_df):
+        """
+        upserts a match together with both of its lineups in a single transaction, a match that already exists keeps
+        its game id and gets its lineups replaced
+        """
+        with self.conn:
+            cur = self.conn.cursor()
+            cur.execute(self._upsert_match_sql() + ' RETURNING game_id', next(self._match_rows(match_row.to_frame().T)))
+            game_id = cur.fetchone()[0]
+            cur.execute('DELETE FROM players WHERE match_id = ?', (game_id,))
+            self._insert_players(cur, home_players_df, game_id, 1)
+            self._insert_players(cur, away_players_df, game_id, 0)
+
+    def match_exists(self, league, season, date, home, away):
+        sql = '''SELECT 1 FROM matches WHERE match_key = ? LIMIT 1'''
+        return self.conn.execute(sql, (make_match_key(league, season, date, home, away),)).fetchone() is not None
+
+    def _upsert_match_sql(self):
+        columns = list(Match._fields) + ['match_key']
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'game_id')
+        return f'''INSERT INTO matches({', '.join(columns)})
+                  VALUES({','.join('?' * len(columns))})
+                  ON CONFLICT(match_key) DO UPDATE SET {updates}'''
+
+    def _match_rows(self, matches_df):
+        return (match.to_db_row() for match in Match.from_df(matches_df))
+
+    def _insert_players(self, cur, players_df, match_id, is_home):
+        sql = f'''INSERT INTO players({', '.join(Player._fields)})
+                 VALUES({','.join('?' * len(Player._fields))})'''
+        cur.executemany(sql, (player.to_db_row() for player in Player.from_df(players_df, match_id, is_home)))
+
+    def is_scrape_season_enqueued(self, league, season):
+        sql = '''SELECT 1 FROM scrape_seasons WHERE league = ? AND season = ?'''
+        return self.conn.execute(sql, (league, season)).fetchone() is not None
+
+    def find_scrape_task_links(self, league, season):
+        """ the match links of the season that already have a scrape task, whatever its status """
+        sql = '''SELECT match_link FROM scrape_tasks WHERE league = ? AND season = ?'''
+        return {match_link for match_link, in self.conn.execute(sql, (league, season))}
+
+    def enqueue_scrape_tasks(self, league, season, matches_df):
+        """ adds a pending task for every match of the season and marks the season as enqueued """
+        sql = '''INSERT OR IGNORE INTO scrape_tasks(league, season, match_link, match_data) VALUES(?,?,?,?)'''
+        with self.conn:
+            self.conn.executemany(sql, ((league, season, match_row['Match Link'], match_row.to_json())
+                                        for _, match_row in matches_df.iterrows()))
+            self.conn.execute('''INSERT OR IGNORE INTO scrape_seasons(league, season) VALUES(?,?)''', (league, season))
+
+    def reset_in_progress_scrape_tasks(self):
+        """ tasks that were claimed by a run that crashed are pending again """
+        with self.conn:
+            self.conn.execute("UPDATE scrape_tasks SET status = 'pending' WHERE status = 'in_progress'")
+
+    def retry_failed_scrape_tasks(self):
+        """ tasks that ran out of attempts in an earlier run are pending again, due now and with all their attempts """
+        sql = '''UPDATE scrape_tasks SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'
+                 RETURNING id'''
+        with self.conn:
+            return len(self.conn.execute(sql).fetchall())
+
+    def claim_scrape_tasks(self, limit):
+        """ marks up to limit due pending tasks as in progress and returns them as (task_id, match_row) """
+        sql = '''UPDATE scrape_tasks SET status = 'in_progress'
+                 WHERE id IN (SELECT id FROM scrape_tasks WHERE status = 'pending' AND next_attempt_at <= ?
+                              ORDER BY id LIMIT ?)
+                 RETURNING id, match_data'''
+        with self.conn:
+            rows = self.conn.execute(sql, (time.time(), limit)).fetchall()
+        return [(task_id, pd.Series(json.loads(match_data))) for task_id, match_data in sorted(rows)]
+
+    def next_scrape_task_attempt_at(self):
+        """ when the next pending task becomes due, None when there are no pending tasks """
+        sql = "SELECT MIN(next_attempt_at) FROM scrape_tasks WHERE status = 'pending'"
+        return self.conn.execute(sql).fetchone()[0]
+
+    def find_fixture_dates(self):
+        """ the dates of the matches in the database and of the ones still to scrape """
+        sql = '''SELECT date FROM matches
+                 UNION
+                 SELECT json_extract(match_data, '$.Date') FROM scrape_tasks WHERE status != ?'''
+        return [date for date, in self.conn.execute(sql, ('failed',))]
+
+    def complete_scrape_task(self, task_id):
+        with self.conn:
+            self.conn.execute("UPDATE scrape_tasks SET status = 'done', last_error = NULL WHERE id = ?", (task_id,))
+
+    def fail_scrape_task(self, task_id, error, max_attempts, backoff_seconds):
+        """ schedules another attempt with exponential backoff, or gives up after max_attempts """
+        sql = '''UPDATE scrape_tasks
+                 SET attempts = attempts + 1,
+                     last_error = ?,
+                     status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                     next_attempt_at = ? * (1 << attempts) + ?
+                 WHERE id = ?'''
+        with self.conn:
+            self.conn.execute(sql, (str(error), max_attempts, backoff_seconds, time.time(), task_id))
+
+    def find_players_version(self):
+        """ changes whenever players are added or replaced """
+        return self.conn.execute('SELECT COUNT(*), MAX(id) FROM players').fetchone()
+
+    def find_teams(self):
+        return self.conn.execute('SELECT id, name FROM teams').fetchall()
+
+    def persist_team(self, name):
+        """ returns the id of the team, adding it when it is new """
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO teams(name) VALUES(?)', (name,))
+        return self.conn.execute('SELECT id FROM teams WHERE name = ?', (name,)).fetchone()[0]
+
+    def find_team_aliases(self):
+        return self.conn.execute('SELECT source, alias, team_id FROM team_aliases ORDER BY rowid').fetchall()
+
+    def find_team_aliases_by_source(self, source):
+        return self.conn.execute('SELECT alias, team_id FROM team_aliases WHERE source = ? ORDER BY alias',
+                                 (source,)).fetchall()
+
+    def persist_team_alias(self, source, alias, team_id):
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO team_aliases(source, alias, team_id) VALUES(?,?,?)',
+                              (source, alias, team_id))
+
+    def find_team_alias_misses(self):
+        return self.conn.execute('SELECT source, team_id, candidates_hash FROM team_alias_misses').fetchall()
+
+    def persist_team_alias_miss(self, source, team_id, candidates_hash):
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO team_alias_misses(source, team_id, candidates_hash) VALUES(?,?,?)',
+                              (source, team_id, candidates_hash))
 
     def find_all_matches(self):
         sql = '''SELECT * FROM matches order by date, time'''
-        matches_df = pd.read_sql_query(sql, self.conn)
-        return self._rename_matches_columns(matches_df)
+        matches_df = pd.read_sql_query(sql, self.conn).drop(columns=['match_key'])
+        return apply_dtypes(self._rename_matches_columns(matches_df), MATCH_DTYPES)
 
     def find_all_matches_filtered(self):
         sql = '''SELECT game_id, home, away, date FROM matches'''
         return pd.read_sql_query(sql, self.conn)
 
     def find_players_by_match_id_and_is_home(self, match_id, is_home):
-        sql = '''SELECT * FROM players WHERE match_id = ? AND is_home = ?'''
-        players_df = pd.read_sql_query(sql, self.conn, params=(match_id, is_home))
-        return self._rename_player_columns(players_df)
+        sql = f'''SELECT {', '.join(Player._fields)} FROM players WHERE match_id = ? AND is_home = ?'''
+        return Player.to_df(self.conn.execute(sql, (match_id, is_home)).fetchall())
+
+    def find_players_by_match_ids(self, match_ids):
+        """ returns the players of all the given matches in a single frame, in the order they were inserted """
+        match_ids = [int(match_id) for match_id in match_ids]
+        players = []
+        for i in range(0, len(match_ids), MAX_QUERY_PARAMETERS):
+            chunk = match_ids[i:i + MAX_QUERY_PARAMETERS]
+            sql = f'''SELECT {', '.join(Player._fields)} FROM players
+                      WHERE match_id IN ({','.join('?' * len(chunk))}) ORDER BY id'''
+            players.extend(self.conn.execute(sql, chunk).fetchall())
+        return Player.to_df(players)
 
     def find_matches_by_date_time_home_away(self, date, time, home, away):
         sql = '''SELECT * FROM matches WHERE date = ? AND time = ? AND home = ? AND away = ?'''
@@ -165,25 +442,7 @@ class SQLiteClient:
         return self._rename_matches_columns(matches_df)
 
     def _rename_matches_columns(self, matches_df):
-        return matches_df.rename(columns={'game_id': 'Game ID', 'wk': 'Wk', 'day': 'Day', 'date': 'Date',
-                                          'time': 'Time', 'home': 'Home', 'xg_home': 'xG Home', 'g_home': 'G Home',
-                                          'away': 'Away', 'xg_away': 'xG Away', 'g_away': 'G Away', 'league': 'League',
-                                          'season': 'Season', 'score': 'Score', 'match_link': 'Match Link'})
-
-    def _rename_player_columns(self, matches_df):
-        return matches_df.rename(columns={'player': 'Player', 'number': 'Number', 'nation': 'Nation', 'pos': 'Position',
-                                          'age': 'Age', 'minutes': 'Minutes Played', 'goals': 'Goals',
-                                          'assists': 'Assists', 'pk': 'Penalty Kicks',
-                                          'pk_att': 'Penalty Kicks Attempted', 'shots': 'Shots',
-                                          'shots_on_target': 'Shots On Target', 'crd_y': 'Yellow Cards',
-                                          'crd_r': 'Red Cards', 'touches': 'Ball Touches', 'tackles': 'Tackles',
-                                          'interceptions': 'Interceptions', 'blocks': 'Blocks', 'xg': 'Expected Goals',
-                                          'npxg': 'Non Penalty Expected Goals', 'xag': 'Expected Assists',
-                                          'sca': 'Shot Creating Actions', 'gca': 'Goal Creating Actions',
-                                          'cmp_x': 'Passes Completed', 'cmp_pct_x': 'Passes Completed Percentage',
-                                          'prgp': 'Progressive Passes', 'carries': 'Carries',
-                                          'prgc': 'Progressive Carries', 'succ_dribbles': 'Successful Dribbles',
-                                          'match_id': 'Game ID', 'is_home': 'Is Home'})
+        return matches_df.rename(columns=MATCH_FRAME_COLUMNS)
 
     def add_elo_columns_if_not_exists(self):
         c = self.conn.cursor()
@@ -194,6 +453,26 @@ class SQLiteClient:
             # Columns may already exist; ignore error
             pass
 
+    def find_elo_snapshot_dates(self):
+        return {row[0] for row in self.conn.execute('SELECT DISTINCT date FROM elo_snapshots')}
+
+    def find_latest_elo_snapshot_date(self):
+        return self.conn.execute('SELECT MAX(date) FROM elo_snapshots').fetchone()[0]
+
+    def find_elo_snapshot(self, date):
+        sql = '''SELECT club AS Club, country AS Country, level AS Level, elo AS Elo FROM elo_snapshots WHERE date = ?'''
+        return pd.read_sql_query(sql, self.conn, params=(date,))
+
+    def persist_elo_snapshot(self, date, elo_df):
+        sql = '''INSERT OR REPLACE INTO elo_snapshots(date, club, country, level, elo) VALUES(?,?,?,?,?)'''
+        rows = elo_df.drop_duplicates('Club')[['Club', 'Country', 'Level', 'Elo']].itertuples(index=False, name=None)
+        with self.conn:
+            self.conn.executemany(sql, ((date,) + row for row in rows))
+
+    def update_many_elo_ratings(self, elo_ratings):
+        """ elo_ratings are (home_elo_value, away_elo_value, game_id) tuples """
+        self.conn.executemany("UPDATE matches SET home_elo = ?, away_elo = ? WHERE game_id = ?", elo_ratings)
+
     def update_elo_ratings(self, home_elo_value, away_elo_value, game_id):
         c = self.conn.cursor()
         c.execute(
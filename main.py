@@ -1,11 +1,41 @@
+import argparse
+
 from db import sqlite_client
-from service import scrapping_manager, data_organizer
+from service import instrumentation, scrapping_manager, data_organizer, scrape_config
+from service.scrappers import http_cache
 
 
 def main():
-    db_client = sqlite_client.SQLiteClient()
-    scrapping_manager.scrap_data(db_client)
-    data_organizer.prepare_matches_for_modeling(db_client)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help='only add the matches that are not in matches_for_modeling.csv yet')
+    parser.add_argument('--players-executor', choices=data_organizer.PLAYERS_EXECUTORS, default='thread',
+                        help='how the players ratings of the matches are computed')
+    parser.add_argument('--scrape-config', default=scrape_config.SCRAPE_CONFIG_PATH,
+                        help='json file with the leagues and seasons to scrap')
+    parser.add_argument('--replay', action='store_true',
+                        help='scrap only from the pages in the http cache, without downloading anything')
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE',
+                        help='profile the stage with cProfile, "all" for every stage, can be repeated')
+    parser.add_argument('--trace-memory', action='append', default=[], metavar='STAGE',
+                        help='record the memory peak of the stage with tracemalloc, "all" for every stage, can be '
+                             'repeated')
+    parser.add_argument('--run-report', default=instrumentation.RUN_REPORT_PATH,
+                        help='where the timings and counters of the run are written as json')
+    args = parser.parse_args()
+    config = scrape_config.load_scrape_config(args.scrape_config)
+
+    if args.replay:
+        http_cache.configure_http_cache(mode='replay')
+    instrumentation.configure_instrumentation(profile_stages=args.profile, trace_memory_stages=args.trace_memory)
+
+    try:
+        db_client = sqlite_client.SQLiteClient()
+        scrapping_manager.scrap_data(db_client, config)
+        data_organizer.prepare_matches_for_modeling(db_client, incremental=args.incremental,
+                                                    players_executor=args.players_executor)
+    finally:
+        instrumentation.write_run_report(args.run_report)
 
 
 if __name__ == '__main__':
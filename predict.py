@@ -0,0 +1,67 @@
+import argparse
+import sys
+
+import pandas as pd
+
+from db import sqlite_client
+from service import prediction, prediction_server
+from service.data_organizer import MATCHES_FOR_MODELING_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description='train the match outcome model and predict upcoming fixtures')
+    parser.add_argument('--model', default=prediction.MODEL_PATH, help='where the trained model is saved')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = commands.add_parser('train', help='train the model on matches_for_modeling.csv and save it')
+    train_parser.add_argument('--matches', default=MATCHES_FOR_MODELING_PATH)
+
+    predict_parser = commands.add_parser('predict', help='predict a batch of fixtures')
+    predict_parser.add_argument('fixtures', nargs='?',
+                                help='csv with Date, Home and Away columns, and optionally B365H, B365D and B365A')
+    predict_parser.add_argument('--fixture', action='append', default=[], metavar='DATE,HOME,AWAY',
+                                help='a fixture to predict, can be repeated')
+    predict_parser.add_argument('--output', help='csv to write the predictions to instead of the standard output')
+
+    serve_parser = commands.add_parser('serve', help='answer predictions over http')
+    serve_parser.add_argument('--host', default=prediction_server.PREDICTION_HOST)
+    serve_parser.add_argument('--port', type=int, default=prediction_server.PREDICTION_PORT)
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        model_bundle = prediction.train_model(pd.read_csv(args.matches))
+        prediction.save_model(model_bundle, args.model)
+        print(f'Model trained on {model_bundle["matches"]} matches up to {model_bundle["last_match_date"]}, '
+              f'accuracy on the last matches: {model_bundle["accuracy"]}, saved to {args.model}')
+        print(f'Fallback model without the odds trained on {model_bundle["fallback_matches"]} matches, '
+              f'accuracy on the last matches: {model_bundle["fallback_accuracy"]}')
+        return
+
+    predictor = prediction.load_predictor(sqlite_client.SQLiteClient(), args.model)
+    if args.command == 'predict':
+        fixtures_df = read_fixtures(parser, args.fixtures, args.fixture)
+        predictions_df = predictor.predict(fixtures_df)
+        predictions_df.to_csv(args.output or sys.stdout, index=False)
+    else:
+        server = prediction_server.make_prediction_server(predictor, args.host, args.port)
+        print(f'Serving predictions on http://{args.host}:{server.server_port}/predict')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+def read_fixtures(parser, fixtures_path, fixtures):
+    if fixtures_path is None and not fixtures:
+        parser.error('give a fixtures csv or --fixture')
+
+    fixtures_dfs = [] if fixtures_path is None else [pd.read_csv(fixtures_path)]
+    fixture_rows = [fixture.split(',') for fixture in fixtures]
+    if any(len(row) != 3 for row in fixture_rows):
+        parser.error('--fixture is DATE,HOME,AWAY')
+    fixtures_dfs.append(pd.DataFrame(fixture_rows, columns=prediction.FIXTURE_COLUMNS))
+    return pd.concat(fixtures_dfs, ignore_index=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,148 +1,319 @@
+import hashlib
+import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from multiprocessing import get_context
 
+import numpy as np
 import pandas as pd
 
-from db.sqlite_client import SQLiteClient
-from service.spi_matcher import add_fivethirtyeight_spi_data
+from service import features, fifa_index, instrumentation, spi_matcher, team_registry
+from service.features import add_features
+from service.fifa_index import FifaNameIndex
+from service.instrumentation import Progress, register_cache
+from service.matches_dataset import append_matches_dataset, export_matches_dataset
+from service.pipeline import Stage, files_fingerprint, run_stages
+from service.spi_matcher import SPI_COLUMNS, SPI_MATCHES_PATH, add_fivethirtyeight_spi_data
+from service.team_registry import TeamRegistry
 
 RESOURCES_PATH = 'resources'
+BETS_PATH = f'{RESOURCES_PATH}/bets'
+FIFA_PATH = f'{RESOURCES_PATH}/fifa'
 OUTPUT_PATH = 'output'
+MATCHES_FOR_MODELING_PATH = f'{OUTPUT_PATH}/matches_for_modeling.csv'
+TEAM_HISTORY_PATH = f'{OUTPUT_PATH}/team_history.csv'
+REFRESH_STATE_PATH = f'{OUTPUT_PATH}/refresh_state.json'
+
+BETS_ODDS_COLUMNS = ['B365H', 'B365D', 'B365A']
+BETS_DTYPES = {'Date': str, 'HomeTeam': str, 'AwayTeam': str, 'B365H': float, 'B365D': float, 'B365A': float}
+BETS_DATE_FORMAT = '%d/%m/%Y'
+BETS_KEY_COLUMNS = ['Date', 'home_id', 'away_id']
+
+
+def prepare_matches_for_modeling(db_client, incremental=False, players_executor='thread', feature_params=None):
+    with instrumentation.stage('load_matches') as record:
+        matches_df = load_matches_df(db_client)
+        record['rows'] = len(matches_df)
+
+    team_history_df = load_team_history() if incremental else None
+    if team_history_df is not None:
+        new_matches_df = find_new_matches(matches_df, team_history_df, load_refresh_state())
+        if new_matches_df is None:
+            team_history_df = None
+        elif new_matches_df.empty:
+            print('No new matches to add to matches_for_modeling.csv')
+            return
+        else:
+            matches_df = new_matches_df
 
-
-def prepare_matches_for_modeling(db_client):
-    matches_df = load_matches_df(db_client)
-
-    add_bets(matches_df)
-    add_elo_xscore(matches_df)
-    add_players_data(matches_df)
-    add_fivethirtyeight_spi_data(matches_df)
-    add_aggregated_data(matches_df)
+    append = team_history_df is not None
+    artifacts = run_stages(matches_df, build_stages(players_executor, team_history_df, feature_params),
+                           db_client)
+    team_history_df = artifacts['aggregates']
 
     matches_df = matches_df.round(2)
 
-    export_data(matches_df, f'{OUTPUT_PATH}/matches_for_modeling.csv')
+    with instrumentation.stage('export', rows=len(matches_df)):
+        if append:
+            append_data(matches_df, MATCHES_FOR_MODELING_PATH)
+            append_matches_dataset(matches_df)
+        else:
+            export_data(matches_df, MATCHES_FOR_MODELING_PATH)
+            export_matches_dataset(matches_df)
+        save_team_history(team_history_df)
+        save_refresh_state(matches_df)
 
     print('All data was added to matches_for_modeling.csv')
 
 
+def build_stages(players_executor='thread', team_history_df=None, feature_params=None):
+    """
+    The stages of the modeling pipeline. Bets, Elo, players, SPI and the aggregates read disjoint columns of the
+    matches, so they have no dependencies and run together. feature_params override the thresholds of the Elo and
+    players features, a stage whose parameters change runs again instead of being read from the cache. The bets and
+    SPI stages also run again when the team aliases of their source change.
+    """
+    this_module = sys.modules[__name__]
+    elo_params = stage_params({'home_win_threshold': features.ELO_HOME_WIN_THRESHOLD,
+                               'away_win_threshold': features.ELO_AWAY_WIN_THRESHOLD}, feature_params)
+    players_params = stage_params({'star_rating': STAR_PLAYER_RATING, 'superstar_rating': SUPERSTAR_PLAYER_RATING,
+                                   'power_gap': features.POWER_GAP}, feature_params)
+    return [
+        Stage('bets', run_bets_stage, ['Date', 'Home', 'Away'], BETS_ODDS_COLUMNS + ['xScore'],
+              [this_module, team_registry],
+              fingerprint=lambda db_client: (files_fingerprint(BETS_PATH),
+                                             db_client.find_team_aliases_by_source('football-data'))),
+        Stage('elo', partial(run_elo_stage, **elo_params), ['home_elo', 'away_elo'], ['xScoreElo'],
+              [this_module, features], params=elo_params),
+        Stage('players', partial(run_players_stage, executor=players_executor, **players_params), ['Game ID', 'Season'],
+              PLAYERS_DATA_COLUMNS + ['xPower', 'xSuperPower'], [this_module, features, fifa_index],
+              params=players_params,
+              fingerprint=lambda db_client: (db_client.find_players_version(), files_fingerprint(FIFA_PATH))),
+        Stage('spi', run_spi_stage, ['Date', 'Home', 'Away'], SPI_COLUMNS, [spi_matcher, team_registry],
+              fingerprint=lambda db_client: (files_fingerprint(SPI_MATCHES_PATH),
+                                             db_client.find_team_aliases_by_source('spi'))),
+        Stage('aggregates', partial(run_aggregates_stage, team_history_df=team_history_df),
+              ['Game ID', 'Home', 'Away', 'G Home', 'G Away', 'xG Home', 'xG Away'], AGGREGATED_COLUMNS,
+              [this_module, features], params={'aggregated_features': AGGREGATED_FEATURES},
+              fingerprint=lambda db_client: history_fingerprint(team_history_df)),
+    ]
+
+
+def stage_params(defaults, feature_params):
+    """ the default parameters of a stage with the ones of feature_params it declares """
+    return {name: (feature_params or {}).get(name, value) for name, value in defaults.items()}
+
+
+def run_bets_stage(matches_df, db_client):
+    add_bets(matches_df, TeamRegistry(db_client))
+
+
+def run_elo_stage(matches_df, db_client, **params):
+    add_elo_xscore(matches_df, **params)
+
+
+def run_players_stage(matches_df, db_client, executor='thread', **params):
+    add_players_data(matches_df, db_client, executor, **params)
+
+
+def run_spi_stage(matches_df, db_client):
+    add_fivethirtyeight_spi_data(matches_df, TeamRegistry(db_client))
+
+
+def run_aggregates_stage(matches_df, db_client, team_history_df=None):
+    return add_aggregated_data(matches_df, team_history_df)
+
+
+def history_fingerprint(team_history_df):
+    if team_history_df is None:
+        return None
+    return hashlib.sha256(pd.util.hash_pandas_object(team_history_df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def find_new_matches(matches_df, team_history_df, refresh_state):
+    """
+    Returns the matches that were not processed yet, or None when some of them are older than the last processed match
+    and the rolling history has to be rebuilt from scratch.
+    """
+    processed_game_ids = set(team_history_df['game_id'].astype(str))
+    new_matches_df = matches_df[~matches_df['Game ID'].astype(str).isin(processed_game_ids)].reset_index(drop=True)
+    if new_matches_df.empty or refresh_state is None:
+        return new_matches_df
+
+    last_processed = (refresh_state['date'], refresh_state['time'])
+    first_new = min(zip(new_matches_df['Date'], new_matches_df['Time']))
+    if first_new < last_processed:
+        print(f'Found new matches older than {last_processed[0]}, rebuilding all matches')
+        return None
+
+    print(f'Found {new_matches_df.shape[0]} new matches since {last_processed[0]}')
+    return new_matches_df
+
+
 def load_matches_df(db_client):
     return db_client.find_all_matches()
 
 
-def add_bets(matches_df):
+def add_bets(matches_df, team_registry):
     print('Adding bets')
 
-    all_bets_dict = load_bets()
+    bets_df = load_bets()
+    team_names = pd.unique(pd.concat([matches_df['Home'], matches_df['Away']]))
+    bets_team_names = list(pd.unique(pd.concat([bets_df['HomeTeam'], bets_df['AwayTeam']])))
+    team_ids, bets_team_ids, unmatched_teams = team_registry.resolve_team_ids(team_names, 'football-data',
+                                                                              bets_team_names)
 
-    for bets_key in all_bets_dict:
-        season = '-'.join(bets_key.split('-')[-2:])
-        league = '-'.join(bets_key.split('-')[:-2])
-        bets_df = all_bets_dict[bets_key]
+    matches_keys = pd.DataFrame({'Date': matches_df['Date'].astype(str),
+                                 'home_id': matches_df['Home'].map(team_ids),
+                                 'away_id': matches_df['Away'].map(team_ids)})
+    bets_df = bets_df.assign(home_id=bets_df['HomeTeam'].map(bets_team_ids),
+                             away_id=bets_df['AwayTeam'].map(bets_team_ids))
+    bets_df = bets_df.dropna(subset=['home_id', 'away_id']).drop_duplicates(BETS_KEY_COLUMNS)
 
-        condition = (matches_df['League'] == league) & (matches_df['Season'] == season)
-        filtered_df = matches_df[condition]
-        if filtered_df.shape[0] == bets_df.shape[0]:
-            matches_df.loc[condition, 'B365H'] = bets_df['B365H'].tolist()
-            matches_df.loc[condition, 'B365D'] = bets_df['B365D'].tolist()
-            matches_df.loc[condition, 'B365A'] = bets_df['B365A'].tolist()
+    # The bets keys are unique, so the merge keeps the rows of matches_df in order
+    merged_df = matches_keys.merge(bets_df, on=BETS_KEY_COLUMNS, how='left')
+    for col in BETS_ODDS_COLUMNS:
+        matches_df[col] = merged_df[col].to_numpy()
 
-    matches_df.dropna()
+    print(f'Bets found for {merged_df["B365H"].notna().sum()} of {len(matches_df)} matches')
+    if unmatched_teams:
+        print(f'{len(unmatched_teams)} teams without bets: {", ".join(sorted(unmatched_teams))}')
+
+    matches_df['xScore'] = calculate_xscore(matches_df[BETS_ODDS_COLUMNS].to_numpy())
 
-    def calculate_xscore(row):
-        if row['B365H'] < row['B365D'] and row['B365H'] < row['B365A']:
-            return 1
-        elif row['B365A'] < row['B365D'] and row['B365A'] < row['B365H']:
-            return -1
-        else:
-            return 0
 
-    matches_df['xScore'] = matches_df.apply(calculate_xscore, axis=1)
+def calculate_xscore(odds):
+    """
+    1 when the home win has the lowest odds, -1 when the away win has, 0 for the draw, a tie for the lowest odds or
+    missing odds
+    """
+    lowest_odds = odds.min(axis=1, keepdims=True)
+    is_single_lowest = (odds == lowest_odds).sum(axis=1) == 1
+    return np.where(is_single_lowest, np.array([1, 0, -1])[odds.argmin(axis=1)], 0)
 
 
-def add_elo_xscore(matches_df):
+def add_elo_xscore(matches_df, **params):
     print('Adding elo score')
 
-    def calculate_elo_xscore(row):
-        home_win_threshold = 0.52
-        away_win_threshold = 0.48
-        home_elo, away_elo = row['home_elo'], row['away_elo']
+    add_features(matches_df, ['xScoreElo'], **params)
 
-        # Calculate the probability of a home win using the Elo formula
-        probability_home_win = 1 / (1 + 10 ** ((away_elo - home_elo) / 400))
 
-        # Determine the expected score based on the probability
-        if probability_home_win > home_win_threshold:
-            return 1  # Home win
-        elif probability_home_win < away_win_threshold:
-            return -1  # Away win
-        else:
-            return 0  # Draw
+PLAYERS_EXECUTORS = ['thread', 'process', 'serial']
+PLAYERS_MAX_WORKERS = 12
+MATCHES_PER_CHUNK = 200
+# Players rated from STAR_PLAYER_RATING count as stars and weigh 5 in the average score, from SUPERSTAR_PLAYER_RATING 10
+STAR_PLAYER_RATING = 85
+SUPERSTAR_PLAYER_RATING = 90
+PLAYER_RATING_PARAMS = ['star_rating', 'superstar_rating']
+PLAYERS_DATA_COLUMNS = ['Home Avg Players Score', 'Away Avg Players Score', 'Home Star Player Count',
+                        'Away Star Player Count', 'Players Found %']
 
-    matches_df['xScoreElo'] = matches_df.apply(calculate_elo_xscore, axis=1)
 
-
-def add_players_data(matches_df):
+def add_players_data(matches_df, db_client, executor='thread', max_workers=PLAYERS_MAX_WORKERS, **params):
+    """ params override the rating thresholds of the players scores and the parameters of the features """
     print('Adding players data')
 
-    all_fifa_dict = load_all_fifa()
+    # Only the FIFA editions of the seasons of the matches are loaded, an incremental run needs a single one
+    fifa_ratings = load_fifa_ratings({season_fifa_edition(season) for season in matches_df['Season'].unique()})
+    players_by_match = group_players_by_match(db_client.find_players_by_match_ids(matches_df['Game ID'].tolist()))
 
     init_players_data_columns(matches_df)
 
-    results = []
-    with ThreadPoolExecutor(max_workers=12) as executor:
-        futures = [executor.submit(process_match_row, i, row, all_fifa_dict) for i, row in
-                   matches_df.iterrows()]
-
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                results.append(result)
-                print(f'Done Adding players data for match {result["index"] + 1}')
-
-    for result in results:
-        matches_df.loc[result['index'], 'Home Avg Players Score'] = result['Home Avg Players Score']
-        matches_df.loc[result['index'], 'Away Avg Players Score'] = result['Away Avg Players Score']
-        matches_df.loc[result['index'], 'Home Star Player Count'] = result['Home Star Player Count']
-        matches_df.loc[result['index'], 'Away Star Player Count'] = result['Away Star Player Count']
-        matches_df.loc[result['index'], 'Players Found %'] = result['Players Found %']
-
-    def calculate_xpower(row):
-        if row['Home Avg Players Score'] - row['Away Avg Players Score'] > 10:
-            return 1
-        elif row['Away Avg Players Score'] - row['Home Avg Players Score'] > 10:
-            return -1
-        else:
-            return 0
+    rating_params = {name: value for name, value in params.items() if name in PLAYER_RATING_PARAMS}
+    results = calculate_players_data(matches_df, fifa_ratings, players_by_match, executor, max_workers,
+                                     rating_params)
 
-    matches_df['xPower'] = matches_df.apply(calculate_xpower, axis=1)
+    results_df = pd.DataFrame(results, columns=['index'] + PLAYERS_DATA_COLUMNS).set_index('index')
+    matches_df.loc[results_df.index, PLAYERS_DATA_COLUMNS] = results_df
 
-    def calculate_xsuperpower(row):
-        if row['Home Star Player Count'] > row['Away Star Player Count']:
-            return 1
-        elif row['Away Star Player Count'] > row['Home Star Player Count']:
-            return -1
-        else:
-            return 0
+    add_features(matches_df, ['xPower', 'xSuperPower'], **params)
+
+
+def calculate_players_data(matches_df, fifa_ratings, players_by_match, executor, max_workers, rating_params=None):
+    """ fifa_ratings holds the ratings frame of every FIFA edition the seasons of the matches need """
+    rating_params = rating_params or {}
+    progress = Progress('Players data added for matches', matches_df.shape[0])
+    if executor in ['serial', 'thread']:
+        all_fifa_dict = build_fifa_indexes(fifa_ratings)
+
+    if executor == 'serial':
+        return [report_players_data_result(
+                    process_match_row(i, row, all_fifa_dict, players_by_match, rating_params), progress)
+                for i, row in matches_df.iterrows()]
+
+    if executor == 'thread':
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(process_match_row, i, row, all_fifa_dict, players_by_match, rating_params)
+                       for i, row in matches_df.iterrows()]
+            return [report_players_data_result(future.result(), progress) for future in as_completed(futures)]
 
-    matches_df['xSuperPower'] = matches_df.apply(calculate_xsuperpower, axis=1)
+    if executor == 'process':
+        # Every worker gets the FIFA ratings frames once and indexes an edition only when a chunk of its season comes,
+        # every chunk holds the matches of a single season. The workers are spawned, the pipeline runs this stage next
+        # to others holding SQLite connections and locks that a forked worker would inherit
+        results = []
+        with ProcessPoolExecutor(max_workers=min(max_workers, os.cpu_count() or 1), mp_context=get_context('spawn'),
+                                 initializer=init_players_worker, initargs=(fifa_ratings,)) as pool:
+            futures = [pool.submit(process_match_rows, chunk_df, chunk_players_by_match, rating_params) for
+                       chunk_df, chunk_players_by_match in split_matches_by_season(matches_df, players_by_match)]
+            for future in as_completed(futures):
+                results.extend(report_players_data_result(result, progress) for result in future.result())
+        return results
+
+    raise ValueError(f'Unknown executor: {executor}, expected one of {PLAYERS_EXECUTORS}')
+
+
+def report_players_data_result(result, progress):
+    progress.advance()
+    return result
 
 
-def process_match_row(i, match_row, all_fifa_dict):
-    db_client = SQLiteClient()
+def split_matches_by_season(matches_df, players_by_match):
+    for _, season_df in matches_df.groupby('Season', sort=False, observed=True):
+        for start in range(0, season_df.shape[0], MATCHES_PER_CHUNK):
+            chunk_df = season_df.iloc[start:start + MATCHES_PER_CHUNK]
+            chunk_players_by_match = {(int(game_id), is_home): players_by_match[(int(game_id), is_home)]
+                                      for game_id in chunk_df['Game ID'] for is_home in [1, 0]
+                                      if (int(game_id), is_home) in players_by_match}
+            yield chunk_df, chunk_players_by_match
+
+
+worker_fifa_ratings = None
+worker_fifa_dict = {}
+
+
+def init_players_worker(fifa_ratings):
+    global worker_fifa_ratings
+    worker_fifa_ratings = fifa_ratings
+
+
+def process_match_rows(matches_df, players_by_match, rating_params):
+    fifa_edition = season_fifa_edition(matches_df['Season'].iloc[0])
+    if fifa_edition not in worker_fifa_dict:
+        worker_fifa_dict[fifa_edition] = FifaNameIndex(worker_fifa_ratings[fifa_edition])
+    return [process_match_row(i, row, worker_fifa_dict, players_by_match, rating_params)
+            for i, row in matches_df.iterrows()]
+
+
+def process_match_row(i, match_row, all_fifa_dict, players_by_match, rating_params=None):
+    rating_params = rating_params or {}
     statistics = [0, 0, 0]
     season = match_row['Season']
     game_id = match_row['Game ID']
 
-    fifa_df = get_relevant_fifa(all_fifa_dict, season)
+    fifa_index = get_relevant_fifa(all_fifa_dict, season)
 
-    home_team_players_df = load_team_player_data(db_client, game_id, 1)
-    away_team_players_df = load_team_player_data(db_client, game_id, 0)
+    home_team_players = load_team_player_data(players_by_match, game_id, 1)
+    away_team_players = load_team_player_data(players_by_match, game_id, 0)
 
-    home_team_avg_score = calculate_avg_score(home_team_players_df['Player'].tolist(), fifa_df, season, statistics)
-    away_team_avg_score = calculate_avg_score(away_team_players_df['Player'].tolist(), fifa_df, season, statistics)
-    home_star_player_count = count_star_players(home_team_players_df['Player'].tolist(), fifa_df, season)
-    away_star_player_count = count_star_players(away_team_players_df['Player'].tolist(), fifa_df, season)
+    home_team_avg_score = calculate_avg_score(home_team_players, fifa_index, season, statistics, **rating_params)
+    away_team_avg_score = calculate_avg_score(away_team_players, fifa_index, season, statistics, **rating_params)
+    home_star_player_count = count_star_players(home_team_players, fifa_index, season,
+                                                rating_params.get('star_rating', STAR_PLAYER_RATING))
+    away_star_player_count = count_star_players(away_team_players, fifa_index, season,
+                                                rating_params.get('star_rating', STAR_PLAYER_RATING))
 
     result = {
         'index': i,
@@ -157,54 +328,78 @@ def process_match_row(i, match_row, all_fifa_dict):
 
 
 def load_all_fifa():
-    all_fifa_dict = {}
-    fifa_folder = RESOURCES_PATH + '/fifa'
+    return build_fifa_indexes(load_fifa_ratings())
+
+
+def load_fifa_ratings(fifa_editions=None):
+    """ {FIFA edition: ratings frame} of the given editions, all of them when fifa_editions is None """
+    fifa_ratings = {}
+    fifa_folder = FIFA_PATH
     for filename in os.listdir(fifa_folder):
-        fifa_input_file = fifa_folder + '/' + filename
-        all_fifa_dict['_'.join(filename.split('_')[:2])] = pd.read_csv(fifa_input_file)
+        fifa_edition = '_'.join(filename.split('_')[:2])
+        if fifa_editions is None or fifa_edition in fifa_editions:
+            fifa_ratings[fifa_edition] = pd.read_csv(fifa_folder + '/' + filename)
 
-    return all_fifa_dict
+    return fifa_ratings
+
+
+def build_fifa_indexes(fifa_ratings):
+    return {fifa_edition: FifaNameIndex(fifa_df) for fifa_edition, fifa_df in fifa_ratings.items()}
 
 
 def init_players_data_columns(matches_df):
-    matches_df['Home Avg Players Score'] = ''
-    matches_df['Away Avg Players Score'] = ''
-    matches_df['Home Star Player Count'] = ''
-    matches_df['Away Star Player Count'] = ''
-    matches_df['Players Found %'] = ''
+    matches_df['Home Avg Players Score'] = np.nan
+    matches_df['Away Avg Players Score'] = np.nan
+    matches_df['Home Star Player Count'] = 0
+    matches_df['Away Star Player Count'] = 0
+    matches_df['Players Found %'] = np.nan
 
 
 def get_relevant_fifa(all_fifa_dict, season):
+    return all_fifa_dict[season_fifa_edition(season)]
+
+
+def season_fifa_edition(season):
     year = season.split('-')[0]
     year_shortcut = year[2] + year[3]
-    return all_fifa_dict[f'fifa_{year_shortcut}']
+    return f'fifa_{year_shortcut}'
+
 
+def group_players_by_match(players_df):
+    """ the names of the players of every team, keyed by (match_id, is_home) """
+    players_by_match = {}
+    for match_id, is_home, player_name in zip(players_df['Game ID'].tolist(), players_df['Is Home'].tolist(),
+                                              players_df['Player'].tolist()):
+        players_by_match.setdefault((match_id, is_home), []).append(player_name)
+    return players_by_match
 
-def load_team_player_data(db_client, match_id, is_home):
-    return db_client.find_players_by_match_id_and_is_home(match_id, is_home)
 
+def load_team_player_data(players_by_match, match_id, is_home):
+    return players_by_match.get((int(match_id), is_home), [])
 
-def count_star_players(players, fifa_df, season):
+
+def count_star_players(players, fifa_index, season, star_rating=STAR_PLAYER_RATING):
     count = 0
     for player_name in players:
-        player = find_player(player_name, fifa_df, season)
+        player = find_player(player_name, fifa_index, season)
         if player['Overall'].empty:
             player_overall = 70
         elif player['Overall'].shape[0] > 1:
             player_overall = int(player['Overall'].values[0])
         else:
             player_overall = int(player['Overall'].values[0])
-        if player_overall >= 85:
+        if player_overall >= star_rating:
             count += 1
 
     return count
 
 
-def calculate_avg_score(players, fifa_df, season, statistics):
+def calculate_avg_score(players, fifa_index, season, statistics, star_rating=STAR_PLAYER_RATING,
+                        superstar_rating=SUPERSTAR_PLAYER_RATING):
     total_score = 0
     extra_weights = 0
     for player_name in players:
-        player = find_player(player_name, fifa_df, season)
+        player = find_player(player_name, fifa_index, season)
         if player['Overall'].empty:
             player_overall = 70
             statistics[0] += 1
@@ -216,10 +411,10 @@ def calculate_avg_score(players, fifa_df, season, statistics):
             statistics[2] += 1
 
         # 1 weight is already counted
-        if player_overall >= 90:
+        if player_overall >= superstar_rating:
             extra_weights += 9
             total_score += player_overall * 10
-        elif player_overall >= 85:
+        elif player_overall >= star_rating:
             extra_weights += 4
             total_score += player_overall * 5
         else:
@@ -228,22 +423,16 @@ def calculate_avg_score(players, fifa_df, season, statistics):
     return round(total_score / (len(players) + extra_weights), 2)
 
 
-player_cache = {}
+PLAYER_CACHE_SIZE = 65536
 
 
-def find_player(player_name, fifa_df, season):
-    cache_key = (player_name, season)
-    if cache_key in player_cache:
-        return player_cache[cache_key]
+@lru_cache(maxsize=PLAYER_CACHE_SIZE)
+def find_player(player_name, fifa_index, season):
+    return fifa_index.find(player_name)
 
-    # Perform the lookup
-    found_player = fifa_df[
-        fifa_df['Name'].apply(lambda x: all(part.lower() in x.lower() for part in player_name.split()))
-    ]
 
-    # Cache the result
-    player_cache[cache_key] = found_player
-    return found_player
+# Only counts the lookups of this process, the process executor looks players up in its workers
+register_cache('find_player', lambda: tuple(find_player.cache_info())[:2])
 
 
 # Function to calculate expected score from Bets
@@ -306,139 +495,176 @@ def load_premier_league_data(start_year, end_year, base_path='./resources'):
 
 
 def load_bets():
-    all_bets_dict = {}
-    bets_folder = RESOURCES_PATH + '/bets'
+    bets_folder = BETS_PATH
+    all_bets = []
     for filename in os.listdir(bets_folder):
-        bets_input_file = bets_folder + '/' + filename
-        all_bets_dict[filename.split('.')[0]] = pd.read_csv(bets_input_file)
+        bets_df = pd.read_csv(bets_folder + '/' + filename, usecols=BETS_DTYPES.keys(), dtype=BETS_DTYPES)
+        bets_df['Date'] = pd.to_datetime(bets_df['Date'], format=BETS_DATE_FORMAT).dt.strftime('%Y-%m-%d')
+        all_bets.append(bets_df)
 
-    return all_bets_dict
+    return pd.concat(all_bets, ignore_index=True)
 
 
-def add_aggregated_data(matches_df):
+def add_aggregated_data(matches_df, team_history_df=None):
+    """
+    Adds the rolling aggregates to matches_df. team_history_df is the team perspective frame of the matches that were
+    already processed, the new matches continue their history. Returns the team perspective frame of all matches.
+    """
     print('Adding aggregated data')
 
-    def calculate_points(row):
-        if row['G Home'] > row['G Away']:
-            return 3, 0  # Home win
-        elif row['G Home'] < row['G Away']:
-            return 0, 3  # Away win
-        else:
-            return 1, 1  # Draw
+    add_features(matches_df, ['Home Points', 'Away Points'])
+    matches_df['xG Home Diff'] = matches_df['G Home'].astype(float) - matches_df['xG Home']
+    matches_df['xG Away Diff'] = matches_df['G Away'].astype(float) - matches_df['xG Away']
+
+    initialize_aggregated_columns(matches_df)
 
-    matches_df[['Home Points', 'Away Points']] = matches_df.apply(calculate_points, axis=1, result_type='expand')
-    matches_df['xG Home Diff'] = matches_df['G Home'] - matches_df['xG Home']
-    matches_df['xG Away Diff'] = matches_df['G Away'] - matches_df['xG Away']
+    team_df = build_team_perspective_df(matches_df)
+    first_new_position = 0
+    if team_history_df is not None:
+        first_new_position = team_history_df['position'].max() + 1
+        team_df['position'] += first_new_position
+        team_df = pd.concat([team_history_df, team_df], ignore_index=True)
+
+    is_new = team_df['position'] >= first_new_position
+    is_home = is_new & (team_df['is_home'] == 1)
+    is_away = is_new & (team_df['is_home'] == 0)
+
+    matches_played = team_df.groupby('team', sort=False).cumcount()
+    matches_df['Home Matches Played'] = matches_played[is_home].to_numpy()
+    matches_df['Away Matches Played'] = matches_played[is_away].to_numpy()
+
+    for column_template, value_column, window, keys in AGGREGATED_FEATURES:
+        history_mean = calculate_history_mean(team_df, keys, value_column, window)
+        matches_df[column_template.format('Home')] = history_mean[is_home].to_numpy()
+        matches_df[column_template.format('Away')] = history_mean[is_away].to_numpy()
+
+    return team_df
+
+
+AGGREGATE_WINDOW = 50
+FORM_WINDOW = 5
+
+# (column template, team perspective value, window - None for the whole history, grouping keys)
+AGGREGATED_FEATURES = [
+    ('{} Avg Points', 'points', AGGREGATE_WINDOW, ['team']),
+    ('{} Avg Goals For', 'goals_for', AGGREGATE_WINDOW, ['team']),
+    ('{} Avg Goals Against', 'goals_against', AGGREGATE_WINDOW, ['team']),
+    ('xG {} Avg Diff', 'xg_diff', AGGREGATE_WINDOW, ['team']),
+    ('{} Points/Match', 'points', None, ['team']),
+    ('{} Form Points', 'points', FORM_WINDOW, ['team']),
+    ('{} Form Goals For', 'goals_for', FORM_WINDOW, ['team']),
+    ('{} Form Goals Against', 'goals_against', FORM_WINDOW, ['team']),
+    ('xG {} Form Diff', 'xg_diff', FORM_WINDOW, ['team']),
+    ('{} Head-to-Head Points', 'points', FORM_WINDOW, ['team', 'opponent']),
+    ('{} Head-to-Head Goals For', 'goals_for', FORM_WINDOW, ['team', 'opponent']),
+    ('{} Head-to-Head Goals Against', 'goals_against', FORM_WINDOW, ['team', 'opponent']),
+]
+
+
+AGGREGATED_COLUMNS = [
+    'Home Points', 'Away Points', 'xG Home Diff', 'xG Away Diff',
+    'Home Avg Points', 'Away Avg Points', 'Home Avg Goals For', 'Away Avg Goals For', 'Home Avg Goals Against',
+    'Away Avg Goals Against', 'Home Matches Played', 'Away Matches Played', 'Home Points/Match', 'Away Points/Match',
+    'Home Form Points', 'Away Form Points', 'Home Form Goals For', 'Away Form Goals For', 'Home Form Goals Against',
+    'Away Form Goals Against', 'Home Head-to-Head Points', 'Away Head-to-Head Points', 'Home Head-to-Head Goals For',
+    'Away Head-to-Head Goals For', 'Home Head-to-Head Goals Against', 'Away Head-to-Head Goals Against',
+    'xG Home Avg Diff', 'xG Home Form Diff', 'xG Away Avg Diff', 'xG Away Form Diff'
+]
+
+
+def build_team_perspective_df(matches_df):
+    """
+    Turns every match into two rows, one from the point of view of each team, ordered as the matches are. The goals
+    keep their nullable dtype, a match not played yet has missing goals.
+    """
+    position = np.arange(len(matches_df))
+    home_df = pd.DataFrame({
+        'position': position,
+        'game_id': matches_df['Game ID'].to_numpy(),
+        'is_home': 1,
+        'team': matches_df['Home'].to_numpy(),
+        'opponent': matches_df['Away'].to_numpy(),
+        'points': matches_df['Home Points'].to_numpy(),
+        'goals_for': matches_df['G Home'].array,
+        'goals_against': matches_df['G Away'].array,
+        'xg_diff': matches_df['xG Home Diff'].to_numpy()
+    })
+    away_df = pd.DataFrame({
+        'position': position,
+        'game_id': matches_df['Game ID'].to_numpy(),
+        'is_home': 0,
+        'team': matches_df['Away'].to_numpy(),
+        'opponent': matches_df['Home'].to_numpy(),
+        'points': matches_df['Away Points'].to_numpy(),
+        'goals_for': matches_df['G Away'].array,
+        'goals_against': matches_df['G Home'].array,
+        'xg_diff': matches_df['xG Away Diff'].to_numpy()
+    })
+    team_df = pd.concat([home_df, away_df], ignore_index=True)
+    return team_df.sort_values(['position', 'is_home'], ascending=[True, False], kind='stable', ignore_index=True)
+
+
+def calculate_history_mean(team_df, keys, value_column, window=None):
+    """
+    Mean of the previous `window` values of every group (the whole history when window is None), 0 when there is no
+    history yet. Like a plain sum / len, a missing value inside the window makes the mean missing.
+    """
+    group_keys = [team_df[key] for key in keys]
+    values = team_df[value_column].astype(float)
+    grouped = values.groupby(group_keys, sort=False)
+    rolling = grouped.expanding() if window is None else grouped.rolling(window, min_periods=1)
+    sums = rolling.sum().droplevel(list(range(len(keys)))).reindex(team_df.index)
+    non_missing = rolling.count().droplevel(list(range(len(keys)))).reindex(team_df.index)
+
+    window_size = team_df.groupby(keys, sort=False).cumcount() + 1
+    if window is not None:
+        window_size = window_size.clip(upper=window)
+    means = (sums / window_size).where(non_missing == window_size)
+
+    history_mean = means.groupby(group_keys, sort=False).shift()
+    history_mean[window_size == 1] = 0
+    return history_mean
 
-    def calculate_avg(lst, n=50):
-        if len(lst) == 0:
-            return 0
-        else:
-            return sum(lst[-n:]) / len(lst[-n:])
 
-    team_stats_history = {
-        team: {'points': [], 'goals_for': [], 'goals_against': [], 'xG_diff': []}
-        for team in pd.concat([matches_df['Home'], matches_df['Away']]).unique()
-    }
+def initialize_aggregated_columns(matches_df):
+    for column in AGGREGATED_COLUMNS[4:]:
+        matches_df[column] = 0
 
-    head_to_head_stats = {
-        (home, away): {'points': [], 'goals_for': [], 'goals_against': []}
-        for home in matches_df['Home'].unique() for away in matches_df['Away'].unique()
-    }
 
-    initialize_aggregated_columns(matches_df)
+def export_data(matches_df, path):
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    matches_df.reset_index(drop=True).to_csv(path, header=True, index=False, mode='w')
 
-    for index, row in matches_df.iterrows():
-        home_team = row['Home']
-        away_team = row['Away']
-
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Avg Points')] = calculate_avg(team_stats_history[home_team]['points'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Avg Points')] = calculate_avg(team_stats_history[away_team]['points'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Avg Goals For')] = calculate_avg(team_stats_history[home_team]['goals_for'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Avg Goals For')] = calculate_avg(team_stats_history[away_team]['goals_for'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Avg Goals Against')] = calculate_avg(team_stats_history[home_team]['goals_against'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Avg Goals Against')] = calculate_avg(team_stats_history[away_team]['goals_against'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Matches Played')] = len(team_stats_history[home_team]['points'])
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Matches Played')] = len(team_stats_history[away_team]['points'])
-        matches_df.iloc[index, matches_df.columns.get_loc('xG Home Avg Diff')] = calculate_avg(team_stats_history[home_team]['xG_diff'])
-        matches_df.iloc[index, matches_df.columns.get_loc('xG Away Avg Diff')] = calculate_avg(team_stats_history[away_team]['xG_diff'])
-
-        if len(team_stats_history[home_team]['points']) == 0:
-            matches_df.iloc[index, matches_df.columns.get_loc('Home Points/Match')] = 0
-        else:
-            matches_df.iloc[index, matches_df.columns.get_loc('Home Points/Match')] = sum(team_stats_history[home_team]['points']) / len(team_stats_history[home_team]['points'])
 
-        if len(team_stats_history[away_team]['points']) == 0:
-            matches_df.iloc[index, matches_df.columns.get_loc('Away Points/Match')] = 0
-        else:
-            matches_df.iloc[index, matches_df.columns.get_loc('Away Points/Match')] = sum(team_stats_history[away_team]['points']) / len(team_stats_history[away_team]['points'])
-
-        # Calculate form indicators (last 5 matches)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Form Points')] = calculate_avg(team_stats_history[home_team]['points'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Form Points')] = calculate_avg(team_stats_history[away_team]['points'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Form Goals For')] = calculate_avg(team_stats_history[home_team]['goals_for'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Form Goals For')] = calculate_avg(team_stats_history[away_team]['goals_for'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Form Goals Against')] = calculate_avg(team_stats_history[home_team]['goals_against'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Form Goals Against')] = calculate_avg(team_stats_history[away_team]['goals_against'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('xG Home Form Diff')] = calculate_avg(team_stats_history[home_team]['xG_diff'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('xG Away Form Diff')] = calculate_avg(team_stats_history[away_team]['xG_diff'], 5)
-
-        # Calculate head-to-head statistics (last 5 matches)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Head-to-Head Points')] = calculate_avg(head_to_head_stats[(home_team, away_team)]['points'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Head-to-Head Points')] = calculate_avg(head_to_head_stats[(away_team, home_team)]['points'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Head-to-Head Goals For')] = calculate_avg(head_to_head_stats[(home_team, away_team)]['goals_for'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Head-to-Head Goals For')] = calculate_avg(head_to_head_stats[(away_team, home_team)]['goals_for'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Home Head-to-Head Goals Against')] = calculate_avg(head_to_head_stats[(home_team, away_team)]['goals_against'], 5)
-        matches_df.iloc[index, matches_df.columns.get_loc('Away Head-to-Head Goals Against')] = calculate_avg(head_to_head_stats[(away_team, home_team)]['goals_against'], 5)
-
-        # Update stats history
-        team_stats_history[home_team]['points'].append(row['Home Points'])
-        team_stats_history[home_team]['goals_for'].append(row['G Home'])
-        team_stats_history[home_team]['goals_against'].append(row['G Away'])
-        team_stats_history[home_team]['xG_diff'].append(row['xG Home Diff'])
-        team_stats_history[away_team]['points'].append(row['Away Points'])
-        team_stats_history[away_team]['goals_for'].append(row['G Away'])
-        team_stats_history[away_team]['goals_against'].append(row['G Home'])
-        team_stats_history[away_team]['xG_diff'].append(row['xG Away Diff'])
-
-        # Update head-to-head stats history
-        head_to_head_stats[(home_team, away_team)]['points'].append(row['Home Points'])
-        head_to_head_stats[(home_team, away_team)]['goals_for'].append(row['G Home'])
-        head_to_head_stats[(home_team, away_team)]['goals_against'].append(row['G Away'])
-        head_to_head_stats[(away_team, home_team)]['points'].append(row['Away Points'])
-        head_to_head_stats[(away_team, home_team)]['goals_for'].append(row['G Away'])
-        head_to_head_stats[(away_team, home_team)]['goals_against'].append(row['G Home'])
+def append_data(matches_df, path):
+    columns = pd.read_csv(path, nrows=0).columns
+    matches_df.reindex(columns=columns).to_csv(path, header=False, index=False, mode='a')
 
 
-def initialize_aggregated_columns(matches_df):
-    matches_df['Home Avg Points'] = 0
-    matches_df['Away Avg Points'] = 0
-    matches_df['Home Avg Goals For'] = 0
-    matches_df['Away Avg Goals For'] = 0
-    matches_df['Home Avg Goals Against'] = 0
-    matches_df['Away Avg Goals Against'] = 0
-    matches_df['Home Matches Played'] = 0
-    matches_df['Away Matches Played'] = 0
-    matches_df['Home Points/Match'] = 0
-    matches_df['Away Points/Match'] = 0
-    matches_df['Home Form Points'] = 0
-    matches_df['Away Form Points'] = 0
-    matches_df['Home Form Goals For'] = 0
-    matches_df['Away Form Goals For'] = 0
-    matches_df['Home Form Goals Against'] = 0
-    matches_df['Away Form Goals Against'] = 0
-    matches_df['Home Head-to-Head Points'] = 0
-    matches_df['Away Head-to-Head Points'] = 0
-    matches_df['Home Head-to-Head Goals For'] = 0
-    matches_df['Away Head-to-Head Goals For'] = 0
-    matches_df['Home Head-to-Head Goals Against'] = 0
-    matches_df['Away Head-to-Head Goals Against'] = 0
-    matches_df['xG Home Avg Diff'] = 0
-    matches_df['xG Home Form Diff'] = 0
-    matches_df['xG Away Avg Diff'] = 0
-    matches_df['xG Away Form Diff'] = 0
+def load_team_history():
+    if not os.path.exists(TEAM_HISTORY_PATH) or not os.path.exists(MATCHES_FOR_MODELING_PATH):
+        return None
+    return pd.read_csv(TEAM_HISTORY_PATH, dtype={'game_id': str, 'team': str, 'opponent': str})
 
 
-def export_data(matches_df, path):
+def save_team_history(team_history_df):
     os.makedirs(OUTPUT_PATH, exist_ok=True)
-    matches_df.reset_index(drop=True).to_csv(path, header=True, index=False, mode='w')
+    team_history_df.to_csv(TEAM_HISTORY_PATH, header=True, index=False, mode='w')
+
+
+def load_refresh_state():
+    if not os.path.exists(REFRESH_STATE_PATH):
+        return None
+    with open(REFRESH_STATE_PATH) as f:
+        return json.load(f)
+
+
+def save_refresh_state(matches_df):
+    last_match = matches_df.iloc[-1]
+    refresh_state = {
+        'date': last_match['Date'],
+        'time': last_match['Time'],
+        'game_id': str(last_match['Game ID'])
+    }
+    with open(REFRESH_STATE_PATH, 'w') as f:
+        json.dump(refresh_state, f)
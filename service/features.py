@@ -0,0 +1,82 @@
+import inspect
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+ELO_HOME_WIN_THRESHOLD = 0.52
+ELO_AWAY_WIN_THRESHOLD = 0.48
+POWER_GAP = 10
+
+
+def elo_home_win_probability(home_elo, away_elo):
+    return 1 / (1 + 10 ** ((away_elo - home_elo) / 400))
+
+
+def home_away_label(home_wins, away_wins):
+    """ 1 where home_wins, -1 where away_wins, 0 otherwise """
+    return np.select([home_wins, away_wins], [1, -1], 0)
+
+
+def xscore_elo(matches_df, home_win_threshold=ELO_HOME_WIN_THRESHOLD, away_win_threshold=ELO_AWAY_WIN_THRESHOLD):
+    probability_home_win = elo_home_win_probability(matches_df['home_elo'].to_numpy(),
+                                                    matches_df['away_elo'].to_numpy())
+    return home_away_label(probability_home_win > home_win_threshold, probability_home_win < away_win_threshold)
+
+
+def xpower(matches_df, power_gap=POWER_GAP):
+    score_gap = (matches_df['Home Avg Players Score'] - matches_df['Away Avg Players Score']).to_numpy(dtype=float)
+    return home_away_label(score_gap > power_gap, -score_gap > power_gap)
+
+
+def xsuperpower(matches_df):
+    home_stars = matches_df['Home Star Player Count'].to_numpy()
+    away_stars = matches_df['Away Star Player Count'].to_numpy()
+    return home_away_label(home_stars > away_stars, away_stars > home_stars)
+
+
+def goals(matches_df, column):
+    """ the goals as floats, a match not played yet has NaN goals and counts as a draw """
+    return matches_df[column].to_numpy(dtype=float, na_value=np.nan)
+
+
+def home_points(matches_df):
+    home_goals, away_goals = goals(matches_df, 'G Home'), goals(matches_df, 'G Away')
+    return np.select([home_goals > away_goals, home_goals < away_goals], [3, 0], 1)
+
+
+def away_points(matches_df):
+    home_goals, away_goals = goals(matches_df, 'G Home'), goals(matches_df, 'G Away')
+    return np.select([home_goals > away_goals, home_goals < away_goals], [0, 3], 1)
+
+
+# Column -> function computing it from the matches frame, the keyword arguments of the function are its parameters
+FEATURES = {
+    'xScoreElo': xscore_elo,
+    'xPower': xpower,
+    'xSuperPower': xsuperpower,
+    'Home Points': home_points,
+    'Away Points': away_points,
+}
+
+
+def add_features(matches_df, columns, **params):
+    """
+    Adds the feature columns to matches_df. params override the default parameters of the features, every feature
+    takes the ones it declares.
+    """
+    for column in columns:
+        feature = FEATURES[column]
+        feature_params = {name: value for name, value in params.items()
+                          if name in inspect.signature(feature).parameters}
+        matches_df[column] = feature(matches_df, **feature_params)
+
+
+def sweep_feature(matches_df, column, **param_values):
+    """
+    Evaluates a feature for every combination of the given parameter values, returns a frame with a column per
+    combination, named by the tuple of its values in the order of the keyword arguments
+    """
+    names = list(param_values)
+    return pd.DataFrame({values: FEATURES[column](matches_df, **dict(zip(names, values)))
+                         for values in product(*param_values.values())}, index=matches_df.index)
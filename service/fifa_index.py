@@ -0,0 +1,46 @@
+from collections import defaultdict
+
+import numpy as np
+
+GRAM_SIZE = 3
+
+
+class FifaNameIndex:
+    """
+    Inverted index from the character trigrams of the lowercased FIFA player names to their row positions.
+
+    A lookup returns the same rows as checking that every part of the name is contained in the FIFA name: the trigrams
+    of the parts narrow the rows down by set intersection and only the remaining candidates are checked.
+    """
+
+    def __init__(self, fifa_df):
+        self.fifa_df = fifa_df
+        self.names = [str(name).lower() for name in fifa_df['Name'].tolist()]
+        self.grams = defaultdict(set)
+        for row_id, name in enumerate(self.names):
+            for gram in get_grams(name):
+                self.grams[gram].add(row_id)
+
+    def __getstate__(self):
+        # The index is cheaper to rebuild than to pickle, only the ratings are shipped to other processes
+        return {'fifa_df': self.fifa_df}
+
+    def __setstate__(self, state):
+        self.__init__(state['fifa_df'])
+
+    def find(self, player_name):
+        parts = [part.lower() for part in player_name.split()]
+        postings = [self.grams.get(gram, set()) for gram in {gram for part in parts for gram in get_grams(part)}]
+        if postings:
+            candidates = set.intersection(*sorted(postings, key=len))
+        else:
+            # Only parts shorter than a trigram, nothing to narrow the rows down with
+            candidates = range(len(self.names))
+
+        row_ids = [row_id for row_id in sorted(candidates)
+                   if all(part in self.names[row_id] for part in parts)]
+        return self.fifa_df.iloc[np.array(row_ids, dtype=int)]
+
+
+def get_grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
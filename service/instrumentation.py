@@ -0,0 +1,235 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+RUN_REPORT_PATH = 'output/run_report.json'
+PROFILES_PATH = 'output/profiles'
+# Seconds between two progress lines of a long loop
+PROGRESS_INTERVAL = 10
+
+# Cache name -> function returning the (hits, misses) of the cache so far
+caches = {}
+
+
+def register_cache(name, counts):
+    caches[name] = counts
+
+
+class Instrumentation:
+    """
+    Measurements of a run. Every stage records its wall time, its rows, the database statements and http requests made
+    from its thread, and the hits and misses of the registered caches while it ran. cProfile and tracemalloc slow the
+    stages down, so they only run for the stages named in profile_stages and trace_memory_stages ('all' for every
+    stage). The caches and tracemalloc are shared by the whole process, so the cache counts and the memory peak of a
+    stage include the stages listed in its concurrent_with. Only one cProfile profiler can be active at a time, enabling
+    a second one raises from Python 3.12, so the callers run their stages one after the other while profiling.
+    """
+
+    def __init__(self, profile_stages=(), trace_memory_stages=(), profiles_path=PROFILES_PATH):
+        self.profile_stages = set(profile_stages)
+        self.trace_memory_stages = set(trace_memory_stages)
+        self.profiles_path = profiles_path
+        self.started_at = time.time()
+        self.stages = []
+        self.totals = new_counters()
+        self.running = {}
+        self.tracing_stages = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """ measures the block as the stage name, yields its record so the block can add to it """
+        record = {'name': name, 'rows': rows, 'concurrent_with': []}
+        counters = new_counters()
+        parent_counters = getattr(self.local, 'counters', None)
+        self.local.counters = counters
+        caches_before = cache_counts()
+        profiler = cProfile.Profile() if is_selected(name, self.profile_stages) else None
+        trace_memory = is_selected(name, self.trace_memory_stages)
+        self.start_stage(record, trace_memory)
+
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['wall_seconds'] = round(time.perf_counter() - start, 3)
+            self.local.counters = parent_counters
+
+            record.update(counters)
+            record['caches'] = cache_deltas(caches_before, cache_counts())
+            if trace_memory:
+                record['memory_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            if profiler is not None:
+                record['profile'] = self.dump_profile(name, profiler)
+            self.finish_stage(record, trace_memory)
+
+    def is_profiling(self):
+        return bool(self.profile_stages)
+
+    def start_stage(self, record, trace_memory):
+        """ marks the stages of the other threads and this one as concurrent, and starts tracing memory if asked """
+        thread_id = threading.get_ident()
+        with self.lock:
+            for other_thread_id, other_record in self.running.values():
+                if other_thread_id != thread_id:
+                    other_record['concurrent_with'].append(record['name'])
+                    record['concurrent_with'].append(other_record['name'])
+            self.running[id(record)] = (thread_id, record)
+
+            if trace_memory:
+                if self.tracing_stages == 0:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                self.tracing_stages += 1
+
+    def finish_stage(self, record, trace_memory):
+        with self.lock:
+            del self.running[id(record)]
+            self.stages.append(record)
+
+            if trace_memory:
+                self.tracing_stages -= 1
+                if self.tracing_stages == 0:
+                    tracemalloc.stop()
+
+    def count_db_query(self):
+        counters = getattr(self.local, 'counters', None)
+        with self.lock:
+            self.totals['db_queries'] += 1
+            if counters is not None:
+                counters['db_queries'] += 1
+
+    def record_http_request(self, host, seconds):
+        counters = getattr(self.local, 'counters', None)
+        with self.lock:
+            add_http_request(self.totals, host, seconds)
+            if counters is not None:
+                add_http_request(counters, host, seconds)
+
+    def dump_profile(self, name, profiler):
+        os.makedirs(self.profiles_path, exist_ok=True)
+        path = os.path.join(self.profiles_path, f'{name}.prof')
+        profiler.dump_stats(path)
+        return path
+
+    def report(self):
+        with self.lock:
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+                'wall_seconds': round(time.time() - self.started_at, 3),
+                'stages': list(self.stages),
+                'totals': {**self.totals, 'caches': cache_deltas({}, cache_counts())}
+            }
+
+    def write_report(self, path=RUN_REPORT_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def new_counters():
+    return {'db_queries': 0, 'http': {}}
+
+
+def add_http_request(counters, host, seconds):
+    host_counters = counters['http'].setdefault(host, {'requests': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+    host_counters['requests'] += 1
+    host_counters['seconds'] = round(host_counters['seconds'] + seconds, 3)
+    host_counters['max_seconds'] = round(max(host_counters['max_seconds'], seconds), 3)
+
+
+def is_selected(name, stage_names):
+    return name in stage_names or 'all' in stage_names
+
+
+def cache_counts():
+    return {name: counts() for name, counts in caches.items()}
+
+
+def cache_deltas(before, after):
+    """ the hits, misses and hit rate of every cache that was used between the two counts """
+    deltas = {}
+    for name, (hits, misses) in after.items():
+        hits_before, misses_before = before.get(name, (0, 0))
+        hits, misses = hits - hits_before, misses - misses_before
+        if hits or misses:
+            deltas[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3)}
+    return deltas
+
+
+class Progress:
+    """ prints how far a loop got every `interval` seconds and when it is done, instead of a line per item """
+
+    def __init__(self, label, total=None, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.printed_done = None
+        self.started = self.printed = time.monotonic()
+
+    def advance(self, count=1):
+        self.done += count
+        now = time.monotonic()
+        if self.done == self.total or now - self.printed >= self.interval:
+            self.print_progress(now)
+
+    def finish(self):
+        """ prints the final count, unless the last line already has it """
+        if self.done != self.printed_done:
+            self.print_progress(time.monotonic())
+
+    def print_progress(self, now):
+        self.printed = now
+        self.printed_done = self.done
+        elapsed = now - self.started
+        of_total = f' of {self.total}' if self.total is not None else ''
+        rate = f', {self.done / elapsed:.1f}/s' if elapsed > 0 else ''
+        print(f'{self.label}: {self.done}{of_total} in {elapsed:.0f}s{rate}')
+
+
+instrumentation = None
+
+
+def get_instrumentation():
+    global instrumentation
+    if instrumentation is None:
+        instrumentation = Instrumentation()
+    return instrumentation
+
+
+def configure_instrumentation(profile_stages=(), trace_memory_stages=(), profiles_path=PROFILES_PATH):
+    global instrumentation
+    instrumentation = Instrumentation(profile_stages, trace_memory_stages, profiles_path)
+    return instrumentation
+
+
+def is_profiling():
+    """ whether some stage is profiled, the stages must not run concurrently then """
+    return get_instrumentation().is_profiling()
+
+
+def stage(name, rows=None):
+    return get_instrumentation().stage(name, rows)
+
+
+def count_db_query():
+    get_instrumentation().count_db_query()
+
+
+def record_http_request(host, seconds):
+    get_instrumentation().record_http_request(host, seconds)
+
+
+def write_run_report(path=RUN_REPORT_PATH):
+    get_instrumentation().write_report(path)
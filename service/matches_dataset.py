@@ -0,0 +1,120 @@
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+MATCHES_DATASET_PATH = 'output/matches_for_modeling'
+PARTITION_COLUMNS = ['League', 'Season']
+
+MATCHES_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('Game ID', pa.int64()),
+    ('Wk', pa.float64()),
+    ('Day', pa.string()),
+    ('Date', pa.date32()),
+    ('Time', pa.string()),
+    ('Home', pa.string()),
+    ('xG Home', pa.float64()),
+    ('G Home', pa.int8()),
+    ('Away', pa.string()),
+    ('xG Away', pa.float64()),
+    ('G Away', pa.int8()),
+    ('League', pa.string()),
+    ('Season', pa.string()),
+    ('Score', pa.int8()),
+    ('Match Link', pa.string()),
+    ('home_elo', pa.float64()),
+    ('away_elo', pa.float64()),
+    ('B365H', pa.float64()),
+    ('B365D', pa.float64()),
+    ('B365A', pa.float64()),
+    ('xScore', pa.int64()),
+    ('xScoreElo', pa.int64()),
+    ('Home Avg Players Score', pa.float64()),
+    ('Away Avg Players Score', pa.float64()),
+    ('Home Star Player Count', pa.int64()),
+    ('Away Star Player Count', pa.int64()),
+    ('Players Found %', pa.float64()),
+    ('xPower', pa.int64()),
+    ('xSuperPower', pa.int64()),
+    ('importance1', pa.float64()),
+    ('importance2', pa.float64()),
+    ('proj_score1', pa.float64()),
+    ('proj_score2', pa.float64()),
+    ('spi1', pa.float64()),
+    ('spi2', pa.float64()),
+    ('prob1', pa.float64()),
+    ('prob2', pa.float64()),
+    ('probtie', pa.float64()),
+    ('Home Points', pa.int64()),
+    ('Away Points', pa.int64()),
+    ('xG Home Diff', pa.float64()),
+    ('xG Away Diff', pa.float64()),
+    ('Home Avg Points', pa.float64()),
+    ('Away Avg Points', pa.float64()),
+    ('Home Avg Goals For', pa.float64()),
+    ('Away Avg Goals For', pa.float64()),
+    ('Home Avg Goals Against', pa.float64()),
+    ('Away Avg Goals Against', pa.float64()),
+    ('Home Matches Played', pa.int64()),
+    ('Away Matches Played', pa.int64()),
+    ('Home Points/Match', pa.float64()),
+    ('Away Points/Match', pa.float64()),
+    ('Home Form Points', pa.float64()),
+    ('Away Form Points', pa.float64()),
+    ('Home Form Goals For', pa.float64()),
+    ('Away Form Goals For', pa.float64()),
+    ('Home Form Goals Against', pa.float64()),
+    ('Away Form Goals Against', pa.float64()),
+    ('Home Head-to-Head Points', pa.float64()),
+    ('Away Head-to-Head Points', pa.float64()),
+    ('Home Head-to-Head Goals For', pa.float64()),
+    ('Away Head-to-Head Goals For', pa.float64()),
+    ('Home Head-to-Head Goals Against', pa.float64()),
+    ('Away Head-to-Head Goals Against', pa.float64()),
+    ('xG Home Avg Diff', pa.float64()),
+    ('xG Home Form Diff', pa.float64()),
+    ('xG Away Avg Diff', pa.float64()),
+    ('xG Away Form Diff', pa.float64()),
+])
+
+
+def to_arrow_table(matches_df):
+    """ casts matches_df to MATCHES_SCHEMA, missing values become nulls and a column that does not fit raises """
+    matches_df = matches_df.reset_index(drop=True).astype({'Date': 'datetime64[ns]'})
+    return pa.Table.from_pandas(matches_df, schema=MATCHES_SCHEMA, preserve_index=False)
+
+
+def export_matches_dataset(matches_df, path=MATCHES_DATASET_PATH):
+    """ writes matches_df as parquet files partitioned by league and season, replacing the dataset in path """
+    shutil.rmtree(path, ignore_errors=True)
+    append_matches_dataset(matches_df, path)
+
+
+def append_matches_dataset(matches_df, path=MATCHES_DATASET_PATH):
+    """ adds the files of matches_df to the partitions of the dataset in path, the files already there are kept """
+    pq.write_to_dataset(to_arrow_table(matches_df), path, partition_cols=PARTITION_COLUMNS,
+                        basename_template=f'part-{time.time_ns()}-{{i}}.parquet',
+                        existing_data_behavior='overwrite_or_ignore')
+
+
+def load_matches_dataset(columns=None, leagues=None, seasons=None, path=MATCHES_DATASET_PATH):
+    """
+    Reads the matches of the dataset in path into a data frame. The files are memory mapped, only the columns asked
+    for are read, and only the partitions of the leagues and seasons asked for are opened.
+    """
+    partitioning = ds.partitioning(pa.schema([MATCHES_SCHEMA.field(column) for column in PARTITION_COLUMNS]),
+                                   flavor='hive')
+    dataset = ds.dataset(path, schema=MATCHES_SCHEMA, format='parquet', partitioning=partitioning,
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    partition_filter = None
+    for column, values in zip(PARTITION_COLUMNS, [leagues, seasons]):
+        if values is not None:
+            condition = ds.field(column).isin(values)
+            partition_filter = condition if partition_filter is None else partition_filter & condition
+
+    return dataset.to_table(columns=columns, filter=partition_filter).to_pandas(date_as_object=False)
@@ -0,0 +1,134 @@
+import hashlib
+import inspect
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import pandas as pd
+
+from service import instrumentation
+
+STAGE_CACHE_PATH = 'cache/stages'
+# Cached outputs kept per stage, older ones are removed
+STAGE_CACHE_ENTRIES = 4
+PIPELINE_MAX_WORKERS = 4
+
+
+class Stage(NamedTuple):
+    """
+    A step of the modeling pipeline. run(matches_df, db_client) gets a copy of the input columns, adds the output
+    columns to it and may return an extra artifact, which is cached together with them. The cache key covers the input
+    columns, the source of the modules, the parameters and the fingerprint of the data the stage reads from elsewhere.
+    """
+    name: str
+    run: Callable
+    inputs: list
+    outputs: list
+    modules: list
+    params: dict = {}
+    depends_on: list = []
+    fingerprint: Optional[Callable] = None
+
+
+def run_stages(matches_df, stages, db_client, cache_path=STAGE_CACHE_PATH, max_workers=PIPELINE_MAX_WORKERS):
+    """
+    Runs the stages in waves: the stages whose dependencies are done run together, each on its own database
+    connection, and the ones whose key is in the cache are read back instead. While profiling the stages run one
+    after the other in this thread. The outputs are added to matches_df in the order of the stages. Returns
+    {stage name: extra artifact}.
+    """
+    artifacts = {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        submit = run_in_this_thread if instrumentation.is_profiling() else pool.submit
+        while pending:
+            wave = [stage for stage in pending if all(name in artifacts for name in stage.depends_on)]
+            if not wave:
+                raise ValueError(f'Stages with unknown or circular dependencies: {[stage.name for stage in pending]}')
+
+            keys = {stage.name: stage_key(stage, matches_df, db_client) for stage in wave}
+            results = {}
+            futures = {}
+            for stage in wave:
+                output_path = stage_output_path(cache_path, stage, keys[stage.name])
+                if os.path.exists(output_path):
+                    with instrumentation.stage(stage.name, rows=len(matches_df)) as record:
+                        record['cached'] = True
+                        results[stage.name] = pd.read_pickle(output_path)
+                    print(f'Stage {stage.name}: up to date')
+                else:
+                    print(f'Stage {stage.name}: running')
+                    futures[stage.name] = submit(run_stage, stage, matches_df[stage.inputs].copy(), db_client)
+
+            for stage in wave:
+                if stage.name in futures:
+                    results[stage.name] = futures[stage.name].result()
+                    if stage.fingerprint is not None:
+                        # The stage may have changed the data it read, the team aliases it matched, cache the output
+                        # under the state it left so that the next run finds it
+                        keys[stage.name] = stage_key(stage, matches_df, db_client)
+                    save_stage_output(cache_path, stage, keys[stage.name], results[stage.name])
+                outputs_df, artifacts[stage.name] = results[stage.name]
+                for column in stage.outputs:
+                    matches_df[column] = outputs_df[column]
+                pending.remove(stage)
+
+    return artifacts
+
+
+def run_stage(stage, stage_df, db_client):
+    # SQLite connections belong to the thread that opened them
+    stage_db_client = db_client.clone()
+    try:
+        with instrumentation.stage(stage.name, rows=len(stage_df)) as record:
+            record['cached'] = False
+            artifact = stage.run(stage_df, stage_db_client)
+    finally:
+        stage_db_client.close()
+    return stage_df[stage.outputs], artifact
+
+
+def run_in_this_thread(fn, *args):
+    """ runs fn now, the future holds what it returned or raised, as if a pool had run it """
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def stage_key(stage, matches_df, db_client):
+    digest = hashlib.sha256(stage.name.encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(matches_df[stage.inputs], index=True).to_numpy().tobytes())
+    digest.update(repr(stage.inputs).encode('utf-8'))
+    digest.update(repr(stage.outputs).encode('utf-8'))
+    for module in stage.modules:
+        digest.update(inspect.getsource(module).encode('utf-8'))
+    digest.update(repr(sorted(stage.params.items())).encode('utf-8'))
+    if stage.fingerprint is not None:
+        digest.update(repr(stage.fingerprint(db_client)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stage_output_path(cache_path, stage, key):
+    return os.path.join(cache_path, stage.name, f'{key}.pkl')
+
+
+def save_stage_output(cache_path, stage, key, result):
+    stage_path = os.path.join(cache_path, stage.name)
+    os.makedirs(stage_path, exist_ok=True)
+    pd.to_pickle(result, stage_output_path(cache_path, stage, key))
+
+    entries = sorted((os.path.join(stage_path, name) for name in os.listdir(stage_path)), key=os.path.getmtime)
+    for entry in entries[:-STAGE_CACHE_ENTRIES]:
+        os.remove(entry)
+
+
+def files_fingerprint(path):
+    """ the name, size and modification time of the file, or of every file under the directory """
+    if os.path.isfile(path):
+        return [(path, os.path.getsize(path), os.path.getmtime(path))]
+    return sorted((os.path.relpath(os.path.join(root, name), path), os.path.getsize(os.path.join(root, name)),
+                   os.path.getmtime(os.path.join(root, name)))
+                  for root, _, names in os.walk(path) for name in names)
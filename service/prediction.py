@@ -0,0 +1,280 @@
+import os
+import pickle
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from service.data_organizer import AGGREGATED_COLUMNS, AGGREGATED_FEATURES, BETS_ODDS_COLUMNS, TEAM_HISTORY_PATH, \
+    calculate_avg_score, calculate_xscore, count_star_players, group_players_by_match, load_all_fifa, \
+    load_team_history, load_team_player_data
+from service.features import add_features
+from service.team_registry import TeamRegistry
+
+MODEL_PATH = 'output/model.pkl'
+# Everything the model is trained on is known before kick-off. The SPI forecasts are left out, FiveThirtyEight does not
+# publish them for new fixtures anymore. The odds may be missing when predicting, a fallback model is trained without
+# them
+ELO_FEATURES = ['home_elo', 'away_elo', 'xScoreElo']
+PLAYERS_FEATURES = ['Home Avg Players Score', 'Away Avg Players Score', 'Home Star Player Count',
+                    'Away Star Player Count', 'xPower', 'xSuperPower']
+ODDS_FEATURES = BETS_ODDS_COLUMNS + ['xScore']
+MATCHES_PLAYED_FEATURE = ('{} Matches Played', None, None, ['team'])
+# The aggregates of the matches the teams played before, picked by name in the order of AGGREGATED_COLUMNS. The points
+# and xG differences of the match itself are aggregated columns too, but only known after it
+PRE_MATCH_AGGREGATED_COLUMNS = [
+    column for column in AGGREGATED_COLUMNS
+    if column in {column_template.format(side) for column_template, _, _, _ in [MATCHES_PLAYED_FEATURE] +
+                  AGGREGATED_FEATURES for side in ['Home', 'Away']}
+]
+MODEL_FEATURES = ELO_FEATURES + PLAYERS_FEATURES + ODDS_FEATURES + PRE_MATCH_AGGREGATED_COLUMNS
+# The first TRAIN_FRACTION of the matches in date order are used to measure the accuracy on the rest
+TRAIN_FRACTION = 0.8
+MODEL_RANDOM_STATE = 42
+FIXTURE_COLUMNS = ['Date', 'Home', 'Away']
+OUTCOMES = {1: 'home', 0: 'draw', -1: 'away'}
+
+
+def train_model(matches_df, features=MODEL_FEATURES, train_fraction=TRAIN_FRACTION):
+    """
+    Trains the random forest of models/simple.ipynb on the matches with all the features, and a fallback model without
+    the odds features for the fixtures that come without odds. It is trained on the matches with all of its features,
+    the ones without odds included.
+    """
+    matches_df = matches_df.sort_values(['Date', 'Time'], kind='stable')
+    model, matches_count, last_match_date, accuracy = fit_model(matches_df, features, train_fraction)
+    fallback_features = [feature for feature in features if feature not in ODDS_FEATURES]
+    if fallback_features == list(features):
+        fallback_model, fallback_matches_count, fallback_accuracy = model, matches_count, accuracy
+    else:
+        fallback_model, fallback_matches_count, _, fallback_accuracy = fit_model(matches_df, fallback_features,
+                                                                                 train_fraction)
+
+    return {
+        'model': model,
+        'features': list(features),
+        'matches': matches_count,
+        'last_match_date': last_match_date,
+        'accuracy': accuracy,
+        'fallback_model': fallback_model,
+        'fallback_features': fallback_features,
+        'fallback_matches': fallback_matches_count,
+        'fallback_accuracy': fallback_accuracy,
+        'trained_at': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def fit_model(matches_df, features, train_fraction):
+    """
+    (model, matches, last match date, accuracy) of a random forest fit on the matches with all the features. The
+    accuracy is measured with the first train_fraction of them in date order against the rest, then the model is fit
+    on all of them.
+    """
+    matches_df = matches_df.dropna(subset=features + ['Score'])
+    x, y = matches_df[features].to_numpy(dtype=float), matches_df['Score'].to_numpy(dtype=int)
+    train_size = int(train_fraction * len(x))
+
+    model = RandomForestClassifier(random_state=MODEL_RANDOM_STATE).fit(x[:train_size], y[:train_size])
+    accuracy = float((model.predict(x[train_size:]) == y[train_size:]).mean()) if train_size < len(x) else None
+    model = RandomForestClassifier(random_state=MODEL_RANDOM_STATE).fit(x, y)
+
+    return model, len(x), matches_df['Date'].iloc[-1], round(accuracy, 4) if accuracy is not None else None
+
+
+def save_model(model_bundle, path=MODEL_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(model_bundle, f)
+
+
+def load_model(path=MODEL_PATH):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class Predictor:
+    """
+    Predicts upcoming fixtures from state that is built once: the trained model, the aggregates the next match of every
+    team gets, the latest Elo rating and lineup of every team and the FIFA ratings. A batch of fixtures costs a few
+    dictionary lookups per fixture and a single call to the model.
+    """
+
+    def __init__(self, model_bundle, team_history_df, elo_by_team, lineups_by_team, all_fifa_dict):
+        self.model_bundle = model_bundle
+        self.model = model_bundle['model']
+        self.features = model_bundle['features']
+        # Models saved before the fallback existed can only predict fixtures with odds
+        self.fallback_model = model_bundle.get('fallback_model')
+        self.fallback_features = model_bundle.get('fallback_features')
+        self.team_state = build_team_state(team_history_df)
+        self.elo_by_team = elo_by_team
+        self.lineups_by_team = lineups_by_team
+        self.all_fifa_dict = all_fifa_dict
+        # (team, FIFA edition) -> (average players score, star players), filled as fixtures come
+        self.players_scores = {}
+
+    def predict(self, fixtures_df):
+        """
+        the predicted outcome of every fixture, with the probability of each one. The fixtures without all the odds are
+        predicted by the fallback model.
+        """
+        fixtures_df = build_fixture_features(self, fixtures_df)
+        has_odds = fixtures_df[BETS_ODDS_COLUMNS].notna().all(axis=1).to_numpy()
+        if not has_odds.all() and self.fallback_model is None:
+            raise ValueError('The model needs the odds of every fixture, train it again to predict fixtures without')
+
+        # The probabilities of the outcomes in the order of OUTCOMES
+        probabilities = np.zeros((len(fixtures_df), len(OUTCOMES)))
+        for model, features, rows in [(self.model, self.features, has_odds),
+                                      (self.fallback_model, self.fallback_features, ~has_odds)]:
+            if rows.any():
+                model_probabilities = model.predict_proba(fixtures_df.loc[rows, features].to_numpy(dtype=float))
+                probabilities[rows] = model_probabilities[:, [list(model.classes_).index(outcome)
+                                                              for outcome in OUTCOMES]]
+
+        predictions_df = fixtures_df[FIXTURE_COLUMNS].copy()
+        predictions_df['Prediction'] = [list(OUTCOMES.values())[i] for i in probabilities.argmax(1)]
+        for i, column in enumerate(['Prob Home', 'Prob Draw', 'Prob Away']):
+            predictions_df[column] = probabilities[:, i].round(4)
+        return predictions_df
+
+    def players_score(self, team, season):
+        """ the average players score and star players count of the latest lineup of the team in the season """
+        fifa_edition = get_fifa_edition(self.all_fifa_dict, season)
+        if (team, fifa_edition) not in self.players_scores:
+            players = self.lineups_by_team.get(team, [])
+            fifa_index = self.all_fifa_dict[fifa_edition]
+            if players:
+                avg_score = calculate_avg_score(players, fifa_index, season, [0, 0, 0])
+                star_player_count = count_star_players(players, fifa_index, season)
+            else:
+                avg_score, star_player_count = np.nan, 0
+            self.players_scores[(team, fifa_edition)] = (avg_score, star_player_count)
+        return self.players_scores[(team, fifa_edition)]
+
+
+def load_predictor(db_client, model_path=MODEL_PATH):
+    """ a Predictor with the saved model and the state of the last run of the pipeline """
+    team_history_df = load_team_history()
+    if team_history_df is None:
+        raise FileNotFoundError(f'{TEAM_HISTORY_PATH} is missing, run main.py first')
+
+    teams = pd.unique(team_history_df['team'])
+    predictor = Predictor(load_model(model_path), team_history_df, find_latest_elo(db_client, teams),
+                          find_latest_lineups(db_client), load_all_fifa())
+    # The FIFA ratings of the running season are the ones most fixtures need
+    current_season = get_season(date.today().isoformat())
+    for team in teams:
+        predictor.players_score(team, current_season)
+    return predictor
+
+
+def build_team_state(team_history_df):
+    """
+    What add_aggregated_data would give the next match of every team: {column template: {group key: value}}, the key
+    is the team, or the (team, opponent) pair for the head-to-head aggregates
+    """
+    team_df = team_history_df.sort_values(['position', 'is_home'], ascending=[True, False], kind='stable')
+    team_state = {MATCHES_PLAYED_FEATURE[0]: team_df.groupby('team', sort=False).size().to_dict()}
+    for column_template, value_column, window, keys in AGGREGATED_FEATURES:
+        team_state[column_template] = next_match_means(team_df, keys, value_column, window)
+    return team_state
+
+
+def next_match_means(team_df, keys, value_column, window=None):
+    """
+    {group key: mean of the last `window` values of the group}, missing when one of them is, like
+    calculate_history_mean gives it to the next match of the group
+    """
+    recent_df = team_df if window is None else team_df.groupby(keys, sort=False).tail(window)
+    grouped = recent_df.groupby(keys, sort=False)[value_column]
+    sizes = grouped.size()
+    means = (grouped.sum() / sizes).where(grouped.count() == sizes)
+    return means.to_dict()
+
+
+def build_fixture_features(predictor, fixtures_df):
+    """ the fixtures with every feature of the model, the odds are taken from the fixtures when they have them """
+    missing_columns = [column for column in FIXTURE_COLUMNS if column not in fixtures_df.columns]
+    if missing_columns:
+        raise ValueError(f'The fixtures miss the columns: {missing_columns}')
+
+    fixtures_df = fixtures_df.reset_index(drop=True).copy()
+    fixtures_df['Date'] = fixtures_df['Date'].astype(str)
+    known_teams = set(predictor.team_state[MATCHES_PLAYED_FEATURE[0]])
+    unknown_teams = set(fixtures_df['Home']).union(fixtures_df['Away']) - known_teams
+    if unknown_teams:
+        print(f'No history for teams: {", ".join(sorted(unknown_teams))}')
+
+    homes, aways = fixtures_df['Home'].tolist(), fixtures_df['Away'].tolist()
+    # The columns are gathered first and added at once, inserting them one by one costs more than the lookups
+    features = {}
+    for column_template, _, _, keys in [MATCHES_PLAYED_FEATURE] + AGGREGATED_FEATURES:
+        values = predictor.team_state[column_template]
+        if keys == ['team']:
+            home_keys, away_keys = homes, aways
+        else:
+            home_keys, away_keys = list(zip(homes, aways)), list(zip(aways, homes))
+        # No history yet gives 0, as for the first match of a team
+        features[column_template.format('Home')] = [values.get(key, 0) for key in home_keys]
+        features[column_template.format('Away')] = [values.get(key, 0) for key in away_keys]
+
+    features['home_elo'] = [predictor.elo_by_team.get(team, 0) for team in homes]
+    features['away_elo'] = [predictor.elo_by_team.get(team, 0) for team in aways]
+
+    seasons = [get_season(fixture_date) for fixture_date in fixtures_df['Date']]
+    home_scores = [predictor.players_score(team, season) for team, season in zip(homes, seasons)]
+    away_scores = [predictor.players_score(team, season) for team, season in zip(aways, seasons)]
+    features['Home Avg Players Score'], features['Home Star Player Count'] = zip(*home_scores)
+    features['Away Avg Players Score'], features['Away Star Player Count'] = zip(*away_scores)
+
+    odds = pd.DataFrame({column: pd.to_numeric(fixtures_df[column]) if column in fixtures_df.columns else np.nan
+                         for column in BETS_ODDS_COLUMNS}, index=fixtures_df.index)
+    features.update(odds)
+    features['xScore'] = calculate_xscore(odds.to_numpy(dtype=float))
+
+    fixtures_df = pd.concat([fixtures_df.drop(columns=[column for column in features if column in fixtures_df]),
+                             pd.DataFrame(features, index=fixtures_df.index)], axis=1)
+    add_features(fixtures_df, ['xScoreElo', 'xPower', 'xSuperPower'])
+    return fixtures_df
+
+
+def find_latest_elo(db_client, teams):
+    """ {team: Elo rating in the latest snapshot}, 0 for the teams it does not have, as the ClubElo scraper does """
+    latest_date = db_client.find_latest_elo_snapshot_date()
+    if latest_date is None:
+        return {}
+
+    elo_df = db_client.find_elo_snapshot(latest_date).drop_duplicates('Club')
+    elo_by_club = dict(zip(elo_df['Club'], elo_df['Elo']))
+    clubs = list(elo_by_club)
+    team_registry = TeamRegistry(db_client)
+    return {team: elo_by_club.get(team_registry.match_team_name(team, 'clubelo', clubs), 0) for team in teams}
+
+
+def find_latest_lineups(db_client):
+    """ {team: the players of its last match} """
+    matches_df = db_client.find_all_matches()
+    last_matches = {}
+    for game_id, home, away in zip(matches_df['Game ID'], matches_df['Home'], matches_df['Away']):
+        last_matches[home] = (game_id, 1)
+        last_matches[away] = (game_id, 0)
+
+    players_by_match = group_players_by_match(
+        db_client.find_players_by_match_ids([game_id for game_id, _ in last_matches.values()]))
+    return {team: load_team_player_data(players_by_match, game_id, is_home)
+            for team, (game_id, is_home) in last_matches.items()}
+
+
+def get_season(match_date):
+    """ the season of a 'YYYY-MM-DD' date, seasons start in July """
+    year, month = int(match_date[:4]), int(match_date[5:7])
+    start_year = year if month >= 7 else year - 1
+    return f'{start_year}-{start_year + 1}'
+
+
+def get_fifa_edition(all_fifa_dict, season):
+    """ the FIFA edition of the season, the latest one when there is none for it """
+    fifa_edition = f'fifa_{season[2:4]}'
+    return fifa_edition if fifa_edition in all_fifa_dict else max(all_fifa_dict)
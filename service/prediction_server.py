@@ -0,0 +1,62 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+PREDICTION_HOST = '127.0.0.1'
+PREDICTION_PORT = 8765
+MAX_REQUEST_BYTES = 1 << 20
+# What GET /health tells about the model, a model saved before the fallback existed has no fallback keys
+MODEL_INFO_KEYS = ['matches', 'last_match_date', 'accuracy', 'fallback_matches', 'fallback_accuracy', 'trained_at']
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with {"fixtures": [{"Date": "YYYY-MM-DD", "Home": ..., "Away": ..., optionally "B365H", "B365D",
+    "B365A"}]} answers {"predictions": [...]} in the same order. GET /health describes the loaded model.
+    """
+    predictor = None
+    # Predictions run one at a time, the predictor fills its cache of players scores as fixtures come
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'error': f'Unknown path: {self.path}'})
+        model_bundle = self.predictor.model_bundle
+        self.send_json(200, {'status': 'ok', **{key: model_bundle[key] for key in MODEL_INFO_KEYS
+                                                if key in model_bundle}})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self.send_json(404, {'error': f'Unknown path: {self.path}'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_BYTES:
+            return self.send_json(413, {'error': f'Requests are limited to {MAX_REQUEST_BYTES} bytes'})
+        try:
+            fixtures = json.loads(self.rfile.read(length))['fixtures']
+            with self.lock:
+                predictions_df = self.predictor.predict(pd.DataFrame(fixtures))
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_json(400, {'error': str(e)})
+
+        self.send_json(200, {'predictions': predictions_df.to_dict('records')})
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # One line per request would drown the output of a busy client
+        pass
+
+
+def make_prediction_server(predictor, host=PREDICTION_HOST, port=PREDICTION_PORT):
+    """ an http server answering with the predictor, port 0 picks a free port """
+    handler = type('BoundPredictionHandler', (PredictionHandler,), {'predictor': predictor})
+    return ThreadingHTTPServer((host, port), handler)
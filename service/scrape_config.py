@@ -0,0 +1,30 @@
+import json
+import re
+from typing import NamedTuple
+
+SCRAPE_CONFIG_PATH = 'scrape_config.json'
+SEASON_FORMAT = re.compile(r'(\d{4})-(\d{4})')
+
+
+class ScrapeConfig(NamedTuple):
+    """ What to scrape: leagues maps the FBref name of every league to its competition id, seasons are 'YYYY-YYYY' """
+    leagues: dict
+    seasons: list
+
+
+def load_scrape_config(path=SCRAPE_CONFIG_PATH):
+    with open(path) as f:
+        config = json.load(f)
+
+    leagues = config.get('leagues')
+    if not isinstance(leagues, dict) or not leagues:
+        raise ValueError(f'{path}: leagues must map league names to FBref competition ids')
+    seasons = config.get('seasons')
+    if not isinstance(seasons, list) or not seasons:
+        raise ValueError(f'{path}: seasons must be a list of seasons')
+    for season in seasons:
+        match = SEASON_FORMAT.fullmatch(str(season))
+        if match is None or int(match.group(2)) != int(match.group(1)) + 1:
+            raise ValueError(f'{path}: unknown season format: {season}, expected YYYY-YYYY')
+
+    return ScrapeConfig({str(league): str(league_id) for league, league_id in leagues.items()}, seasons)
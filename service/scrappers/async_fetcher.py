@@ -0,0 +1,112 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from service.instrumentation import record_http_request
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    """
+    Downloads pages over a pool of persistent connections. Every host gets its own token bucket and a bound on the
+    number of requests in flight, so pages of different hosts never wait for each other. Pages found in the cache are
+    returned without touching the network or the rate limit.
+    """
+
+    def __init__(self, requests_per_second, max_concurrency_per_host=2, burst=1, headers=None, timeout=60, cache=None,
+                 source=None):
+        self.requests_per_second = requests_per_second
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.burst = burst
+        self.headers = headers or DEFAULT_HEADERS
+        self.timeout = timeout
+        self.cache = cache
+        self.source = source
+        self.session = None
+        self.buckets = {}
+        self.semaphores = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency_per_host)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def fetch(self, url, ttl=None):
+        if self.cache is not None:
+            text = self.cache.lookup(url, ttl)
+            if text is not None:
+                return text
+
+        text = await self.download(url)
+        if self.cache is not None:
+            self.cache.store(url, self.source, text)
+        return text
+
+    async def download(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            self.semaphores[host] = asyncio.Semaphore(self.max_concurrency_per_host)
+
+        async with self.semaphores[host]:
+            await self.buckets[host].acquire()
+            # The latency starts once the rate limit lets the request go
+            start = time.perf_counter()
+            try:
+                async with self.session.get(url) as response:
+                    response.raise_for_status()
+                    return await response.text()
+            finally:
+                record_http_request(host, time.perf_counter() - start)
+
+    async def fetch_all(self, urls, return_exceptions=False):
+        """
+        yields (url, html) pairs in the order the downloads finish, with return_exceptions a failed download yields
+        (url, exception) instead of raising
+        """
+        async def fetch_with_url(url):
+            try:
+                return url, await self.fetch(url)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return url, e
+
+        tasks = [asyncio.create_task(fetch_with_url(url)) for url in urls]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -1,73 +1,104 @@
+import asyncio
+import datetime
 import time
 from io import StringIO
 
 import pandas as pd
 import requests
-import requests_cache
-from fuzzywuzzy import process
 
-requests_cache.install_cache('elo_cache', expire_after=None)
+from service.instrumentation import Progress
+from service.scrappers.async_fetcher import AsyncFetcher
+from service.scrappers.http_cache import CURRENT_SEASON_TTL, get_http_cache
+from service.team_registry import TeamRegistry
 
-SPECIAL_MATCHES = {
-    "Arminia": "Bielefeld",
-    "Athletic Club": "Bilbao",
-    "Atlético Madrid": "Atletico",
-    "Greuther Fürth": "Fuerth",
-    "Köln": "Koeln",
-    "Manchester Utd": "Man United"
-}
+CLUBELO_URL = 'http://api.clubelo.com/{date}'
+# Politeness budget: one snapshot every CLUBELO_REQUEST_INTERVAL seconds
+CLUBELO_REQUEST_INTERVAL = 1
+CLUBELO_MAX_CONCURRENCY = 2
 
 
 # Match team names using fuzzy matching from Elo results
 def scrap_clubelo_to_database(db_client):
     db_client.add_elo_columns_if_not_exists()
     matches_df = db_client.find_all_matches_filtered()
+    snapshot_dates = db_client.find_elo_snapshot_dates()
+    team_registry = TeamRegistry(db_client)
+
+    elo_ratings = []
+    progress = Progress('Elo ratings fetched for matches', matches_df.shape[0])
+    for date, date_matches_df in matches_df.groupby('date'):
+        elo_data = load_elo_snapshot(db_client, date, snapshot_dates)
+        unique_clubs_df = elo_data.drop_duplicates('Club')
+        elo_by_club = dict(zip(unique_clubs_df['Club'], unique_clubs_df['Elo']))
+        clubs = list(elo_by_club)
+
+        for game_id, home, away in zip(date_matches_df['game_id'], date_matches_df['home'], date_matches_df['away']):
+            # Match team names to Elo data
+            home_elo_team = team_registry.match_team_name(home, 'clubelo', clubs)
+            away_elo_team = team_registry.match_team_name(away, 'clubelo', clubs)
+
+            # Get Elo ratings from the matched teams
+            elo_ratings.append((elo_by_club.get(home_elo_team, 0), elo_by_club.get(away_elo_team, 0), game_id))
+        progress.advance(date_matches_df.shape[0])
+
+    db_client.update_many_elo_ratings(elo_ratings)
+    db_client.commit_changes()
 
-    for _, match in matches_df.iterrows():
-        game_id = match['game_id']
-        home = match['home']
-        away = match['away']
-        date = match['date']
-        print(f"Fetching Elo ratings for match {game_id}, {date}, {home} vs {away}")
-
-        # Fetch Elo ratings for the specific match date
-        elo_data = fetch_elo_ratings(date)
+    print("Clubelo update complete")
 
-        # Match team names to Elo data
-        home_elo_team = match_team_name(home, elo_data)
-        away_elo_team = match_team_name(away, elo_data)
 
-        # Get Elo ratings from the matched teams
-        home_elo = elo_data.loc[elo_data['Club'] == home_elo_team, 'Elo'].values
-        away_elo = elo_data.loc[elo_data['Club'] == away_elo_team, 'Elo'].values
+def prefetch_elo_snapshots(db_client):
+    asyncio.run(prefetch_elo_snapshots_async(db_client))
 
-        home_elo_value = home_elo[0] if len(home_elo) > 0 else 0
-        away_elo_value = away_elo[0] if len(away_elo) > 0 else 0
 
-        print(f"Elo values: {home_elo_value}, {away_elo_value}")
+async def prefetch_elo_snapshots_async(db_client):
+    """
+    Downloads the snapshots of the past fixture dates that are not stored yet within the ClubElo budget, so that
+    scrap_clubelo_to_database finds them in the snapshot store. A date that fails is left to it.
+    """
+    today = datetime.date.today().isoformat()
+    snapshot_dates = db_client.find_elo_snapshot_dates()
+    dates = {CLUBELO_URL.format(date=date): date for date in db_client.find_fixture_dates()
+             if date < today and date not in snapshot_dates}
+    if not dates:
+        return
 
-        db_client.update_elo_ratings(home_elo_value, away_elo_value, game_id)
+    progress = Progress('Elo snapshots prefetched', len(dates))
+    async with AsyncFetcher(1 / CLUBELO_REQUEST_INTERVAL, CLUBELO_MAX_CONCURRENCY, cache=get_http_cache(),
+                            source='clubelo') as fetcher:
+        async for url, text in fetcher.fetch_all(dates, return_exceptions=True):
+            if isinstance(text, Exception):
+                print(f'Error in Elo snapshot {dates[url]}: {text}')
+            else:
+                db_client.persist_elo_snapshot(dates[url], pd.read_csv(StringIO(text)))
+            progress.advance()
+    progress.finish()
 
-        # Throttle the requests to avoid hitting the API too hard
-        time.sleep(1)
 
-    db_client.commit_changes()
+def load_elo_snapshot(db_client, date, snapshot_dates):
+    """ Elo ratings of all the clubs on that date, downloaded once and then read from the snapshot store """
+    if date in snapshot_dates:
+        return db_client.find_elo_snapshot(date)
 
-    print("Clubelo update complete")
+    elo_data = fetch_elo_ratings(date)
+    # The ratings of past days are final
+    if date < datetime.date.today().isoformat():
+        db_client.persist_elo_snapshot(date, elo_data)
+    return elo_data
 
 
 def fetch_elo_ratings(date):
-    url = f"http://api.clubelo.com/{date}"
+    url = CLUBELO_URL.format(date=date)
+    # The ratings of past days are final
+    ttl = None if date < datetime.date.today().isoformat() else CURRENT_SEASON_TTL
+    return pd.read_csv(StringIO(get_http_cache().fetch(url, 'clubelo', download_page, ttl)))
+
+
+def download_page(url):
+    """ only called on a cache miss, so the pages served from the cache are not throttled """
     response = requests.get(url)
     response.raise_for_status()
-    return pd.read_csv(StringIO(response.text))
-
 
-def match_team_name(name, elo_data):
-    if name in SPECIAL_MATCHES:
-        return SPECIAL_MATCHES[name]
-    teams = elo_data['Club'].tolist()
-    match, score = process.extractOne(name, teams)
-    if score > 80:  # Adjust the threshold as needed
-        return match
-    return None
+    # Throttle the requests to avoid hitting the API too hard
+    time.sleep(CLUBELO_REQUEST_INTERVAL)
+    return response.text
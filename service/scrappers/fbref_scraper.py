@@ -1,53 +1,133 @@
-import random
+import asyncio
+import re
 import time
-from datetime import datetime
 from functools import reduce
+from io import StringIO
 
+import lxml.html
 import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup as soup
 
-LEAGUES = {
-    'Premier-League': '9',
-    'Serie-A': '11',
-    'La-Liga': '12',
-    'Ligue-1': '13',
-    'Bundesliga': '20'
-}
-SEASONS = ['2019-2020', '2020-2021', '2021-2022', '2022-2023', '2023-2024']
+from db.datamodels.match import make_game_id, make_match_key
+from service.instrumentation import Progress
+from service.scrappers.async_fetcher import AsyncFetcher
+from service.scrappers.http_cache import get_current_season, get_http_cache, season_ttl
+
+FBREF_BASE_URL = 'https://fbref.com'
+# Politeness budget: one page every FBREF_REQUEST_INTERVAL seconds
+FBREF_REQUEST_INTERVAL = 5
+FBREF_MAX_CONCURRENCY = 2
+SCRAPE_TASKS_BATCH_SIZE = 20
+SCRAPE_MAX_ATTEMPTS = 5
+SCRAPE_BACKOFF_SECONDS = 30
+# Ids of the tables holding the fixtures of a schedule page and the lineup of a team in a match report, the team id
+# comes from the summary table
+SCHEDULE_TABLE_ID_PREFIX = 'sched_'
+SUMMARY_TABLE_ID = re.compile(r'stats_(\w+)_summary')
+KEEPER_TABLE_ID = 'keeper_stats_{team_id}'
+
+
+def scrap_fbref(db_client, leagues, seasons, on_enqueued=None):
+    asyncio.run(scrap_fbref_async(db_client, leagues, seasons, on_enqueued))
+
+
+async def scrap_fbref_async(db_client, leagues, seasons, on_enqueued=None):
+    """
+    Scraps the matches of the seasons of the leagues, given as {league name: FBref competition id}. on_enqueued is
+    called once the scrape tasks of all the seasons are in the database. The tasks that failed in an earlier run are
+    tried again.
+    """
+    db_client.reset_in_progress_scrape_tasks()
+    retried_count = db_client.retry_failed_scrape_tasks()
+    if retried_count:
+        print(f'Retrying {retried_count} match reports that failed in an earlier run')
+    async with AsyncFetcher(1 / FBREF_REQUEST_INTERVAL, FBREF_MAX_CONCURRENCY, cache=get_http_cache(),
+                            source='fbref') as fetcher:
+        for league, league_id in leagues.items():
+            for season in seasons:
+                try:
+                    await enqueue_season(db_client, fetcher, league, league_id, season)
+                except Exception as e:
+                    print(f'Error: could not enqueue league: {league} and season: {season}: {e}')
+        if on_enqueued is not None:
+            on_enqueued()
+
+        await scrap_match_reports(db_client, fetcher)
+
+
+async def enqueue_season(db_client, fetcher, league, league_id, season):
+    """
+    adds a scrape task for every match of the season that is neither in the database nor queued yet. The schedule of a
+    finished season is read once, the one of the running season again once its cached page expires.
+    """
+    if db_client.is_scrape_season_enqueued(league, season) and season != get_current_season():
+        return
 
+    print(f'Start scrapping league: {league} and season: {season}')
+
+    url = f'{FBREF_BASE_URL}/en/comps/{league_id}/{season}/schedule/{season}-{league}-Scores-and-Fixtures'
+    html = await fetcher.fetch(url, season_ttl(season))
+    matches_df = await asyncio.get_running_loop().run_in_executor(None, parse_matches_page, html, league, season)
+    queued_links = db_client.find_scrape_task_links(league, season)
+    new_matches = [match_link not in queued_links and not db_client.match_exists(league, season, date, home, away)
+                   for date, home, away, match_link in
+                   zip(matches_df['Date'], matches_df['Home'], matches_df['Away'], matches_df['Match Link'])]
+    db_client.enqueue_scrape_tasks(league, season, matches_df[new_matches])
+
+    print(f'Enqueued {sum(new_matches)} matches for league: {league} and season: {season}')
+
+
+async def scrap_match_reports(db_client, fetcher):
+    """
+    Works through the pending scrape tasks until none is left. A report is parsed and persisted as soon as it arrives
+    while the next ones are being downloaded, a failed task is retried with backoff.
+    """
+    loop = asyncio.get_running_loop()
+    progress = Progress('Match reports scraped')
+    while True:
+        tasks = db_client.claim_scrape_tasks(SCRAPE_TASKS_BATCH_SIZE)
+        if not tasks:
+            next_attempt_at = db_client.next_scrape_task_attempt_at()
+            if next_attempt_at is None:
+                break
+            await asyncio.sleep(max(0, next_attempt_at - time.time()))
+            continue
 
-def scrap_fbref(db_client):
-    for league in LEAGUES.keys():
-        for season in SEASONS:
-            print(f'Start scrapping league: {league} and season: {season}')
+        match_rows = {match_row['Match Link']: (task_id, match_row) for task_id, match_row in tasks}
+        async for match_link, match_html in fetcher.fetch_all(match_rows, return_exceptions=True):
+            task_id, match_row = match_rows[match_link]
+            try:
+                if isinstance(match_html, Exception):
+                    raise match_html
 
-            url = f'https://fbref.com/en/comps/{LEAGUES[league]}/{season}/schedule/{season}-{league}-Scores-and-Fixtures'
-            matches_df = get_matches_data(url, league, season)
-            for i, match_row in matches_df.iterrows():
-                if not db_client.find_matches_by_date_time_home_away(match_row['Date'], match_row['Time'],
-                                                                     match_row['Home'], match_row['Away']).empty:
-                    continue
+                players_data = await loop.run_in_executor(None, get_players_data, match_html)
+                if players_data is None:
+                    raise ValueError('Could not parse players data')
 
-                home_team_players_df, away_team_players_df = get_players_data(match_row['Match Link'])
-                db_client.persist_match(match_row)
-                db_client.persist_players(home_team_players_df, match_row['Game ID'], 1)
-                db_client.persist_players(away_team_players_df, match_row['Game ID'], 0)
+                home_team_players_df, away_team_players_df = players_data
+                db_client.persist_match_with_players(match_row, home_team_players_df, away_team_players_df)
+            except Exception as e:
+                print(f'Error in match {match_link}: {e}')
+                db_client.fail_scrape_task(task_id, e, SCRAPE_MAX_ATTEMPTS, SCRAPE_BACKOFF_SECONDS)
+                continue
 
-                print(f'Done match number: {i + 1}')
+            db_client.complete_scrape_task(task_id)
+            progress.advance()
 
-                time.sleep(5)
+    progress.finish()
 
-            print(f'Data collected for league: {league} and season: {season}')
 
+def parse_matches_page(html, league, season):
+    """ the fixtures of a schedule page, with the links to their match reports, both read from a single parse """
+    page = lxml.html.document_fromstring(html)
+    schedule_tables = page.xpath(f'//table[starts-with(@id, "{SCHEDULE_TABLE_ID_PREFIX}")]')
+    if not schedule_tables:
+        raise ValueError('No schedule table')
 
-def get_matches_data(url, league, season):
-    print('Getting matches data...')
-    tables = pd.read_html(url)
+    tables = read_tables(schedule_tables[:1])
     matches_df = arrange_matches_data(tables, league, season)
-    match_links = get_match_links(url, league)
-    add_match_links_to_match_df(match_links, matches_df)
+    match_links = index_match_links(page, league)
+    matches_df = add_match_links_to_match_df(match_links, matches_df)
     matches_df = matches_df[
         ['Game ID', 'Wk', 'Day', 'Date', 'Time', 'Home', 'xG Home', 'G Home', 'Away', 'xG Away', 'G Away', 'League', 'Season', 'Match Link', 'Score']]
 
@@ -55,30 +135,21 @@ def get_matches_data(url, league, season):
 
 
 def add_match_links_to_match_df(match_links, matches_df):
-    if matches_df.shape[0] > len(match_links):
-        raise ValueError('Not enough match links')
-
-    if matches_df.shape[0] == len(match_links):
-        matches_df['Match Link'] = match_links
-        return
-
-    for i, match_row in matches_df.iterrows():
-        row_found = False
-        match_row_indices_to_delete = []
-        for match_link in match_links:
-            match_link_details = match_link.split('/')[-1].split('-')
-            league_length = len(match_row['League'].split('-'))
-            link_date = convert_date_format('-'.join(match_link_details[-league_length - 3:-league_length]))
-            link_league = '-'.join(match_link_details[-league_length:])
-            if match_row['Date'] == link_date and match_row['League'] == link_league:
-                row_found = True
-                break
-
-        if row_found:
-            matches_df.loc[i, 'Match Link'] = match_link
-            match_links.remove(match_link)
-        else:
-            match_row_indices_to_delete.append(i)
+    """
+    Joins the fixtures to the index of match report links on (date, home, away, league). Returns the fixtures that
+    have a link, the others are reported and dropped.
+    """
+    keys = zip(matches_df['Date'], matches_df['Home'], matches_df['Away'], matches_df['League'])
+    matches_df = matches_df.assign(**{'Match Link': [match_links.get(key) for key in keys]})
+    unmatched = matches_df['Match Link'].isna()
+    if len(matches_df) > 0 and unmatched.all():
+        raise ValueError('No match links')
+
+    if unmatched.any():
+        fixtures = ', '.join(f'{date} {home} - {away}' for date, home, away in
+                             zip(*(matches_df.loc[unmatched, column] for column in ['Date', 'Home', 'Away'])))
+        print(f'Dropped {unmatched.sum()} fixtures without a match link: {fixtures}')
+    return matches_df[~unmatched]
 
 
 def arrange_matches_data(tables, league, season):
@@ -95,56 +166,75 @@ def arrange_matches_data(tables, league, season):
         matches['G Home'] < matches['G Away']
     ]
     choices = [1, 0, -1]
-    matches['Game ID'] = [random.randint(10**(10-1), (10**10)-1) for x in range(len(matches))]
     matches['Score'] = np.select(conditions, choices)
     matches['League'] = [league] * len(matches)
     matches['Season'] = [season] * len(matches)
+    matches['Game ID'] = [make_game_id(make_match_key(league, season, date, home, away))
+                          for date, home, away in zip(matches['Date'], matches['Home'], matches['Away'])]
     return matches
 
 
-def get_match_links(url, league):
-    print('Getting player data...')
-    # access and download content from url containing all fixture links    
-    match_links = []
-    html = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
-    links = soup(html.content, "html.parser").find_all('a')
+def index_match_links(page, league):
+    """
+    The match report links of a parsed schedule page by (date, home, away, league), read from the date and team cells
+    of the row of every link
+    """
+    match_links = {}
+    for link in page.iter('a'):
+        href = link.get('href', '')
+        if '/en/matches/' not in href or league not in href:
+            continue
 
-    # filter list to return only needed links
-    key_words_good = ['/en/matches/', f'{league}']
-    for l in links:
-        href = l.get('href', '')
-        if all(x in href for x in key_words_good):
-            if 'https://fbref.com' + href not in match_links:
-                match_links.append('https://fbref.com' + href)
+        row = next(link.iterancestors('tr'), None)
+        if row is None:
+            continue
+        cells = {cell.get('data-stat'): cell for cell in row}
+        if all(data_stat in cells for data_stat in ['date', 'home_team', 'away_team']):
+            key = (cell_text(cells['date']), cell_text(cells['home_team']), cell_text(cells['away_team']), league)
+            match_links.setdefault(key, FBREF_BASE_URL + href)
 
     return match_links
 
 
-def get_players_data(match_link):
-    tables = pd.read_html(match_link)
-    for table in tables:
-        try:
-            table.columns = table.columns.droplevel()
-        except Exception as e:
-            continue
+def cell_text(cell):
+    """ the text of a table cell, with its whitespace normalized like pd.read_html does """
+    return re.sub(r'[\r\n\t\xa0]+', ' ', cell.text_content()).strip()
+
+
+def get_players_data(match_html):
+    """
+    The lineups of the home and away teams of a match report, None when the page does not have them. Only the summary
+    and keeper tables of the teams are read, the home team comes first on the page.
+    """
+    page = lxml.html.document_fromstring(match_html)
+    team_ids = [match.group(1) for match in
+                (SUMMARY_TABLE_ID.fullmatch(table.get('id', '')) for table in page.iter('table')) if match]
+    if len(team_ids) != 2:
+        return None
 
     try:
-        home_team_players_df = get_team_player_data([tables[3], tables[9]])
-        away_team_players_df = get_team_player_data([tables[10], tables[16]])
+        tables = read_tables([page.get_element_by_id(table_id) for team_id in team_ids
+                              for table_id in (f'stats_{team_id}_summary', KEEPER_TABLE_ID.format(team_id=team_id))])
+        home_team_players_df = get_team_player_data(tables[:2])
+        away_team_players_df = get_team_player_data(tables[2:])
     except Exception as e:
         return None
 
     return home_team_players_df, away_team_players_df
 
 
+def read_tables(table_elements):
+    """ the tables of a parsed page as data frames, read together, with the top header row dropped """
+    html = ''.join(lxml.html.tostring(table, encoding='unicode', with_tail=False) for table in table_elements)
+    tables = pd.read_html(StringIO(html))
+    for table in tables:
+        if isinstance(table.columns, pd.MultiIndex):
+            table.columns = table.columns.droplevel()
+    return tables
+
+
 def get_team_player_data(df):
     return reduce(lambda left, right:
                   pd.merge(left, right,
                            on=['Player', 'Nation', 'Age', 'Min'], how='outer'),
                   df).iloc[:-1]
-
-
-def convert_date_format(date_str):
-    date_obj = datetime.strptime(date_str, "%B-%d-%Y")
-    new_date_str = date_obj.strftime("%Y-%m-%d")
-    return new_date_str
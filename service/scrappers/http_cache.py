@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date
+from urllib.parse import urlsplit
+
+from service.instrumentation import record_http_request, register_cache
+
+HTTP_CACHE_PATH = 'cache/http'
+CACHE_MODES = ['normal', 'replay', 'off']
+# How long pages of the running season stay fresh, pages of past seasons never expire
+CURRENT_SEASON_TTL = 6 * 60 * 60
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class HttpCache:
+    """
+    On-disk cache of downloaded pages shared by all the scrapers.
+
+    The bodies are stored compressed under the hash of their content, so identical pages are kept once, and an index
+    maps every url to its body and download time. In replay mode nothing is downloaded: every page is served from
+    disk whatever its age, and a page that was never downloaded raises CacheMissError.
+    """
+
+    def __init__(self, path=HTTP_CACHE_PATH, mode='normal'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f'Unknown cache mode: {mode}, expected one of {CACHE_MODES}')
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(path, 'blobs'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, 'index.db'), check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                 url TEXT PRIMARY KEY,
+                                 source TEXT NOT NULL,
+                                 content_hash TEXT NOT NULL,
+                                 fetched_at REAL NOT NULL
+                             )''')
+        self.conn.commit()
+
+    def get(self, url, ttl=None):
+        """ returns the cached page, None when it is missing or older than ttl seconds (None never expires) """
+        with self.lock:
+            row = self.conn.execute('SELECT content_hash, fetched_at FROM responses WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+
+        content_hash, fetched_at = row
+        if self.mode != 'replay' and ttl is not None and time.time() - fetched_at > ttl:
+            return None
+
+        with open(self._blob_path(content_hash), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def put(self, url, source, text):
+        content = text.encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(content_hash)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f'{blob_path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(content))
+            os.replace(tmp_path, blob_path)
+
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses(url, source, content_hash, fetched_at) VALUES(?,?,?,?)',
+                              (url, source, content_hash, time.time()))
+            self.conn.commit()
+
+    def lookup(self, url, ttl=None):
+        """ returns the cached page, or None when it has to be downloaded """
+        text = self.get(url, ttl) if self.mode != 'off' else None
+        with self.lock:
+            if text is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if text is None and self.mode == 'replay':
+            raise CacheMissError(f'{url} is not in the cache')
+        return text
+
+    def store(self, url, source, text):
+        if self.mode != 'off':
+            self.put(url, source, text)
+
+    def fetch(self, url, source, download, ttl=None):
+        """ returns the page from the cache, or downloads it with download(url) and caches it """
+        text = self.lookup(url, ttl)
+        if text is None:
+            start = time.perf_counter()
+            try:
+                text = download(url)
+            finally:
+                record_http_request(urlsplit(url).netloc, time.perf_counter() - start)
+            self.store(url, source, text)
+        return text
+
+    def find_urls(self, source, url_part=''):
+        """ the cached urls of the source that contain url_part """
+        with self.lock:
+            rows = self.conn.execute('SELECT url FROM responses WHERE source = ? AND instr(url, ?) > 0 ORDER BY url',
+                                     (source, url_part)).fetchall()
+        return [url for url, in rows]
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.path, 'blobs', content_hash[:2], f'{content_hash}.z')
+
+
+http_cache = None
+# The scrapers run in threads, the first ones to ask for the cache must not open one each
+http_cache_lock = threading.Lock()
+register_cache('http', lambda: (http_cache.hits, http_cache.misses) if http_cache is not None else (0, 0))
+
+
+def get_http_cache():
+    global http_cache
+    with http_cache_lock:
+        if http_cache is None:
+            http_cache = HttpCache()
+        return http_cache
+
+
+def configure_http_cache(mode='normal', path=HTTP_CACHE_PATH):
+    global http_cache
+    with http_cache_lock:
+        http_cache = HttpCache(path, mode)
+        return http_cache
+
+
+def get_current_season(today=None):
+    today = today or date.today()
+    start_year = today.year if today.month >= 7 else today.year - 1
+    return f'{start_year}-{start_year + 1}'
+
+
+def season_ttl(season):
+    return CURRENT_SEASON_TTL if season == get_current_season() else None
@@ -1,9 +1,14 @@
-import time
-import urllib
-from urllib import request
+import asyncio
+import csv
+import os
+from collections import deque
+from contextlib import aclosing, contextmanager
+from itertools import count
 
-import pandas as pd
-from bs4 import BeautifulSoup as Soup
+from bs4 import BeautifulSoup as Soup, SoupStrainer
+
+from service.scrappers.async_fetcher import AsyncFetcher
+from service.scrappers.http_cache import CURRENT_SEASON_TTL, get_http_cache
 
 COLUMN = ['ID', 'Name', 'Age', 'Position', 'Overall', 'Potential', 'Team']
 
@@ -15,68 +20,115 @@ FIFA_IDENTIFIERS = {
     'fifa_20': '200061',
     'fifa_19': '190075'
 }
+SOFIFA_URL = 'https://sofifa.com/players?r={fifa_identifier}&col=oa&sort=desc&set=true&offset={offset}'
+SOFIFA_PLAYERS_PER_PAGE = 60
+SOFIFA_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5'
+}
+# Politeness budget: one page every SOFIFA_REQUEST_INTERVAL seconds, at most SOFIFA_MAX_CONCURRENCY at once
+SOFIFA_REQUEST_INTERVAL = 0.2
+SOFIFA_MAX_CONCURRENCY = 4
+# Pages downloaded ahead of the one being parsed
+SOFIFA_PAGES_AHEAD = 8
+# Past the last page SoFIFA keeps serving players it already did: a player seen that many times ends the edition,
+# and a player is written at most SOFIFA_MAX_COPIES times
+SOFIFA_REPEATS_TO_STOP = 10
+SOFIFA_MAX_COPIES = 2
+SOFIFA_OUTPUT_PATH = 'output'
 
 
 def scrap_sofifa():
-    base_url = 'https://sofifa.com/players?r={fifa_identifier}&col=oa&sort=desc&set=true'
-    for fifa_name in FIFA_IDENTIFIERS:
-        done, fifa_df, ids_map, offset = init()
-        extended_url = base_url.format(fifa_identifier=FIFA_IDENTIFIERS[fifa_name])
-        extended_url += '&offset={offset}'
-        while True:
-            url = extended_url.format(offset=str(offset * 60))
-            players_data = get_players_data(url)
-            for player_data in players_data:
-                player_info = player_data.findAll('td')
-                id = player_info[0].find('img').get('id')
-
-                if id in ids_map:
-                    ids_map[id] += 1
-                else:
-                    ids_map[id] = 1
-
-                if ids_map[id] > 10:
-                    done = True
-                    break
-
-                if ids_map[id] > 2:
-                    continue
+    asyncio.run(scrap_sofifa_async())
 
-                player_df = create_player_df(id, player_info)
-                fifa_df = pd.concat([fifa_df, player_df], ignore_index=True)
 
-            if done:
-                break
+async def scrap_sofifa_async():
+    async with AsyncFetcher(1 / SOFIFA_REQUEST_INTERVAL, SOFIFA_MAX_CONCURRENCY, headers=SOFIFA_HEADERS,
+                            cache=get_http_cache(), source='sofifa') as fetcher:
+        for fifa_name in FIFA_IDENTIFIERS:
+            # Only the ratings of the latest edition still change
+            ttl = CURRENT_SEASON_TTL if fifa_name == max(FIFA_IDENTIFIERS) else None
+            players = await scrap_edition(fetcher, fifa_name, ttl)
+            print(f'Saved {players} players of {fifa_name}')
 
-            offset += 1
-            time.sleep(0.2)
 
-        fifa_df.to_csv(f'output/{fifa_name}_ratings.csv', index=False)
+async def scrap_edition(fetcher, fifa_name, ttl=None):
+    """
+    Streams the players of an edition to its csv: every page is parsed into tuples as soon as it arrives while the
+    next ones are downloading, and its rows are appended to the file. Returns the number of rows written.
+    """
+    loop = asyncio.get_running_loop()
+    ids_map = {}
+    players = 0
+    with open_ratings_table(f'{SOFIFA_OUTPUT_PATH}/{fifa_name}_ratings.csv') as writer:
+        async with aclosing(fetch_pages(fetcher, FIFA_IDENTIFIERS[fifa_name], ttl)) as pages:
+            async for page_html in pages:
+                rows = await loop.run_in_executor(None, parse_players_page, page_html)
+                new_rows, done = select_new_players(rows, ids_map)
+                writer.writerows(new_rows)
+                players += len(new_rows)
+                if done or not rows:
+                    break
+    return players
 
 
-def init():
-    fifa_df = pd.DataFrame(columns=COLUMN)
-    ids_map = {}
-    done = False
-    offset = 0
-    return done, fifa_df, ids_map, offset
-
-
-def get_players_data(url):
-    req = urllib.request.Request(url)
-    req.add_header('User-Agent',
-                   'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0')
-    req.add_header('Accept',
-                   'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8')
-    req.add_header('Accept-Language', 'en-US,en;q=0.5')
-    p_html = urllib.request.urlopen(req).read().decode('utf-8')
-    data = Soup(p_html, 'html.parser')
-    table = data.find('tbody')
-    trs = table.findAll('tr')
-    return trs
-
-
-def create_player_df(id, player_info):
+async def fetch_pages(fetcher, fifa_identifier, ttl=None):
+    """ yields the pages of the players list in order, keeping SOFIFA_PAGES_AHEAD downloads in flight """
+    offsets = count(0, SOFIFA_PLAYERS_PER_PAGE)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < SOFIFA_PAGES_AHEAD:
+                url = SOFIFA_URL.format(fifa_identifier=fifa_identifier, offset=next(offsets))
+                pending.append(asyncio.create_task(fetcher.fetch(url, ttl)))
+            yield await pending.popleft()
+    finally:
+        # The pages past the end are not needed, their downloads may have failed or be still running
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def select_new_players(rows, ids_map):
+    """
+    The rows to write, skipping the players already written SOFIFA_MAX_COPIES times, and whether the list wrapped
+    around. ids_map counts how many times every player was seen.
+    """
+    new_rows = []
+    for row in rows:
+        id = row[0]
+        ids_map[id] = ids_map.get(id, 0) + 1
+        if ids_map[id] > SOFIFA_REPEATS_TO_STOP:
+            return new_rows, True
+        if ids_map[id] <= SOFIFA_MAX_COPIES:
+            new_rows.append(row)
+    return new_rows, False
+
+
+@contextmanager
+def open_ratings_table(path):
+    """ a csv writer on a temporary file, which replaces path once the block completes """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = f'{path}.part'
+    with open(part_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(COLUMN)
+        yield writer
+    os.replace(part_path, path)
+
+
+def parse_players_page(p_html):
+    """ the players of a page of the list, as tuples in the order of COLUMN """
+    table = Soup(p_html, 'html.parser', parse_only=SoupStrainer('tbody')).find('tbody')
+    if table is None:
+        return []
+    return [parse_player(player_data.findAll('td')) for player_data in table.findAll('tr')]
+
+
+def parse_player(player_info):
+    # Plain strings, the tags would keep the whole page alive
+    id = player_info[0].find('img').get('id')
     name = player_info[1].contents[1].attrs['data-tippy-content']
     age = player_info[2].text
     try:
@@ -86,6 +138,4 @@ def create_player_df(id, player_info):
     overall = player_info[3].next_element.contents[0]
     potential = player_info[4].next_element.contents[0]
     team = player_info[5].contents[3].string.strip()
-    player_df = pd.DataFrame([[id, name, age, position, overall, potential, team]])
-    player_df.columns = COLUMN
-    return player_df
+    return tuple(str(value) for value in [id, name, age, position, overall, potential, team])
@@ -1,19 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from service import instrumentation
 from service.scrappers import sofifa_scraper, fbref_scraper, clubelo_scrapper
 
-MAX_RETRIES = 10
 
+def scrap_data(db_client, config):
+    """
+    Scraps the three hosts at the same time, each from its own thread and within its own rate budget, so the scrape
+    takes as long as the slowest host. ClubElo downloads the snapshots of the fixture dates while the FBref match
+    reports are downloading, and adds the ratings to the matches once FBref is done. While profiling a single thread
+    scraps the hosts one after the other, in that order.
+    """
+    fixtures_enqueued = threading.Event()
+    with ThreadPoolExecutor(max_workers=1 if instrumentation.is_profiling() else 3) as pool:
+        sofifa = pool.submit(scrap_sofifa)
+        fbref = pool.submit(run_with_own_connection, scrap_fbref, db_client, config, fixtures_enqueued)
+        clubelo = pool.submit(run_with_own_connection, scrap_clubelo, db_client, fixtures_enqueued, fbref)
 
-def scrap_data(db_client):
-    sofifa_scraper.scrap_sofifa()
-    scrap_fbref_with_retries(db_client, 0)
-    clubelo_scrapper.scrap_clubelo_to_database(db_client)
+    for future in [sofifa, fbref, clubelo]:
+        future.result()
 
 
-def scrap_fbref_with_retries(db_client, retries):
+def run_with_own_connection(scrap, db_client, *args):
+    worker_db_client = db_client.clone()
     try:
-        fbref_scraper.scrap_fbref(db_client)
-    except Exception as e:
-        print(f'Error: {e}')
-        retries += 1
-        if retries < MAX_RETRIES:
-            scrap_fbref_with_retries(db_client, retries)
\ No newline at end of file
+        scrap(worker_db_client, *args)
+    finally:
+        worker_db_client.close()
+
+
+def scrap_sofifa():
+    with instrumentation.stage('sofifa'):
+        sofifa_scraper.scrap_sofifa()
+
+
+def scrap_fbref(db_client, config, fixtures_enqueued):
+    try:
+        with instrumentation.stage('fbref'):
+            fbref_scraper.scrap_fbref(db_client, config.leagues, config.seasons, on_enqueued=fixtures_enqueued.set)
+    finally:
+        # ClubElo would wait forever if FBref failed before enqueueing
+        fixtures_enqueued.set()
+
+
+def scrap_clubelo(db_client, fixtures_enqueued, fbref):
+    fixtures_enqueued.wait()
+    with instrumentation.stage('clubelo'):
+        clubelo_scrapper.prefetch_elo_snapshots(db_client)
+
+    # The ratings go to the matches FBref persisted
+    if fbref.exception() is None:
+        with instrumentation.stage('clubelo_ratings'):
+            clubelo_scrapper.scrap_clubelo_to_database(db_client)
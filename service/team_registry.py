@@ -0,0 +1,116 @@
+import hashlib
+
+from fuzzywuzzy import process
+
+FUZZY_MATCH_THRESHOLD = 80
+
+# FBref name -> the name of the same team in every other source, where fuzzy matching gets it wrong
+SPECIAL_TEAM_NAMES = {
+    'clubelo': {
+        "Arminia": "Bielefeld",
+        "Athletic Club": "Bilbao",
+        "Atlético Madrid": "Atletico",
+        "Greuther Fürth": "Fuerth",
+        "Köln": "Koeln",
+        "Manchester Utd": "Man United"
+    },
+    'spi': {
+        'Saint-Étienne': 'St Etienne',
+        'Köln': "FC Cologne",
+        'Hertha BSC': 'Hertha Berlin',
+        'Athletic Club': 'Athletic Bilbao',
+        'Inter': 'Internazionale',
+        'Wolves': 'Wolverhampton'
+    },
+    'football-data': {
+        'Arminia': 'Bielefeld',
+        'Athletic Club': 'Ath Bilbao',
+        'Atlético Madrid': 'Ath Madrid',
+        'Düsseldorf': 'Fortuna Dusseldorf',
+        'Köln': 'FC Koln',
+        'Manchester Utd': 'Man United'
+    }
+}
+
+
+class TeamRegistry:
+    """
+    Canonical teams, named as on FBref, and the name every other source (clubelo, spi, football-data) uses for them.
+
+    A name is fuzzy matched against a source only the first time it is seen, the match is persisted so every later
+    lookup, in this run or the next ones, is a dictionary lookup. A miss is persisted with a hash of the names it was
+    matched against, so the name is matched again once the source has other names.
+    """
+
+    def __init__(self, db_client):
+        self.db_client = db_client
+        self.team_ids = {name: team_id for team_id, name in db_client.find_teams()}
+        self.aliases = {}
+        self.team_ids_by_alias = {}
+        # (source, team id, candidates hash) of the teams none of the given names of the source matched
+        self.unmatched = set(db_client.find_team_alias_misses())
+        for source, alias, team_id in db_client.find_team_aliases():
+            self.aliases.setdefault((source, team_id), alias)
+            self.team_ids_by_alias[(source, alias)] = team_id
+
+        for source, special_names in SPECIAL_TEAM_NAMES.items():
+            for name, alias in special_names.items():
+                if (source, self.get_team_id(name)) not in self.aliases:
+                    self.add_alias(source, alias, self.get_team_id(name))
+
+    def get_team_id(self, name):
+        if name not in self.team_ids:
+            self.team_ids[name] = self.db_client.persist_team(name)
+        return self.team_ids[name]
+
+    def find_team_id_by_alias(self, source, alias):
+        return self.team_ids_by_alias.get((source, alias))
+
+    def add_alias(self, source, alias, team_id):
+        self.db_client.persist_team_alias(source, alias, team_id)
+        self.aliases.setdefault((source, team_id), alias)
+        self.team_ids_by_alias.setdefault((source, alias), team_id)
+
+    def match_team_name(self, name, source, candidates):
+        """ the name the source uses for the team, None when none of the candidates is close enough """
+        team_id = self.get_team_id(name)
+        if (source, team_id) in self.aliases:
+            return self.aliases[(source, team_id)]
+        if len(candidates) == 0:
+            return None
+        miss = (source, team_id, hash_candidates(candidates))
+        if miss in self.unmatched:
+            return None
+
+        match, score = process.extractOne(name, candidates)
+        if score > FUZZY_MATCH_THRESHOLD:
+            self.add_alias(source, match, team_id)
+            return match
+
+        self.db_client.persist_team_alias_miss(*miss)
+        self.unmatched.add(miss)
+        return None
+
+    def resolve_team_ids(self, names, source, candidates):
+        """
+        Resolves every distinct name once against the names the source uses. Returns the team id of every resolved
+        name, the team id of every candidate that is the alias of a team, and the names that were not resolved. A
+        name and the candidate it resolves to get the same id, so frames of both sides can be merged on it.
+        """
+        team_ids = {}
+        unmatched_names = []
+        for name in names:
+            alias = self.match_team_name(name, source, candidates)
+            if alias is None:
+                unmatched_names.append(name)
+            else:
+                team_ids[name] = self.find_team_id_by_alias(source, alias)
+
+        candidate_ids = {candidate: self.find_team_id_by_alias(source, candidate) for candidate in candidates}
+        candidate_ids = {candidate: team_id for candidate, team_id in candidate_ids.items() if team_id is not None}
+        return team_ids, candidate_ids, unmatched_names
+
+
+def hash_candidates(candidates):
+    """ the same for the same names in any order """
+    return hashlib.sha256('\n'.join(sorted(set(candidates))).encode('utf-8')).hexdigest()
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+TEAMS = ['Arsenal', 'Chelsea', 'Everton', 'Fulham', 'Leeds']
+
+
+def generate_matches(teams=TEAMS, match_count=150, seed=0):
+    """
+    Played matches of the teams in date order, three days apart, with their goals and xG. The pairings come in a
+    shuffled order, so every team plays about 2 * match_count / len(teams) matches.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = [(home, away) for home in teams for away in teams if home != away]
+    homes, aways = zip(*[pairs[i % len(pairs)] for i in rng.permutation(match_count)])
+    return pd.DataFrame({
+        'Game ID': np.arange(match_count) + 1000,
+        'Date': [(pd.Timestamp('2023-08-01') + pd.Timedelta(days=3 * i)).strftime('%Y-%m-%d')
+                 for i in range(match_count)],
+        'Time': '15:00',
+        'Home': homes,
+        'Away': aways,
+        'G Home': rng.integers(0, 5, match_count),
+        'G Away': rng.integers(0, 4, match_count),
+        'xG Home': rng.uniform(0, 3, match_count).round(1),
+        'xG Away': rng.uniform(0, 3, match_count).round(1),
+    })
+
+
+@pytest.fixture(scope='session')
+def make_matches():
+    """ generate_matches, a new frame on every call """
+    return generate_matches
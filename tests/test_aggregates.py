@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from db.datamodels.match import MATCH_DTYPES, apply_dtypes
+from service.data_organizer import AGGREGATE_WINDOW, AGGREGATED_COLUMNS, FORM_WINDOW, add_aggregated_data
+
+MATCH_COUNT = 150
+
+
+@pytest.fixture
+def matches_df(make_matches):
+    """ every team plays more than AGGREGATE_WINDOW matches, some xG values are missing """
+    matches_df = make_matches(match_count=MATCH_COUNT)
+    matches_df.loc[[3, 17, 90], 'xG Home'] = np.nan
+    matches_df.loc[[40], 'xG Away'] = np.nan
+    return matches_df
+
+
+def add_aggregated_data_per_row(matches_df):
+    """ the aggregates as the original loop computed them, one match at a time from per-team lists """
+    def calculate_avg(values, n=AGGREGATE_WINDOW):
+        return sum(values[-n:]) / len(values[-n:]) if values else 0
+
+    teams = pd.unique(matches_df[['Home', 'Away']].to_numpy().ravel())
+    history = {team: {'points': [], 'goals_for': [], 'goals_against': [], 'xg_diff': []} for team in teams}
+    head_to_head = {(home, away): {'points': [], 'goals_for': [], 'goals_against': []}
+                    for home in teams for away in teams}
+    rows = []
+    for match in matches_df.to_dict('records'):
+        home_points, away_points = (3, 0) if match['G Home'] > match['G Away'] else \
+            (0, 3) if match['G Home'] < match['G Away'] else (1, 1)
+        row = {'Home Points': home_points, 'Away Points': away_points,
+               'xG Home Diff': match['G Home'] - match['xG Home'], 'xG Away Diff': match['G Away'] - match['xG Away']}
+        for side, team, opponent in [('Home', match['Home'], match['Away']), ('Away', match['Away'], match['Home'])]:
+            team_history, pair_history = history[team], head_to_head[(team, opponent)]
+            row[f'{side} Avg Points'] = calculate_avg(team_history['points'])
+            row[f'{side} Avg Goals For'] = calculate_avg(team_history['goals_for'])
+            row[f'{side} Avg Goals Against'] = calculate_avg(team_history['goals_against'])
+            row[f'{side} Matches Played'] = len(team_history['points'])
+            row[f'xG {side} Avg Diff'] = calculate_avg(team_history['xg_diff'])
+            row[f'{side} Points/Match'] = calculate_avg(team_history['points'], len(team_history['points']))
+            row[f'{side} Form Points'] = calculate_avg(team_history['points'], FORM_WINDOW)
+            row[f'{side} Form Goals For'] = calculate_avg(team_history['goals_for'], FORM_WINDOW)
+            row[f'{side} Form Goals Against'] = calculate_avg(team_history['goals_against'], FORM_WINDOW)
+            row[f'xG {side} Form Diff'] = calculate_avg(team_history['xg_diff'], FORM_WINDOW)
+            row[f'{side} Head-to-Head Points'] = calculate_avg(pair_history['points'], FORM_WINDOW)
+            row[f'{side} Head-to-Head Goals For'] = calculate_avg(pair_history['goals_for'], FORM_WINDOW)
+            row[f'{side} Head-to-Head Goals Against'] = calculate_avg(pair_history['goals_against'], FORM_WINDOW)
+
+        for side, team, opponent, goals_for, goals_against in [
+                ('Home', match['Home'], match['Away'], match['G Home'], match['G Away']),
+                ('Away', match['Away'], match['Home'], match['G Away'], match['G Home'])]:
+            for stats in [history[team], head_to_head[(team, opponent)]]:
+                stats['points'].append(row[f'{side} Points'])
+                stats['goals_for'].append(goals_for)
+                stats['goals_against'].append(goals_against)
+            history[team]['xg_diff'].append(row[f'xG {side} Diff'])
+        rows.append(row)
+
+    return pd.DataFrame(rows, index=matches_df.index)
+
+
+def test_grouped_aggregates_match_the_per_row_loop(matches_df):
+    expected_df = add_aggregated_data_per_row(matches_df)
+
+    add_aggregated_data(matches_df)
+
+    # A missing xG makes the xG aggregates missing for as long as it stays in the window
+    assert expected_df['xG Home Form Diff'].isna().any()
+    pd.testing.assert_frame_equal(matches_df[expected_df.columns], expected_df, check_dtype=False)
+
+
+@pytest.mark.parametrize('split', [1, 60, MATCH_COUNT - 1])
+def test_new_matches_continue_the_team_history(matches_df, split):
+    full_df = matches_df.copy()
+    add_aggregated_data(full_df)
+    aggregated_columns = full_df.columns.difference(matches_df.columns)
+
+    old_df, new_df = matches_df.iloc[:split].copy(), matches_df.iloc[split:].reset_index(drop=True)
+    team_history_df = add_aggregated_data(old_df)
+    add_aggregated_data(new_df, team_history_df)
+
+    pd.testing.assert_frame_equal(new_df[aggregated_columns],
+                                  full_df[aggregated_columns].iloc[split:].reset_index(drop=True), check_dtype=False)
+
+
+def test_a_match_not_played_yet_has_missing_goals(matches_df):
+    played_df = matches_df.copy()
+    add_aggregated_data(played_df)
+    # As the matches table gives it, the goals of the last match are NULL
+    apply_dtypes(matches_df, MATCH_DTYPES)
+    matches_df.loc[MATCH_COUNT - 1, ['G Home', 'G Away']] = pd.NA
+
+    add_aggregated_data(matches_df)
+
+    # Only what happened before kick-off goes into the aggregates of a match
+    pd.testing.assert_frame_equal(matches_df[AGGREGATED_COLUMNS[4:]], played_df[AGGREGATED_COLUMNS[4:]],
+                                  check_dtype=False)
+    last_match = matches_df.iloc[-1]
+    assert (last_match['Home Points'], last_match['Away Points']) == (1, 1)
+    assert last_match[['xG Home Diff', 'xG Away Diff']].isna().all()
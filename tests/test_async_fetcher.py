@@ -0,0 +1,196 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from db import sqlite_client
+from service.scrappers import fbref_scraper, http_cache
+from service.scrappers.async_fetcher import AsyncFetcher
+from service.scrappers.http_cache import HttpCache
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'fbref')
+REPORT_IDS = ['66ff789c', 'f34fe234', '1565b591b']
+REQUESTS = web.AppKey('requests', list)
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_PATH, f'{name}.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+def make_app(delays=None):
+    """
+    FBref served from the saved pages: the schedule of a season and the reports of its matches, a report that is not
+    saved is a 404. delays holds the seconds a report takes to answer, every request is logged in app[REQUESTS].
+    """
+    delays = delays or {}
+
+    async def schedule(request):
+        request.app[REQUESTS].append((time.monotonic(), request.path))
+        return web.Response(text=read_fixture('schedule'), content_type='text/html')
+
+    async def match_report(request):
+        request.app[REQUESTS].append((time.monotonic(), request.path))
+        report_id = request.match_info['report_id']
+        if report_id not in REPORT_IDS:
+            raise web.HTTPNotFound()
+        await asyncio.sleep(delays.get(report_id, 0))
+        return web.Response(text=read_fixture(report_id), content_type='text/html')
+
+    app = web.Application()
+    app[REQUESTS] = []
+    app.router.add_get('/en/comps/{league_id}/{season}/schedule/{slug}', schedule)
+    app.router.add_get('/en/matches/{report_id}/{slug}', match_report)
+    return app
+
+
+def report_url(server, report_id):
+    return str(server.make_url(f'/en/matches/{report_id}/Match-Report'))
+
+
+def test_fetch_all_yields_the_pages_as_they_finish():
+    async def scenario():
+        async with TestServer(make_app({'66ff789c': 0.4, 'f34fe234': 0, '1565b591b': 0.2})) as server:
+            urls = [report_url(server, report_id) for report_id in REPORT_IDS]
+            async with AsyncFetcher(100, max_concurrency_per_host=3, burst=3) as fetcher:
+                return urls, [pair async for pair in fetcher.fetch_all(urls)]
+
+    urls, pages = asyncio.run(scenario())
+
+    assert [url for url, _ in pages] == [urls[1], urls[2], urls[0]]
+    assert all(html == read_fixture(url.split('/')[-2]) for url, html in pages)
+
+
+def test_requests_follow_the_rate_limit():
+    requests_per_second = 20
+
+    async def scenario():
+        app = make_app()
+        async with TestServer(app) as server:
+            urls = [report_url(server, report_id) for report_id in REPORT_IDS * 2]
+            async with AsyncFetcher(requests_per_second, max_concurrency_per_host=4) as fetcher:
+                await asyncio.gather(*(fetcher.fetch(url) for url in urls))
+        return [requested_at for requested_at, _ in app[REQUESTS]]
+
+    requested_at = asyncio.run(scenario())
+
+    gaps = [later - earlier for earlier, later in zip(requested_at, requested_at[1:])]
+    assert len(requested_at) == 6
+    # The server sees every request a little after the bucket lets it go, opening a connection delays some of them
+    assert min(gaps) >= 0.5 / requests_per_second
+    assert requested_at[-1] - requested_at[0] >= 0.9 * 5 / requests_per_second
+
+
+def test_fetch_all_returns_the_failed_downloads():
+    async def scenario(return_exceptions):
+        async with TestServer(make_app()) as server:
+            urls = [report_url(server, 'ffffffff'), report_url(server, REPORT_IDS[0])]
+            async with AsyncFetcher(100, burst=2) as fetcher:
+                return urls, {url: html async for url, html in fetcher.fetch_all(urls, return_exceptions)}
+
+    urls, pages = asyncio.run(scenario(return_exceptions=True))
+
+    assert isinstance(pages[urls[0]], aiohttp.ClientResponseError)
+    assert pages[urls[0]].status == 404
+    assert pages[urls[1]] == read_fixture(REPORT_IDS[0])
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(scenario(return_exceptions=False))
+
+
+def test_cached_pages_skip_the_network_and_the_rate_limit(tmp_path):
+    cache = HttpCache(str(tmp_path / 'http'))
+
+    async def scenario():
+        app = make_app()
+        async with TestServer(app) as server:
+            url = report_url(server, REPORT_IDS[0])
+            # One request every 10 seconds, a second download would make the test wait
+            async with AsyncFetcher(0.1, cache=cache, source='fbref') as fetcher:
+                first = await fetcher.fetch(url)
+                start = time.monotonic()
+                second = await fetcher.fetch(url)
+                elapsed = time.monotonic() - start
+        return first, second, elapsed, len(app[REQUESTS])
+
+    first, second, elapsed, request_count = asyncio.run(scenario())
+
+    assert first == second == read_fixture(REPORT_IDS[0])
+    assert request_count == 1
+    assert elapsed < 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+
+def test_threads_share_one_http_cache(tmp_path, monkeypatch):
+    opened = []
+
+    def slow_http_cache():
+        opened.append(threading.get_ident())
+        # Opening the index takes a while, long enough for the other threads to ask for the cache meanwhile
+        time.sleep(0.1)
+        return HttpCache(str(tmp_path / 'http'))
+
+    monkeypatch.setattr(http_cache, 'http_cache', None)
+    monkeypatch.setattr(http_cache, 'HttpCache', slow_http_cache)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        caches = list(pool.map(lambda _: http_cache.get_http_cache(), range(4)))
+
+    assert len(opened) == 1
+    assert all(cache is caches[0] for cache in caches)
+
+def test_scrap_fbref_reads_the_saved_season(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_client, 'DB_NAME', str(tmp_path / 'matches.db'))
+    db_client = sqlite_client.SQLiteClient()
+    cache = HttpCache(str(tmp_path / 'http'))
+
+    async def scenario():
+        app = make_app()
+        async with TestServer(app) as server:
+            monkeypatch.setattr(fbref_scraper, 'FBREF_BASE_URL', str(server.make_url('')).rstrip('/'))
+            async with AsyncFetcher(100, burst=3, cache=cache, source='fbref') as fetcher:
+                await fbref_scraper.enqueue_season(db_client, fetcher, 'League-1', 9, '2019-2020')
+                await fbref_scraper.scrap_match_reports(db_client, fetcher)
+        return [path for _, path in app[REQUESTS]]
+
+    paths = asyncio.run(scenario())
+
+    assert paths[0] == '/en/comps/9/2019-2020/schedule/2019-2020-League-1-Scores-and-Fixtures'
+    assert sorted(path.split('/')[3] for path in paths[1:]) == sorted(REPORT_IDS)
+    matches_df = db_client.find_all_matches()
+    assert len(matches_df) == 3
+    assert set(matches_df['Season']) == {'2019-2020'}
+    assert len(db_client.find_players_by_match_ids(matches_df['Game ID'])) == 3 * 2 * 14
+    db_client.close()
+
+
+def test_reports_that_failed_in_an_earlier_run_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_client, 'DB_NAME', str(tmp_path / 'matches.db'))
+    db_client = sqlite_client.SQLiteClient()
+
+    async def scenario():
+        async with TestServer(make_app()) as server:
+            monkeypatch.setattr(fbref_scraper, 'FBREF_BASE_URL', str(server.make_url('')).rstrip('/'))
+            async with AsyncFetcher(100, burst=3) as fetcher:
+                await fbref_scraper.enqueue_season(db_client, fetcher, 'League-1', 9, '2019-2020')
+                for task_id, _ in db_client.claim_scrape_tasks(1):
+                    db_client.fail_scrape_task(task_id, 'Connection reset', max_attempts=1, backoff_seconds=3600)
+                await fbref_scraper.scrap_match_reports(db_client, fetcher)
+                matches_before_retry = len(db_client.find_all_matches())
+
+                retried_count = db_client.retry_failed_scrape_tasks()
+                await fbref_scraper.scrap_match_reports(db_client, fetcher)
+        return matches_before_retry, retried_count
+
+    matches_before_retry, retried_count = asyncio.run(scenario())
+
+    assert (matches_before_retry, retried_count) == (2, 1)
+    assert len(db_client.find_all_matches()) == 3
+    assert db_client.retry_failed_scrape_tasks() == 0
+    db_client.close()
@@ -0,0 +1,69 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from db import sqlite_client
+from service import instrumentation
+from service.pipeline import Stage, run_stages
+from service.team_registry import TeamRegistry
+
+SPI_TEAMS = ['Arsenal FC', 'Chelsea FC', 'Everton FC']
+
+
+@pytest.fixture
+def db_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_client, 'DB_NAME', str(tmp_path / 'matches.db'))
+    db_client = sqlite_client.SQLiteClient()
+    yield db_client
+    db_client.close()
+
+
+def make_spi_stage(runs):
+    """ a stage naming the home teams as SPI does, every run is counted in runs """
+    def run(matches_df, db_client):
+        runs.append(matches_df['Home'].tolist())
+        team_registry = TeamRegistry(db_client)
+        matches_df['SPI Home'] = [team_registry.match_team_name(name, 'spi', SPI_TEAMS) for name in matches_df['Home']]
+
+    return Stage('spi', run, ['Home'], ['SPI Home'], [],
+                 fingerprint=lambda db_client: db_client.find_team_aliases_by_source('spi'))
+
+
+def test_a_stage_runs_again_when_the_team_aliases_of_its_source_change(db_client, tmp_path):
+    matches_df = pd.DataFrame({'Home': ['Arsenal', 'Chelsea']})
+    runs = []
+
+    def run_spi_stage():
+        run_stages(matches_df, [make_spi_stage(runs)], db_client, cache_path=str(tmp_path / 'stages'))
+        return matches_df['SPI Home'].tolist()
+
+    # The first run matches the names and persists them, the second one reads the output it cached
+    assert run_spi_stage() == run_spi_stage() == SPI_TEAMS[:2]
+    assert len(runs) == 1
+
+    team_registry = TeamRegistry(db_client)
+    team_registry.add_alias('spi', 'Everton FC', team_registry.get_team_id('Everton'))
+    run_spi_stage()
+    assert len(runs) == 2
+
+
+def test_profiled_stages_run_one_after_the_other(db_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'instrumentation', None)
+    measurements = instrumentation.configure_instrumentation(profile_stages=['all'], profiles_path=str(tmp_path))
+    threads = []
+
+    def make_stage(name):
+        def run(matches_df, db_client):
+            threads.append(threading.get_ident())
+            matches_df[name] = matches_df['Home'].str.upper()
+
+        return Stage(name, run, ['Home'], [name], [])
+
+    matches_df = pd.DataFrame({'Home': ['Arsenal', 'Chelsea']})
+    run_stages(matches_df, [make_stage('first'), make_stage('second')], db_client, cache_path=str(tmp_path / 'stages'))
+
+    assert threads == [threading.get_ident()] * 2
+    stages = measurements.report()['stages']
+    assert [stage['name'] for stage in stages] == ['first', 'second']
+    assert all(stage['profile'] and not stage['concurrent_with'] for stage in stages)
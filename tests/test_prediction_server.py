@@ -0,0 +1,152 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from service.data_organizer import BETS_ODDS_COLUMNS, add_aggregated_data, calculate_xscore
+from service.features import add_features
+from service.fifa_index import FifaNameIndex
+from service.prediction import MODEL_FEATURES, ODDS_FEATURES, Predictor, build_fixture_features, train_model
+from service.prediction_server import make_prediction_server
+
+TEAMS = ['Arsenal', 'Chelsea', 'Everton', 'Fulham']
+MATCH_COUNT = 60
+# The matches the bookmaker has no odds for
+MISSING_ODDS = [2, 7, 30]
+
+
+def add_model_features(matches_df, seed=0):
+    """ the Elo, players and odds features of the model, random but consistent with each other, some odds missing """
+    rng = np.random.default_rng(seed)
+    match_count = len(matches_df)
+    matches_df['home_elo'] = rng.uniform(1500, 1900, match_count)
+    matches_df['away_elo'] = rng.uniform(1500, 1900, match_count)
+    matches_df['Home Avg Players Score'] = rng.uniform(65, 80, match_count)
+    matches_df['Away Avg Players Score'] = rng.uniform(65, 80, match_count)
+    matches_df['Home Star Player Count'] = rng.integers(0, 4, match_count)
+    matches_df['Away Star Player Count'] = rng.integers(0, 4, match_count)
+    for column in BETS_ODDS_COLUMNS:
+        matches_df[column] = rng.uniform(1.5, 5, match_count).round(2)
+    matches_df.loc[MISSING_ODDS, BETS_ODDS_COLUMNS] = np.nan
+    matches_df['xScore'] = calculate_xscore(matches_df[BETS_ODDS_COLUMNS].to_numpy())
+    matches_df['Score'] = np.sign(matches_df['G Home'] - matches_df['G Away'])
+    add_features(matches_df, ['xScoreElo', 'xPower', 'xSuperPower'])
+    return matches_df
+
+
+def make_predictor(matches_df, model_bundle=None):
+    """ a Predictor of the teams of the matches, with a model trained on them unless model_bundle is given """
+    matches_df = matches_df.copy()
+    team_history_df = add_aggregated_data(matches_df)
+    fifa_df = pd.DataFrame({'Name': [f'Player {team} {i}' for team in TEAMS for i in range(11)],
+                            'Overall': np.resize([70, 78, 86, 91], 11 * len(TEAMS))})
+    lineups_by_team = {team: [f'Player {team} {i}' for i in range(11)] for team in TEAMS}
+    elo_by_team = {team: 1600 + 50 * i for i, team in enumerate(TEAMS)}
+    return Predictor(model_bundle or train_model(matches_df), team_history_df, elo_by_team, lineups_by_team,
+                     {'fifa_23': FifaNameIndex(fifa_df)})
+
+
+@pytest.fixture(scope='module')
+def matches_df(make_matches):
+    return add_model_features(make_matches(TEAMS, MATCH_COUNT))
+
+
+@pytest.fixture(scope='module')
+def predictor(matches_df):
+    return make_predictor(matches_df)
+
+
+@pytest.fixture(scope='module')
+def server_url(predictor):
+    server = make_prediction_server(predictor, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def request_json(url, body=None):
+    """ (status, json body) of a GET, or of a POST when body is given """
+    data = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_model_features_are_known_before_kick_off():
+    assert not {'Home Points', 'Away Points', 'xG Home Diff', 'xG Away Diff', 'Score'} & set(MODEL_FEATURES)
+    assert {'Home Matches Played', 'xG Away Form Diff', 'Away Head-to-Head Goals Against'} <= set(MODEL_FEATURES)
+
+
+def test_health_describes_the_model(server_url, predictor):
+    status, body = request_json(f'{server_url}/health')
+
+    assert status == 200
+    assert body['status'] == 'ok'
+    assert body['matches'] == predictor.model_bundle['matches'] == MATCH_COUNT - len(MISSING_ODDS)
+    assert body['fallback_matches'] == predictor.model_bundle['fallback_matches'] == MATCH_COUNT
+    assert body['last_match_date'] == predictor.model_bundle['last_match_date']
+
+
+def test_predict_answers_every_fixture_in_order(server_url, predictor):
+    fixtures = [
+        {'Date': '2024-02-10', 'Home': 'Arsenal', 'Away': 'Fulham'},
+        {'Date': '2024-02-10', 'Home': 'Everton', 'Away': 'Chelsea', 'B365H': 2.5, 'B365D': 3.1, 'B365A': 2.9},
+        {'Date': '2024-02-11', 'Home': 'Promoted FC', 'Away': 'Arsenal'},
+    ]
+
+    status, body = request_json(f'{server_url}/predict', {'fixtures': fixtures})
+
+    assert status == 200
+    predictions_df = pd.DataFrame(body['predictions'])
+    assert predictions_df[['Home', 'Away']].values.tolist() == [[f['Home'], f['Away']] for f in fixtures]
+    assert set(predictions_df['Prediction']) <= {'home', 'draw', 'away'}
+    np.testing.assert_allclose(predictions_df[['Prob Home', 'Prob Draw', 'Prob Away']].sum(axis=1), 1, atol=1e-3)
+    pd.testing.assert_frame_equal(predictions_df, predictor.predict(pd.DataFrame(fixtures)), check_dtype=False)
+
+
+def test_fixtures_without_odds_are_predicted_without_them(predictor):
+    fixtures_df = pd.DataFrame([
+        {'Date': '2024-02-10', 'Home': 'Everton', 'Away': 'Chelsea'},
+        {'Date': '2024-02-10', 'Home': 'Everton', 'Away': 'Chelsea', 'B365H': 2.5, 'B365D': 3.1, 'B365A': 2.9},
+    ])
+    model_bundle = predictor.model_bundle
+
+    predictions_df = predictor.predict(fixtures_df)
+
+    assert not set(model_bundle['fallback_features']) & set(ODDS_FEATURES)
+    features_df = build_fixture_features(predictor, fixtures_df)
+    for i, model, features in [(0, model_bundle['fallback_model'], model_bundle['fallback_features']),
+                               (1, model_bundle['model'], model_bundle['features'])]:
+        probabilities = model.predict_proba(features_df.loc[[i], features].to_numpy(dtype=float))[0]
+        expected = [probabilities[list(model.classes_).index(outcome)] for outcome in [1, 0, -1]]
+        np.testing.assert_allclose(predictions_df.loc[i, ['Prob Home', 'Prob Draw', 'Prob Away']].to_numpy(dtype=float),
+                                   expected, atol=1e-4)
+
+
+def test_a_model_without_fallback_rejects_fixtures_without_odds(matches_df, predictor):
+    # As saved before the fallback model existed
+    model_bundle = {key: value for key, value in predictor.model_bundle.items() if not key.startswith('fallback')}
+    old_predictor = make_predictor(matches_df, model_bundle)
+
+    with pytest.raises(ValueError):
+        old_predictor.predict(pd.DataFrame([{'Date': '2024-02-10', 'Home': 'Everton', 'Away': 'Chelsea'}]))
+
+
+@pytest.mark.parametrize('body', [
+    {'fixtures': [{'Date': '2024-02-10', 'Home': 'Arsenal'}]},
+    {'matches': []},
+    b'not json',
+])
+def test_predict_rejects_bad_requests(server_url, body):
+    status, response = request_json(f'{server_url}/predict', body)
+
+    assert status == 400
+    assert response['error']
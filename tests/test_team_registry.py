@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from db import sqlite_client
+from service import team_registry
+from service.team_registry import TeamRegistry
+
+ELO_CLUBS = ['Arsenal', 'Chelsea', 'Everton']
+
+
+@pytest.fixture
+def db_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_client, 'DB_NAME', str(tmp_path / 'matches.db'))
+    db_client = sqlite_client.SQLiteClient()
+    yield db_client
+    db_client.close()
+
+
+@pytest.fixture
+def fuzzy_matches(monkeypatch):
+    """ the names fuzzy matched, in order """
+    names = []
+    extract_one = team_registry.process.extractOne
+
+    def counting_extract_one(name, candidates):
+        names.append(name)
+        return extract_one(name, candidates)
+
+    monkeypatch.setattr(team_registry.process, 'extractOne', counting_extract_one)
+    return names
+
+
+def test_a_miss_is_matched_again_only_against_other_names(db_client, fuzzy_matches):
+    assert TeamRegistry(db_client).match_team_name('Leeds United', 'clubelo', ELO_CLUBS) is None
+    assert TeamRegistry(db_client).match_team_name('Leeds United', 'clubelo', list(reversed(ELO_CLUBS))) is None
+    assert fuzzy_matches == ['Leeds United']
+
+    assert TeamRegistry(db_client).match_team_name('Leeds United', 'clubelo', ELO_CLUBS + ['Leeds']) == 'Leeds'
+    assert TeamRegistry(db_client).match_team_name('Leeds United', 'clubelo', ELO_CLUBS) == 'Leeds'
+    assert fuzzy_matches == ['Leeds United', 'Leeds United']
+
+
+def test_null_aliases_are_dropped_from_old_databases(tmp_path, monkeypatch):
+    path = str(tmp_path / 'matches.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE teams (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE team_aliases (source TEXT NOT NULL, alias TEXT, team_id INTEGER NOT NULL REFERENCES teams (id),
+                                   UNIQUE (source, alias));
+        INSERT INTO teams(id, name) VALUES (1, 'Arsenal'), (2, 'Leeds United');
+        INSERT INTO team_aliases(source, alias, team_id) VALUES ('clubelo', 'Arsenal', 1), ('clubelo', NULL, 2),
+                                                                ('clubelo', NULL, 2);
+    ''')
+    conn.close()
+    monkeypatch.setattr(sqlite_client, 'DB_NAME', path)
+
+    db_client = sqlite_client.SQLiteClient()
+
+    assert db_client.find_team_aliases() == [('clubelo', 'Arsenal', 1)]
+    assert TeamRegistry(db_client).match_team_name('Leeds United', 'clubelo', ELO_CLUBS + ['Leeds']) == 'Leeds'
+    db_client.close()